@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+Check that the capture-only launch profile exports the same markdown
+
+Loads the first chapters of a book with the default and the capture-only
+profile, compares the markdown of every chapter and reports load times.
+Needs chrome and network access:
+    python benchmarks/bench_capture.py -b $book_id --chapters 5 --headless
+"""
+
+import argparse
+import asyncio
+import difflib
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from weread_exporter import webpage
+
+
+async def load_chapters(book_id, chapter_count, capture_only, headless):
+    page = webpage.WeReadWebPage(
+        book_id,
+        cookie_path=os.path.join("cache", "cookie.txt"),
+        webcache_path="cache",
+    )
+    book_info = await page.get_book_info()
+    await page.launch(headless=headless, capture_only=capture_only)
+    result = []
+    try:
+        for chapter in book_info["chapters"][:chapter_count]:
+            time0 = time.time()
+            await page.goto_chapter(chapter["id"], url=chapter.get("url"))
+            markdown = await page.get_markdown()
+            result.append(
+                {
+                    "id": chapter["id"],
+                    "seconds": time.time() - time0,
+                    "markdown": markdown,
+                    "requests": page.get_request_stats(),
+                }
+            )
+    finally:
+        await page.close()
+    return result
+
+
+async def async_main():
+    parser = argparse.ArgumentParser(description="Capture-only profile parity check")
+    parser.add_argument("-b", "--book-id", help="book id", required=True)
+    parser.add_argument("--chapters", help="chapters to compare", type=int, default=5)
+    parser.add_argument("--headless", action="store_true", default=False)
+    args = parser.parse_args()
+    full = await load_chapters(args.book_id, args.chapters, False, args.headless)
+    capture = await load_chapters(args.book_id, args.chapters, True, args.headless)
+
+    mismatches = []
+    for it, other in zip(full, capture):
+        if it["markdown"] != other["markdown"]:
+            mismatches.append(it["id"])
+            sys.stderr.writelines(
+                difflib.unified_diff(
+                    it["markdown"].splitlines(True),
+                    other["markdown"].splitlines(True),
+                    "chapter-%s-full.md" % it["id"],
+                    "chapter-%s-capture.md" % it["id"],
+                )
+            )
+    result = {}
+    for mode, chapters in (("full", full), ("capture_only", capture)):
+        result[mode] = {
+            "seconds": [it["seconds"] for it in chapters],
+            "total": sum(it["seconds"] for it in chapters),
+            "requests": [it["requests"]["total"] for it in chapters],
+        }
+    result["mismatches"] = mismatches
+    print(json.dumps(result, indent=2))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    logging.root.level = logging.WARNING
+    sys.exit(asyncio.run(async_main()))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+Latency of intercepted resource requests while chapters are being written
+
+    python benchmarks/bench_io_latency.py --chapters 200 --chapter-size 262144
+
+Cached resources are served through WeReadWebPage._get_from_cache_or_server
+while an exporter saves chapters on the same event loop. With --inline the
+disk operations run on the loop as before, for comparison.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_path)
+sys.path.insert(0, os.path.dirname(current_path))
+
+from weread_exporter import export, fileio, utils, webpage
+
+
+class FakePage(object):
+    def __init__(self, text):
+        self._text = text
+
+    async def get_markdown(self):
+        return self._text
+
+
+def run_inline():
+    async def run(func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def submit(func, *args, **kwargs):
+        func(*args, **kwargs)
+
+    fileio.run = run
+    fileio.submit = submit
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+async def async_main():
+    parser = argparse.ArgumentParser(description="weread-exporter io latency")
+    parser.add_argument("--chapters", type=int, default=200)
+    parser.add_argument("--chapter-size", type=int, default=256 * 1024)
+    parser.add_argument("--resources", type=int, default=20)
+    parser.add_argument(
+        "--request-interval", help="seconds between requests", type=float, default=0.002
+    )
+    parser.add_argument("--inline", help="run disk io on event loop", action="store_true")
+    args = parser.parse_args()
+    if args.inline:
+        run_inline()
+
+    work_dir = tempfile.mkdtemp(prefix="weread-bench-")
+    root_url = "https://weread.qq.com"
+    try:
+        page = webpage.WeReadWebPage(
+            "bench",
+            cookie_path=os.path.join(work_dir, "cookie.json"),
+            webcache_path=work_dir,
+        )
+        for i in range(args.resources):
+            path = os.path.join(work_dir, "resources", "web", "%d.js" % i)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            utils.atomic_write(path, b"console.log('cached');\n" * 2000)
+
+        text = "中文" * (args.chapter_size // 6) + "\n"
+        exporter = export.WeReadExporter(FakePage(text), os.path.join(work_dir, "book"))
+        latencies = []
+        done = False
+
+        async def write_chapters():
+            for i in range(args.chapters):
+                chapter = {"id": i, "title": "Chapter %d" % i}
+                await exporter._save_chapter(exporter._page, i, chapter)
+                await asyncio.sleep(0)
+
+        async def request_resources():
+            # measured from when the request is due, a blocked loop delays it
+            i = 0
+            while not done:
+                due_time = time.perf_counter() + args.request_interval
+                await asyncio.sleep(args.request_interval)
+                url = "%s/web/%d.js" % (root_url, i % args.resources)
+                await page._get_from_cache_or_server(url)
+                latencies.append(time.perf_counter() - due_time)
+                i += 1
+
+        time0 = time.perf_counter()
+        requester = asyncio.ensure_future(request_resources())
+        await write_chapters()
+        write_time = time.perf_counter() - time0
+        done = True
+        await requester
+        exporter.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = {
+        "mode": "inline" if args.inline else "thread",
+        "chapters": args.chapters,
+        "chapter_size": args.chapter_size,
+        "write_seconds": write_time,
+        "requests": len(latencies),
+        "latency": {
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies),
+        },
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    logging.root.level = logging.WARNING
+    asyncio.run(async_main())
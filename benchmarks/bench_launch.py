@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare cold (temporary profile) and warm (persistent profile) chapter loads
+
+Needs chrome and network access:
+    python benchmarks/bench_launch.py -b $book_id --rounds 3
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from weread_exporter import webpage
+
+
+async def load_first_chapter(book_id, persist_profile, headless):
+    page = webpage.WeReadWebPage(
+        book_id,
+        cookie_path=os.path.join("cache", "cookie.txt"),
+        webcache_path="cache",
+    )
+    book_info = await page.get_book_info()
+    time0 = time.time()
+    await page.launch(headless=headless, persist_profile=persist_profile)
+    time1 = time.time()
+    try:
+        await page.goto_chapter(book_info["chapters"][0]["id"])
+    finally:
+        time2 = time.time()
+        await page.close()
+    return {"launch": time1 - time0, "chapter": time2 - time1}
+
+
+async def async_main():
+    parser = argparse.ArgumentParser(description="Browser profile benchmark")
+    parser.add_argument("-b", "--book-id", help="book id", required=True)
+    parser.add_argument("--rounds", help="rounds per mode", type=int, default=3)
+    parser.add_argument("--headless", action="store_true", default=False)
+    args = parser.parse_args()
+    result = {}
+    for mode, persist_profile in (("cold", False), ("warm", True)):
+        result[mode] = []
+        for _ in range(args.rounds):
+            result[mode].append(
+                await load_first_chapter(args.book_id, persist_profile, args.headless)
+            )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    logging.root.level = logging.WARNING
+    asyncio.run(async_main())
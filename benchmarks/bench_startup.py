@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measure interpreter startup and import time of the exporter and its backends
+
+    python benchmarks/bench_startup.py --rounds 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+    "python": "pass",
+    "weread_exporter.export": "import weread_exporter.export",
+    "weread_exporter.formats": "import weread_exporter.formats",
+    "weread_exporter.webpage": "import weread_exporter.webpage",
+    "cli --help": "import sys; sys.argv = ['weread-exporter', '--help']; "
+    "import asyncio, weread_exporter.__main__ as m; "
+    "exec('try:\\n asyncio.run(m.async_main())\\nexcept SystemExit:\\n pass')",
+    "backend markdown": "import markdown",
+    "backend bs4": "import bs4",
+    "backend ebooklib": "from ebooklib import epub",
+    "backend weasyprint": "import weasyprint",
+}
+
+
+def measure(code, rounds):
+    result = []
+    for _ in range(rounds):
+        time0 = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=root_path,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if proc.returncode:
+            return {"error": "exit code %d" % proc.returncode}
+        result.append(time.perf_counter() - time0)
+    return {"min": min(result), "mean": sum(result) / len(result), "max": max(result)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="weread-exporter startup benchmark")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("-o", "--output", help="save result json to file")
+    args = parser.parse_args()
+    result = {}
+    for name, code in TARGETS.items():
+        result[name] = measure(code, args.rounds)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
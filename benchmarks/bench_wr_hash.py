@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark of chapter url generation
+
+    python benchmarks/bench_wr_hash.py --chapters 500 --navigations 3
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from weread_exporter import utils, webpage
+
+VECTORS = {"42557145": "f343248072895ed9f34f408", "14": "aab325601eaab3238922e53"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="wr_hash micro-benchmark")
+    parser.add_argument("--book-id", default="42557145")
+    parser.add_argument("--chapters", type=int, default=500)
+    parser.add_argument(
+        "--navigations", help="times each chapter url is built", type=int, default=3
+    )
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    uncached_hash = utils.wr_hash.__wrapped__
+    for value, expected in VECTORS.items():
+        assert uncached_hash(value) == expected
+        assert utils.wr_hash(value) == expected
+
+    root_url = webpage.WeReadWebPage.root_url
+    chapter_ids = list(range(1, args.chapters + 1)) * args.navigations
+
+    def uncached():
+        for chapter_id in chapter_ids:
+            "%s/web/reader/%sk%s" % (
+                root_url,
+                args.book_id,
+                uncached_hash(str(chapter_id)),
+            )
+
+    def cached():
+        for chapter_id in chapter_ids:
+            webpage.make_chapter_urls(root_url, args.book_id, [chapter_id])
+
+    def bulk():
+        urls = webpage.make_chapter_urls(
+            root_url, args.book_id, range(1, args.chapters + 1)
+        )
+        for i in range(len(chapter_ids)):
+            urls[i % args.chapters]
+
+    result = {"chapters": args.chapters, "navigations": args.navigations}
+    for name, func in (("uncached", uncached), ("cached", cached), ("bulk", bulk)):
+        utils.wr_hash.cache_clear()
+        times = timeit.repeat(func, number=1, repeat=args.rounds)
+        result[name] = {"min": min(times), "mean": sum(times) / len(times)}
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
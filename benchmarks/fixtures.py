@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fixture pages and synthetic chapter corpora for benchmarks
+
+Fixtures are laid out by url path, e.g. web/bookDetail/<book_id>.html, so
+pages recorded from weread.qq.com can be dropped into the same directory.
+"""
+
+import json
+import os
+import random
+import struct
+import zlib
+
+TEXT = "微信读书是一个基于微信关系链的阅读应用，用户可以在这里发现好书、记录想法并与朋友交流。"
+
+
+def make_png(width=64, height=48, color=(200, 80, 80)):
+    def chunk(tag, data):
+        crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+    row = b"\x00" + bytes(color) * width
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+def make_initial_state(book_id, chapter_count, root_url):
+    chapter_infos = []
+    for i in range(chapter_count):
+        anchors = None
+        if i % 5 == 0:
+            anchors = [{"title": "第%d节" % (j + 1), "level": 2} for j in range(3)]
+        chapter_infos.append(
+            {
+                "chapterUid": i + 1,
+                "title": "第%d章" % (i + 1),
+                "level": 1,
+                "wordCount": 3000,
+                "anchors": anchors,
+            }
+        )
+    return {
+        "reader": {
+            "bookInfo": {
+                "bookId": book_id,
+                "title": "基准测试书籍",
+                "author": "weread-exporter",
+                "cover": "%s/images/s_cover.jpg" % root_url,
+                "intro": "Synthetic book for benchmarks",
+                "soldout": 0,
+            },
+            "chapterInfos": chapter_infos,
+        }
+    }
+
+
+def make_book_detail_html(state):
+    return (
+        "<!DOCTYPE html><html><head><title>%s</title></head><body>"
+        '<div id="app"></div><script>window.__INITIAL_STATE__=%s;'
+        "(function(){var s;})();</script></body></html>"
+        % (state["reader"]["bookInfo"]["title"], json.dumps(state, ensure_ascii=False))
+    )
+
+
+def make_booklist_html(books):
+    entities = []
+    for book_id, title in books:
+        entities.append('"%s":{bookId:"%s",title:"%s",author:a}' % (book_id, book_id, title))
+    return (
+        "<!DOCTYPE html><html><head></head><body><script>"
+        "window.__NUXT__=(function(a){return {layout:\"default\",data:[{}],"
+        "state:{booklist:{bookEntities:{%s}}}}}(\"weread\"));</script></body></html>"
+        % ",".join(entities)
+    )
+
+
+def make_chapter_markdown(index, paragraphs, images, image_url, rand):
+    lines = ["## 第%d章" % (index + 1), ""]
+    for i in range(paragraphs):
+        # hook.js emits one line per rendered text line
+        for _ in range(rand.randint(1, 4)):
+            start = rand.randint(0, len(TEXT) - 20)
+            lines.append(TEXT[start:] + TEXT[:start])
+        lines.append("")
+        if i % 20 == 10:
+            lines.extend(["```", "print('hello')", "```", ""])
+    for i in range(images):
+        lines.extend(["", "![](%s?chapter=%d&index=%d)" % (image_url, index, i), ""])
+    return "\n".join(lines)
+
+
+def write_fixtures(fixtures_dir, book_id, book_list_id, chapter_count, root_url):
+    """Write book detail, booklist, image and reader bundle fixtures"""
+    state = make_initial_state(book_id, chapter_count, root_url)
+    files = {
+        os.path.join("web", "bookDetail", book_id + ".html"): make_book_detail_html(
+            state
+        ).encode(),
+        os.path.join("misc", "booklist", book_list_id + ".html"): make_booklist_html(
+            [("%d" % (10000 + i), "书籍%d" % i) for i in range(200)]
+        ).encode(),
+        os.path.join("images", "s_cover.jpg"): make_png(),
+        os.path.join("images", "t9_cover.jpg"): make_png(300, 400),
+        os.path.join("images", "figure.jpg"): make_png(),
+        os.path.join("web", "app.js"): b"console.log('reader bundle');\n" * 2000,
+    }
+    for path, data in files.items():
+        path = os.path.join(fixtures_dir, path)
+        if os.path.isfile(path):
+            continue  # keep recorded fixtures
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as fp:
+            fp.write(data)
+    return state
+
+
+def write_corpus(
+    save_dir, meta_data, paragraphs=50, images=1, image_url=None, seed=0
+):
+    """Write meta.json, cover and raw chapters as export_markdown leaves them"""
+    rand = random.Random(seed)
+    chapter_dir = os.path.join(save_dir, "chapters")
+    os.makedirs(chapter_dir)
+    os.makedirs(os.path.join(save_dir, "images"))
+    with open(os.path.join(save_dir, "meta.json"), "w") as fp:
+        fp.write(json.dumps(meta_data))
+    with open(os.path.join(save_dir, "cover.jpg"), "wb") as fp:
+        fp.write(make_png(300, 400))
+    total = 0
+    for index, chapter in enumerate(meta_data["chapters"]):
+        text = make_chapter_markdown(
+            index, paragraphs, images if image_url else 0, image_url, rand
+        )
+        data = text.encode("utf-8")
+        total += len(data)
+        path = os.path.join(chapter_dir, "%d-%s.md" % (index + 1, chapter["id"]))
+        with open(path, "wb") as fp:
+            fp.write(data)
+    return total
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for weread.qq.com serving recorded fixtures by url path
+"""
+
+import mimetypes
+import os
+
+from aiohttp import web
+
+
+class ReplayServer(object):
+    def __init__(self, fixtures_dir, host="127.0.0.1", port=0):
+        self._fixtures_dir = os.path.abspath(fixtures_dir)
+        self._host = host
+        self._port = port
+        self._runner = None
+        self._requests = 0
+
+    @property
+    def url(self):
+        return "http://%s:%d" % (self._host, self._port)
+
+    @property
+    def requests(self):
+        return self._requests
+
+    async def _handle(self, request):
+        self._requests += 1
+        path = os.path.normpath(
+            os.path.join(self._fixtures_dir, request.path.lstrip("/"))
+        )
+        if not path.startswith(self._fixtures_dir):
+            raise web.HTTPForbidden()
+        for it in (path, path + ".html"):
+            if os.path.isfile(it):
+                path = it
+                break
+        else:
+            raise web.HTTPNotFound()
+        with open(path, "rb") as fp:
+            body = fp.read()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return web.Response(body=body, content_type=content_type)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._host, self._port)
+        await site.start()
+        if not self._port:
+            self._port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
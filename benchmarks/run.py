@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+Offline benchmark of the export pipeline against a local replay server
+
+    python benchmarks/run.py --chapters 100 --paragraphs 50 -o bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_path)
+sys.path.insert(0, os.path.dirname(current_path))
+
+import fixtures
+import replay_server
+
+import weread_exporter
+from weread_exporter import export, utils, webpage
+
+
+# image links in the corpus look like real ones, fetches are replayed locally
+IMAGE_ROOT_URL = "https://res.weread.qq.com"
+
+
+def replay_image_fetches(server):
+    fetch = utils.fetch
+
+    async def replay_fetch(url, *args, **kwargs):
+        if url.startswith(IMAGE_ROOT_URL):
+            url = server.url + url[len(IMAGE_ROOT_URL) :]
+        return await fetch(url, *args, **kwargs)
+
+    utils.fetch = replay_fetch
+
+
+class Stage(object):
+    def __init__(self, name):
+        self.name = name
+        self.rounds = []
+        self.skipped = None
+
+    def result(self):
+        if self.skipped:
+            return {"skipped": self.skipped}
+        return {
+            "rounds": self.rounds,
+            "min": min(self.rounds),
+            "mean": sum(self.rounds) / len(self.rounds),
+            "max": max(self.rounds),
+        }
+
+
+async def timeit(stage, coro):
+    time0 = time.perf_counter()
+    try:
+        result = await coro
+    except ImportError as ex:
+        stage.skipped = str(ex)
+        return None
+    stage.rounds.append(time.perf_counter() - time0)
+    return result
+
+
+async def run_round(args, server, work_dir, stages, index):
+    class ReplayWebPage(webpage.WeReadWebPage):
+        root_url = server.url
+
+    page = ReplayWebPage(
+        args.book_id,
+        cookie_path=os.path.join(work_dir, "cookie.txt"),
+        webcache_path=work_dir,
+    )
+    meta_data = await timeit(stages["get_book_info"], page.get_book_info())
+    await timeit(
+        stages["get_book_list"],
+        utils.get_book_list(args.book_list_id, root_url=server.url),
+    )
+
+    save_dir = os.path.join(work_dir, "round-%d" % index)
+    fixtures.write_corpus(
+        save_dir,
+        meta_data,
+        paragraphs=args.paragraphs,
+        images=args.images,
+        image_url=IMAGE_ROOT_URL + "/images/figure.jpg",
+        seed=index,
+    )
+    exporter = export.WeReadExporter(page, save_dir, packed=args.packed)
+    await timeit(stages["pre_process_markdown"], exporter.pre_process_markdown())
+
+    async def markdown_to_html():
+        for i, chapter in enumerate(meta_data["chapters"]):
+            exporter._render_chapter(i, chapter)
+
+    await timeit(stages["_markdown_to_html"], markdown_to_html())
+    output_dir = os.path.join(save_dir, "output")
+    os.mkdir(output_dir)
+    await timeit(
+        stages["markdown_to_epub"],
+        exporter.markdown_to_epub(os.path.join(output_dir, "book.epub")),
+    )
+    if not args.skip_pdf:
+        await timeit(
+            stages["markdown_to_pdf"],
+            exporter.markdown_to_pdf(os.path.join(output_dir, "book.pdf")),
+        )
+    await timeit(
+        stages["markdown_to_txt"],
+        exporter.markdown_to_txt(os.path.join(output_dir, "book.txt")),
+    )
+
+
+async def async_main():
+    parser = argparse.ArgumentParser(description="weread-exporter offline benchmark")
+    parser.add_argument("--fixtures-dir", help="recorded fixtures directory")
+    parser.add_argument("--book-id", default="bench0000000000000001")
+    parser.add_argument("--book-list-id", default="bench_list")
+    parser.add_argument("--chapters", type=int, default=50)
+    parser.add_argument("--paragraphs", type=int, default=50)
+    parser.add_argument("--images", help="images per chapter", type=int, default=1)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--skip-pdf", action="store_true", default=False)
+    parser.add_argument(
+        "--packed", help="use packed chapter store", action="store_true", default=False
+    )
+    parser.add_argument("-o", "--output", help="save result json to file")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="weread-bench-")
+    fixtures_dir = args.fixtures_dir or os.path.join(work_dir, "fixtures")
+    server = replay_server.ReplayServer(fixtures_dir)
+    await server.start()
+    replay_image_fetches(server)
+    fixtures.write_fixtures(
+        fixtures_dir, args.book_id, args.book_list_id, args.chapters, server.url
+    )
+    stages = {}
+    for name in (
+        "get_book_info",
+        "get_book_list",
+        "pre_process_markdown",
+        "_markdown_to_html",
+        "markdown_to_epub",
+        "markdown_to_pdf",
+        "markdown_to_txt",
+    ):
+        stages[name] = Stage(name)
+    if args.skip_pdf:
+        stages["markdown_to_pdf"].skipped = "--skip-pdf"
+    try:
+        for i in range(args.rounds):
+            await run_round(args, server, work_dir, stages, i)
+    finally:
+        await utils.close_session()
+        await server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = {
+        "version": weread_exporter.VERSION,
+        "python": platform.python_version(),
+        "platform": sys.platform,
+        "time": int(time.time()),
+        "params": {
+            "chapters": args.chapters,
+            "paragraphs": args.paragraphs,
+            "images": args.images,
+            "rounds": args.rounds,
+            "packed": args.packed,
+        },
+        "requests": server.requests,
+        "stages": dict((name, stage.result()) for name, stage in stages.items()),
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    logging.root.level = logging.WARNING
+    asyncio.run(async_main())
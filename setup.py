@@ -35,7 +35,7 @@ setuptools.setup(
     packages=find_packages(),
     python_requires=">=3.7",
     install_requires=REQUIREMENTS,
-    extras_require={},
+    extras_require={"zstd": ["zstandard"]},
     classifiers=[
         # Trove classifiers
         # (https://pypi.python.org/pypi?%3Aaction=list_classifiers)
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+
+import pytest
+
+from weread_exporter import browser_profile, utils
+
+
+def test_profile_slots(tmp_path):
+    root = str(tmp_path / "profiles")
+    profile1 = browser_profile.BrowserProfile(root, "10000")
+    profile2 = browser_profile.BrowserProfile(root, "10000")
+    assert profile1.acquire() == os.path.join(root, "10000")
+    assert profile2.acquire() == os.path.join(root, "10000-1")
+    assert "--user-data-dir=%s" % os.path.abspath(profile1.path) in (
+        profile1.get_chrome_args()
+    )
+    profile1.release()
+    profile3 = browser_profile.BrowserProfile(root, "10000")
+    assert profile3.acquire() == os.path.join(root, "10000")
+    profile2.release()
+    profile3.release()
+
+
+
+def test_cleanup_expired_profile(tmp_path):
+    root = str(tmp_path / "profiles")
+    profile1 = browser_profile.BrowserProfile(root, "10000", max_age=1)
+    profile2 = browser_profile.BrowserProfile(root, "10001", max_age=1)
+    profile1.acquire()
+    profile2.acquire()
+    profile2.release()
+    lock_path = os.path.join(root, "10001.lock")
+    os.utime(lock_path, (time.time() - 86400 * 2, time.time() - 86400 * 2))
+    profile1.cleanup()
+    assert sorted(os.listdir(root)) == ["10000", "10000.lock"]
+    assert profile2.acquire() == os.path.join(root, "10001")
+    profile1.release()
+    profile2.release()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="flock is not used on windows")
+def test_lock_removed_file(tmp_path, monkeypatch):
+    import fcntl
+
+    lock_path = str(tmp_path / "profile.lock")
+    flock = fcntl.flock
+    calls = []
+
+    def remove_then_flock(fd, operation):
+        if not calls:
+            # lock file is removed by cleanup of another process
+            os.remove(lock_path)
+        calls.append(operation)
+        return flock(fd, operation)
+
+    monkeypatch.setattr(fcntl, "flock", remove_then_flock)
+    lock = utils.try_lock_file(lock_path)
+    assert os.path.samestat(os.fstat(lock.fileno()), os.stat(lock_path))
+    assert len([it for it in calls if it != fcntl.LOCK_UN]) == 2
+    utils.unlock_file(lock)
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from weread_exporter import chapterstore
+
+
+@pytest.mark.parametrize("packed", [False, True])
+@pytest.mark.parametrize("codec", [None, "gzip"])
+def test_chapter_store(tmp_path, packed, codec):
+    store = chapterstore.open_chapter_store(str(tmp_path), packed, codec)
+    assert store.read(0, 100) is None
+    assert store.get_size(0, 100) is None
+
+    store.write(0, 100, b"raw", chapterstore.VERSION_RAW)
+    assert store.read(0, 100) == b"raw"
+    assert store.read(0, 100, chapterstore.VERSION_PROCESSED) is None
+    assert store.get_size(0, 100) == 3
+
+    store.write(0, 100, b"processed", chapterstore.VERSION_PROCESSED)
+    store.write(0, 100, b"<p>processed</p>", chapterstore.VERSION_HTML)
+    assert store.read(0, 100) == b"processed"
+    assert store.read(0, 100, chapterstore.VERSION_RAW) == b"raw"
+    if store.cache_rendered:
+        assert store.read(0, 100, chapterstore.VERSION_HTML) == b"<p>processed</p>"
+
+    # export again
+    store.write(0, 100, b"raw2", chapterstore.VERSION_RAW)
+    assert store.read(0, 100) == b"raw2"
+    assert store.read(0, 100, chapterstore.VERSION_PROCESSED) is None
+    assert store.read(0, 100, chapterstore.VERSION_HTML) is None
+    store.close()
+
+
+def test_move_files_into_packed_store(tmp_path):
+    store = chapterstore.open_chapter_store(str(tmp_path))
+    store.write(0, 100, b"raw1", chapterstore.VERSION_RAW)
+    store.write(0, 100, b"processed1", chapterstore.VERSION_PROCESSED)
+    store.write(1, 200, b"raw2", chapterstore.VERSION_RAW)
+
+    store = chapterstore.open_chapter_store(str(tmp_path), packed=True)
+    assert not os.path.exists(str(tmp_path / "chapters"))
+    assert store.read(0, 100) == b"processed1"
+    assert store.read(0, 100, chapterstore.VERSION_RAW) == b"raw1"
+    assert store.read(1, 200) == b"raw2"
+    store.close()
+
+    store = chapterstore.open_chapter_store(str(tmp_path))
+    assert isinstance(store, chapterstore.PackedChapterStore)
+    store.close()
+
+
+def test_merge_stray_files_into_packed_store(tmp_path):
+    store = chapterstore.open_chapter_store(str(tmp_path), packed=True)
+    store.write(0, 1, b"packed1", chapterstore.VERSION_RAW)
+    store.close()
+    # written by a process that started in file mode before chapters.db existed
+    file_store = chapterstore.FileChapterStore(str(tmp_path / "chapters"))
+    file_store.write(1, 2, b"file2", chapterstore.VERSION_RAW)
+    path = file_store.describe(0, 1)
+    file_store.write(0, 1, b"stale1", chapterstore.VERSION_RAW)
+    os.utime(path, (0, 0))
+
+    store = chapterstore.open_chapter_store(str(tmp_path))
+    assert isinstance(store, chapterstore.PackedChapterStore)
+    assert store.read(1, 2) == b"file2"
+    assert store.read(0, 1) == b"packed1"
+    assert not os.path.exists(str(tmp_path / "chapters"))
+    store.close()
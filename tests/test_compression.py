@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from weread_exporter import compression
+
+
+def test_write_and_read_file(tmp_path):
+    path = str(tmp_path / "app.js")
+    data = "console.log('中文');\n".encode("utf-8") * 100
+    compression.write_file(path, data, "gzip")
+    assert os.listdir(str(tmp_path)) == ["app.js.gz"]
+    assert os.path.getsize(path + ".gz") < len(data)
+    assert compression.read_file(path) == data
+    assert compression.get_size(path) == len(data)
+    with compression.open_file(path) as fp:
+        assert fp.read(10) == data[:10]
+
+    compression.write_file(path, b"plain")
+    assert os.listdir(str(tmp_path)) == ["app.js"]
+    assert compression.read_file(path) == b"plain"
+    assert compression.get_size(path) == 5
+    assert compression.read_file(str(tmp_path / "none.js")) is None
+    assert compression.get_size(str(tmp_path / "none.js")) is None
+    compression.write_file(path, b"", "gzip")
+    assert compression.get_size(path) == 0
+
+
+def test_zstd(tmp_path):
+    pytest.importorskip("zstandard")
+    path = str(tmp_path / "1-100.md")
+    compression.write_file(path, b"hello" * 100, "zstd")
+    assert compression.find_file(path) == (path + ".zst", "zstd")
+    assert compression.read_file(path) == b"hello" * 100
+    assert compression.get_size(path) == 500
+
+
+def test_compression_policy():
+    policy = compression.CompressionPolicy.parse(["gzip", "script=none"])
+    assert policy.get_codec("chapter") == "gzip"
+    assert policy.get_codec_for_path("web/app.css") == "gzip"
+    assert policy.get_codec_for_path("web/app.js") is None
+    assert policy.get_codec_for_path("web/cover.jpg") is None
+    with pytest.raises(ValueError):
+        compression.CompressionPolicy.parse(["image=gzip"])
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import os
+import threading
+
+from weread_exporter import fileio
+
+
+def test_run_in_io_thread():
+    thread_names = []
+
+    def func(value):
+        thread_names.append(threading.current_thread().name)
+        return value * 2
+
+    assert asyncio.run(fileio.run(func, 21)) == 42
+    assert thread_names[0].startswith("weread-io")
+
+
+def test_read_write_file(tmp_path):
+    path = str(tmp_path / "chapter.md")
+
+    async def run():
+        await fileio.write_file(path, b"hello", "gzip")
+        assert os.path.isfile(path + ".gz")
+        assert await fileio.read_file(path) == b"hello"
+        await fileio.atomic_write(path, b"world")
+        assert await fileio.read_file(path) == b"world"
+        assert await fileio.read_file(path + ".missing") is None
+
+    asyncio.run(run())
+
+
+def test_append_text_in_order(tmp_path):
+    path = str(tmp_path / "log.txt")
+    for i in range(10):
+        fileio.append_text(path, "%d\n" % i)
+    fileio.submit(lambda: None).result()
+    with open(path) as fp:
+        assert fp.read() == "".join("%d\n" % i for i in range(10))
+
+
+def test_submit_logs_exception(tmp_path, caplog):
+    path = str(tmp_path / "missing" / "log.txt")
+    with caplog.at_level(logging.ERROR):
+        fileio.append_text(path, "text\n")
+        fileio.submit(lambda: None).result()
+    assert "_append_text failed" in caplog.text
@@ -0,0 +1,308 @@
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from weread_exporter import export, formats, utils
+
+
+def test_resolve_formats():
+    names = [it.name for it in formats.resolve_formats(["mobi", "txt"])]
+    assert names == ["epub", "mobi", "txt"]
+    names = [it.name for it in formats.resolve_formats(["epub", "mobi", "epub"])]
+    assert names == ["epub", "mobi"]
+
+
+def test_lazy_backends():
+    code = (
+        "import sys; import weread_exporter.export, weread_exporter.formats; "
+        "print(','.join(it for it in ('weasyprint', 'ebooklib', 'bs4', 'markdown') "
+        "if it in sys.modules))"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code])
+    assert output.strip() == b""
+
+
+def _make_book(save_dir):
+    os.makedirs(os.path.join(save_dir, "chapters"))
+    meta_data = {
+        "title": "test",
+        "author": "test",
+        "chapters": [
+            {"id": 1, "title": "Chapter 1", "level": 1, "anchors": []},
+            {"id": 2, "title": "Chapter 2", "level": 1, "anchors": []},
+        ],
+    }
+    with open(os.path.join(save_dir, "meta.json"), "w") as fp:
+        fp.write(json.dumps(meta_data))
+    for index, chapter in enumerate(meta_data["chapters"]):
+        path = os.path.join(
+            save_dir, "chapters", "%d-%d.md" % (index + 1, chapter["id"])
+        )
+        with open(path, "w") as fp:
+            fp.write("## %s\n\nHello world\n" % chapter["title"])
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_format_pipeline(tmp_path, packed):
+    pytest.importorskip("bs4")
+    pytest.importorskip("markdown")
+    save_dir = str(tmp_path / "book")
+    output_dir = str(tmp_path / "output")
+    os.makedirs(output_dir)
+    _make_book(save_dir)
+    exporter = export.WeReadExporter(None, save_dir, packed=packed)
+    pipeline = formats.FormatPipeline(formats.resolve_formats(["md", "txt"]), workers=2)
+    asyncio.run(pipeline.run(exporter, output_dir, "test", {}))
+    with open(os.path.join(output_dir, "test.md")) as fp:
+        assert "## Chapter 2" in fp.read()
+    with open(os.path.join(output_dir, "test.txt")) as fp:
+        assert "Hello world" in fp.read()
+    exporter.close()
+    assert os.path.isdir(os.path.join(save_dir, "chapters")) != packed
+
+
+def test_export_in_process(tmp_path):
+    pytest.importorskip("bs4")
+    pytest.importorskip("markdown")
+    save_dir = str(tmp_path / "book")
+    save_path = str(tmp_path / "test.txt")
+    _make_book(save_dir)
+    exporter = export.WeReadExporter(
+        None, save_dir, packed=True, chapter_codec="gzip"
+    )
+    exporter.close()
+    formats._export_in_process(
+        "txt", save_dir, exporter.settings, save_path, str(tmp_path), "test", {}
+    )
+    with open(save_path) as fp:
+        assert "Hello world" in fp.read()
+    # html rendered by the worker is saved with the chapter codec
+    conn = sqlite3.connect(os.path.join(save_dir, "chapters.db"))
+    rows = conn.execute("SELECT codec FROM chapters WHERE version='html'").fetchall()
+    conn.close()
+    assert rows == [("gzip",), ("gzip",)]
+
+
+def test_pre_process_markdown_images(tmp_path, monkeypatch):
+    save_dir = str(tmp_path / "book")
+    _make_book(save_dir)
+    fetched = []
+
+    async def fetch(url, *args, **kwargs):
+        fetched.append(url)
+        return b"image"
+
+    monkeypatch.setattr(utils, "fetch", fetch)
+    exporter = export.WeReadExporter(None, save_dir)
+    exporter._chapter_store.write(
+        0,
+        1,
+        "![](https://res.weread.qq.com/1.jpg)\n\n![](http://a.com/2.jpg)\n",
+        "raw",
+    )
+    asyncio.run(exporter.pre_process_markdown())
+    text = exporter._chapter_store.read(0, 1).decode()
+    # only https images are downloaded
+    assert fetched == ["https://res.weread.qq.com/1.jpg"]
+    assert "](images/%s.jpg)" % utils.md5(fetched[0]) in text
+    assert "](http://a.com/2.jpg)" in text
+    exporter.close()
+
+
+class FakeReaderPage(object):
+    def __init__(self, name, events, fail_chapter=None):
+        self.name = name
+        self.events = events
+        self.fail_chapter = fail_chapter
+        self.chapter_id = None
+        self.closed = False
+
+    async def fork(self):
+        return FakeReaderPage("tab2", self.events, self.fail_chapter)
+
+    async def goto_chapter(self, chapter_id, timeout=None, url=None):
+        self.events.append(("load", self.name, chapter_id))
+        await asyncio.sleep(0.01)
+        if chapter_id == self.fail_chapter:
+            raise utils.LoginRequiredError()
+        self.chapter_id = chapter_id
+
+    async def get_markdown(self):
+        self.events.append(("extract", self.name, self.chapter_id))
+        await asyncio.sleep(0.01)
+        return "## Chapter %d\n\nHello world\n" % self.chapter_id
+
+    async def close(self):
+        self.closed = True
+
+
+def _make_pending_book(save_dir):
+    os.makedirs(save_dir)
+    meta_data = {
+        "title": "test",
+        "chapters": [
+            {"id": i, "title": "Chapter %d" % i, "url": "/%d" % i} for i in (1, 2, 3)
+        ],
+    }
+    with open(os.path.join(save_dir, "meta.json"), "w") as fp:
+        fp.write(json.dumps(meta_data))
+    with open(os.path.join(save_dir, "cover.jpg"), "wb") as fp:
+        fp.write(b"cover")
+
+
+def test_export_chapters_pipelined(tmp_path):
+    save_dir = str(tmp_path / "book")
+    _make_pending_book(save_dir)
+    events = []
+    page = FakeReaderPage("tab1", events)
+    exporter = export.WeReadExporter(page, save_dir)
+    forked = []
+    fork = page.fork
+
+    async def record_fork():
+        forked.append(await fork())
+        return forked[-1]
+
+    page.fork = record_fork
+    asyncio.run(exporter.export_markdown(timeout=1, interval=0, prefetch=True))
+    # next chapter loads in the other tab while current one is extracted
+    assert events[0] == ("load", "tab1", 1)
+    assert sorted(events[1:3]) == [("extract", "tab1", 1), ("load", "tab2", 2)]
+    extracts = [it[1:] for it in events if it[0] == "extract"]
+    assert extracts == [("tab1", 1), ("tab2", 2), ("tab1", 3)]
+    for index in range(3):
+        data = exporter._chapter_store.read(index, index + 1)
+        assert data.startswith(b"## Chapter %d" % (index + 1))
+    assert forked[0].closed
+    exporter.close()
+
+
+def test_export_chapters_pipelined_failure(tmp_path):
+    save_dir = str(tmp_path / "book")
+    _make_pending_book(save_dir)
+    events = []
+    page = FakeReaderPage("tab1", events, fail_chapter=2)
+    exporter = export.WeReadExporter(page, save_dir)
+    forked = []
+    fork = page.fork
+
+    async def record_fork():
+        forked.append(await fork())
+        return forked[-1]
+
+    page.fork = record_fork
+    with pytest.raises(utils.LoginRequiredError):
+        asyncio.run(exporter.export_markdown(timeout=1, interval=0, prefetch=True))
+    # chapter 1 is saved, the failed chapter and the ones after are not
+    assert [it[1:] for it in events if it[0] == "extract"] == [("tab1", 1)]
+    assert exporter._chapter_store.read(0, 1) is not None
+    assert exporter._chapter_store.read(1, 2) is None
+    assert forked[0].closed
+    exporter.close()
+
+
+def test_verify_chapter(tmp_path):
+    save_dir = str(tmp_path / "book")
+    _make_book(save_dir)
+    exporter = export.WeReadExporter(None, save_dir, chapter_codec="gzip")
+    chapter = {"id": 1, "title": "Chapter 1"}
+    data = b"## Chapter 1\n\nHello gzip\n"
+    exporter._chapter_store.write(0, 1, data, "raw")
+    assert exporter._chapter_store.get_size(0, 1) == len(data)
+    assert not exporter._verify_chapter(0, chapter)
+    exporter._journal.record(1, data, "exported")
+    assert exporter._verify_chapter(0, chapter)
+    assert not exporter._verify_chapter(1, {"id": 3, "title": "Chapter 3"})
+    exporter.close()
+
+
+def test_render_chapter_text_like_path(tmp_path):
+    pytest.importorskip("markdown")
+    save_dir = str(tmp_path / "book")
+    _make_book(save_dir)
+    exporter = export.WeReadExporter(None, save_dir)
+    # chapter text happens to name an existing file
+    meta_path = os.path.join(save_dir, "meta.json")
+    exporter._chapter_store.write(0, 1, meta_path.encode(), "raw")
+    html = exporter._render_chapter(0, {"id": 1, "title": "Chapter 1"})
+    assert meta_path in html
+    assert "author" not in html
+    html = exporter._markdown_file_to_html(
+        os.path.join(save_dir, "chapters", "2-2.md"), False
+    )
+    assert "<h2>Chapter 2</h2>" in html
+    exporter.close()
+
+
+class SlowFormat(formats.OutputFormat):
+    name = "test-slow"
+    extension = "slow"
+
+    async def export(self, exporter, save_path, output_dir, title, options):
+        await asyncio.sleep(3)
+
+
+class BrokenFormat(formats.OutputFormat):
+    name = "test-broken"
+    extension = "broken"
+
+    async def export(self, exporter, save_path, output_dir, title, options):
+        raise RuntimeError("Render failed")
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="workers see test formats by fork")
+def test_format_pipeline_failure_does_not_wait(tmp_path, monkeypatch):
+    monkeypatch.setitem(formats.formats, SlowFormat.name, SlowFormat())
+    monkeypatch.setitem(formats.formats, BrokenFormat.name, BrokenFormat())
+    save_dir = str(tmp_path / "book")
+    _make_book(save_dir)
+    exporter = export.WeReadExporter(None, save_dir)
+    pipeline = formats.FormatPipeline(
+        formats.resolve_formats([SlowFormat.name, BrokenFormat.name]), workers=2
+    )
+    time0 = time.time()
+    with pytest.raises(RuntimeError):
+        asyncio.run(pipeline.run(exporter, str(tmp_path), "test", {}))
+    # slow format is still running in its worker
+    assert time.time() - time0 < 2
+    exporter.close()
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_merge_markdown(tmp_path, packed):
+    save_dir = str(tmp_path / "book")
+    _make_book(save_dir)
+    exporter = export.WeReadExporter(None, save_dir, packed=packed)
+    save_path = str(tmp_path / "test.md")
+    assert asyncio.run(exporter.merge_markdown(save_path, front_matter=True)) == []
+    with open(save_path, encoding="utf-8") as fp:
+        text = fp.read()
+    assert text.startswith('---\ntitle: "test"\n')
+    assert "- Chapter 2\n" in text
+    assert text.endswith("## Chapter 2\n\nHello world\n\n")
+
+    exporter._chapter_store.write(0, 1, "## Chapter 1\n\n中文\n", "processed")
+    if packed:
+        exporter._chapter_store._conn.execute(
+            "DELETE FROM chapters WHERE chapter_id='2'"
+        )
+    else:
+        os.remove(os.path.join(save_dir, "chapters", "2-2.md"))
+    with pytest.raises(RuntimeError):
+        asyncio.run(exporter.merge_markdown(save_path))
+    assert not [it for it in os.listdir(str(tmp_path)) if it.endswith(".tmp")]
+    gaps = asyncio.run(exporter.merge_markdown(save_path, partial=True))
+    assert gaps == [{"index": 1, "id": 2, "title": "Chapter 2"}]
+    with open(save_path + ".gaps.json") as fp:
+        assert json.loads(fp.read()) == gaps
+    with open(save_path, encoding="utf-8") as fp:
+        assert fp.read() == (
+            "## Chapter 1\n\n中文\n\n<!-- missing chapter: Chapter 2 -->\n\n"
+        )
+    exporter.close()
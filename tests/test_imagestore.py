@@ -0,0 +1,55 @@
+import os
+
+from weread_exporter import imagestore
+
+
+def test_image_store(tmp_path):
+    store = imagestore.ImageStore(str(tmp_path / "store"), grace=0)
+    object_path = store.add("http://a.com/1.jpg", b"image")
+    assert store.add("http://b.com/2.jpg", b"image") == object_path
+    assert store.lookup("http://b.com/2.jpg") == object_path
+    assert store.lookup("http://c.com/3.jpg") is None
+
+    book1 = tmp_path / "book1.jpg"
+    book2 = tmp_path / "book2.jpg"
+    store.link(object_path, str(book1))
+    store.link(object_path, str(book2))
+    assert book1.read_bytes() == b"image"
+    assert os.path.samefile(str(book1), str(book2))
+
+    orphan_path = store.add("http://c.com/3.jpg", b"orphan")
+    assert store.collect_garbage() == len(b"orphan")
+    assert not os.path.exists(orphan_path)
+    assert store.lookup("http://c.com/3.jpg") is None
+    assert store.lookup("http://a.com/1.jpg") == object_path
+
+    os.remove(str(book1))
+    os.remove(str(book2))
+    store.collect_garbage()
+    assert not os.path.exists(object_path)
+    assert store.lookup("http://a.com/1.jpg") is None
+    store.close()
+
+
+def test_image_store_copied_objects(tmp_path, monkeypatch):
+    store = imagestore.ImageStore(str(tmp_path / "store"))
+    object_path = store.add("http://a.com/1.jpg", b"image")
+    # objects just added are kept until they are linked
+    assert store.collect_garbage() == 0
+
+    def link(src, dst):
+        raise OSError("Hardlink not supported")
+
+    monkeypatch.setattr(os, "link", link)
+    book = tmp_path / "book.jpg"
+    store.link(object_path, str(book))
+    assert book.read_bytes() == b"image"
+    assert sorted(os.listdir(str(tmp_path))) == ["book.jpg", "store"]
+    store._grace = 0
+    assert store.collect_garbage() == 0
+    assert store.lookup("http://a.com/1.jpg") == object_path
+
+    os.remove(str(book))
+    assert store.collect_garbage() == len(b"image")
+    assert not os.path.exists(object_path)
+    store.close()
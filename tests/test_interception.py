@@ -0,0 +1,111 @@
+import asyncio
+
+from weread_exporter import interception
+
+
+def test_rule_table():
+    rules = interception.RuleTable()
+    rule = rules.match("https://weread.qq.com/web/1.392ec47a.js", "script")
+    assert rule.action == interception.ACTION_HOOK
+    rule = rules.match("https://cdn.weread.qq.com/web/app.js?v=1", "script")
+    assert rule.action == interception.ACTION_CACHE
+    rule = rules.match("https://cdn.weread.qq.com/web/app.js", "script", "OPTIONS")
+    assert rule.name == "cors-preflight"
+    rule = rules.match("https://weread.qq.com/web/book/read", "xhr", "POST")
+    assert rule.action == interception.ACTION_MOCK
+    rule = rules.match("https://wx.qlogo.cn/mmhead/abc/0", "image")
+    assert rule.action == interception.ACTION_BLOCK
+    rule = rules.match("https://weread.qq.com/web/reader/abc", "document")
+    assert rule.action == interception.ACTION_REWRITE
+    assert rules.match("https://weread.qq.com/web/book/chapterInfos", "xhr") is None
+
+
+def test_mock_response():
+    rules = interception.RuleTable()
+    status, headers, body = rules.match(
+        "https://weread.qq.com/hera/chlog", "xhr", "POST"
+    ).make_response()
+    assert status == 200
+    assert body == b'{"ret":0}'
+    assert headers["Content-Length"] == str(len(body))
+    status, headers, body = rules.match(
+        "https://weread.qq.com/hera/logkv", "xhr", "POST"
+    ).make_response()
+    assert status == 204
+    assert body == b""
+
+
+def test_capture_only_rules():
+    rules = interception.RuleTable()
+    for i, rule in enumerate(interception.CAPTURE_ONLY_RULES):
+        rules.insert(i, rule)
+    rule = rules.match("https://res.weread.qq.com/wrepub/abc.jpg", "image")
+    assert rule.name == "capture-image"
+    rule = rules.match("https://weread.qq.com/web/fonts/a.woff2", "font")
+    assert rule.action == interception.ACTION_BLOCK
+    rule = rules.match("https://weread.qq.com/web/1.392ec47a.js", "script")
+    assert rule.action == interception.ACTION_HOOK
+
+
+def test_interception_manager():
+    class FakePage(object):
+        def __init__(self):
+            self.listeners = []
+
+        async def setRequestInterception(self, enabled):
+            pass
+
+        def on(self, event, listener):
+            self.listeners.append(listener)
+
+    class FakeRequest(object):
+        def __init__(self, name):
+            self.name = name
+            self.aborted = None
+
+        async def abort(self, error_code="failed"):
+            if self.name == "error":
+                raise RuntimeError("Request is already handled")
+            self.aborted = error_code
+
+    handled = []
+
+    async def handler(request):
+        if request.name in ("error", "fail"):
+            raise RuntimeError("Fetch %s failed" % request.name)
+        await asyncio.sleep(0 if request.name == "fast" else 10)
+        handled.append(request.name)
+
+    async def run():
+        manager = interception.InterceptionManager(handler, max_tasks=2)
+        page = FakePage()
+        await manager.attach(page)
+        await manager.attach(page)
+        assert len(page.listeners) == 1
+        requests = [FakeRequest(it) for it in ("slow", "slow", "fast", "error")]
+        for request in requests:
+            page.listeners[0](request)
+        await asyncio.sleep(0.01)
+        # fast request waits for a free slot
+        assert handled == []
+        assert manager.in_flight == 4
+        assert manager.cancel() == 4
+        await asyncio.sleep(0.01)
+        assert [it.aborted for it in requests] == ["aborted"] * 3 + [None]
+        summary = manager.summary()
+        assert summary["started"] == 4
+        assert summary["cancelled"] == 4
+        assert summary["max_in_flight"] == 4
+        assert summary["in_flight"] == 0
+
+        requests = [FakeRequest(it) for it in ("fast", "error", "fail")]
+        for request in requests:
+            page.listeners[0](request)
+        await asyncio.sleep(0.01)
+        assert handled == ["fast"]
+        assert [it.aborted for it in requests] == [None, None, "failed"]
+        summary = manager.summary()
+        assert summary["completed"] == 1
+        assert summary["failed"] == 2
+
+    asyncio.run(run())
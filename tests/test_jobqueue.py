@@ -0,0 +1,146 @@
+import asyncio
+import subprocess
+import sys
+import time
+
+from weread_exporter import jobqueue, metrics, pipeline, utils
+from weread_exporter.__main__ import create_parser
+
+
+def test_job_queue_priority_and_retry(tmp_path):
+    queue = jobqueue.JobQueue(str(tmp_path / "jobs.db"), max_attempts=2, backoff_base=60)
+    job1 = queue.add("book1")
+    job2 = queue.add("book2", ["epub"], priority=1)
+    assert queue.add("book1")["id"] == job1["id"]
+
+    job = queue.claim()
+    assert job["id"] == job2["id"]
+    assert job["formats"] == ["epub"]
+    assert job["attempts"] == 1
+    queue.fail(job["id"], "timeout")
+    job = queue.get(job2["id"])
+    assert job["status"] == queue.STATUS_QUEUED
+    assert job["next_run"] > time.time() + 50
+
+    job = queue.claim()
+    assert job["id"] == job1["id"]
+    queue.complete(job["id"], {"title": "test"})
+    assert queue.get(job1["id"])["result"] == {"title": "test"}
+    assert queue.claim() is None
+    assert 50 < queue.get_next_delay() <= 60
+    assert queue.get_next_delay(["book1"]) is None
+
+    queue._conn.execute("UPDATE jobs SET next_run=0")
+    job = queue.claim()
+    queue.fail(job["id"], "timeout")
+    job = queue.get(job2["id"])
+    assert job["status"] == queue.STATUS_DEAD
+    assert job["error"] == "timeout"
+    assert queue.add("book2")["id"] != job2["id"]
+
+
+def test_job_queue_retry_on_progress(tmp_path):
+    queue = jobqueue.JobQueue(str(tmp_path / "jobs.db"), max_attempts=2, backoff_base=60)
+    job = queue.add("book1")
+    for _ in range(3):
+        queue._conn.execute("UPDATE jobs SET next_run=0")
+        job = queue.claim()
+        queue.fail(job["id"], "load chapter failed", progress=True)
+        job = queue.get(job["id"])
+        assert job["status"] == queue.STATUS_QUEUED
+        assert job["attempts"] == 0
+        assert job["next_run"] <= time.time() + 60
+
+    for _ in range(2):
+        queue._conn.execute("UPDATE jobs SET next_run=0")
+        queue.fail(queue.claim()["id"], "load chapter failed")
+    assert queue.get(job["id"])["status"] == queue.STATUS_DEAD
+
+
+def test_run_job_progress(tmp_path, monkeypatch):
+    args = create_parser().parse_args(["-b", "abc", "-o", "txt"])
+    export_pipeline = pipeline.ExportPipeline(
+        args, cache_dir=str(tmp_path / "cache"), output_dir=str(tmp_path / "output")
+    )
+    queue = jobqueue.JobQueue(str(tmp_path / "jobs.db"), max_attempts=1)
+    chapters = [2, 0]
+
+    async def export_book(book_id, output_formats=None):
+        book_metrics = metrics.Metrics(labels={"book_id": book_id})
+        export_pipeline._metrics_list.append(book_metrics)
+        book_metrics.incr("chapters_exported", chapters.pop(0))
+        raise utils.LoadChapterFailedError("Load chapter timeout")
+
+    monkeypatch.setattr(export_pipeline, "export_book", export_book)
+    job = queue.add("abc")
+    assert not asyncio.run(export_pipeline.run_job(queue, queue.claim()))
+    assert queue.get(job["id"])["status"] == queue.STATUS_QUEUED
+    queue._conn.execute("UPDATE jobs SET next_run=0")
+    assert not asyncio.run(export_pipeline.run_job(queue, queue.claim()))
+    assert queue.get(job["id"])["status"] == queue.STATUS_DEAD
+    export_pipeline._image_store.close()
+
+
+def test_job_queue_recover(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = jobqueue.JobQueue(path)
+    job = queue.add("book1")
+    queue.claim()
+    queue.close()
+
+    queue = jobqueue.JobQueue(path)
+    assert queue.claim() is None
+    # owner process is still running
+    assert queue.recover() == 0
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    host = queue._owner.rsplit(":", 1)[0]
+    queue._conn.execute("UPDATE jobs SET owner=?", ("%s:%d" % (host, process.pid),))
+    assert queue.recover() == 1
+    job = queue.claim()
+    assert job["book_id"] == "book1"
+    assert job["attempts"] == 2
+
+    # lease expired
+    queue.heartbeat(job["id"])
+    assert queue.recover() == 0
+    queue._conn.execute("UPDATE jobs SET heartbeat=?", (time.time() - 600,))
+    assert queue.recover() == 1
+
+
+class RacingConnection(object):
+    """Let another queue claim the selected job before the update"""
+
+    def __init__(self, conn, queue):
+        self._conn = conn
+        self._queue = queue
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *args):
+        return self._conn.__exit__(*args)
+
+    def execute(self, sql, *args):
+        if sql.startswith("UPDATE jobs SET status") and self._queue:
+            self._queue.claim()
+            self._queue = None
+        return self._conn.execute(sql, *args)
+
+
+def test_job_queue_claim_once(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue1 = jobqueue.JobQueue(path)
+    queue2 = jobqueue.JobQueue(path)
+    job1 = queue1.add("book1", priority=1)
+    job2 = queue1.add("book2")
+    queue2._conn = RacingConnection(queue2._conn, queue1)
+    # more book ids than sqlite variables
+    book_ids = ["book%d" % i for i in range(40000)]
+    assert queue2.claim(book_ids)["id"] == job2["id"]
+    assert queue1.get(job1["id"])["status"] == queue1.STATUS_RUNNING
+    assert queue2.claim(book_ids) is None
+    assert queue2.get_next_delay(book_ids[:1]) is None
@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+
+from weread_exporter import compression, journal, utils
+
+
+def get_umask():
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def test_journal_verify(tmp_path):
+    file_path = str(tmp_path / "1-100.md")
+    utils.atomic_write(file_path, "## Chapter 1\n")
+    chapter_journal = journal.ChapterJournal(str(tmp_path / "journal.json"))
+    assert not chapter_journal.verify(100, file_path)
+    chapter_journal.record(100, "## Chapter 1\n", journal.ChapterJournal.STATUS_EXPORTED)
+    assert chapter_journal.verify(100, file_path)
+    assert not chapter_journal.verify(
+        100, file_path, journal.ChapterJournal.STATUS_PROCESSED
+    )
+
+    # reload from disk
+    chapter_journal = journal.ChapterJournal(str(tmp_path / "journal.json"))
+    assert chapter_journal.verify(100, file_path)
+
+    # truncated file
+    with open(file_path, "wb") as fp:
+        fp.write(b"## Chap")
+    assert not chapter_journal.verify(100, file_path)
+    # appended file
+    with open(file_path, "wb") as fp:
+        fp.write(b"## Chapter 1\n\nmore")
+    assert not chapter_journal.verify(100, file_path)
+    compression.write_file(file_path, b"## Chapter 1\n", "gzip")
+    with compression.open_file(file_path) as fp:
+        assert chapter_journal.verify_stream(100, fp)
+
+
+def test_journal_append(tmp_path):
+    journal_path = str(tmp_path / "journal.json")
+    with open(journal_path, "w") as fp:
+        # saved by older versions
+        json.dump({"1": {"hash": "", "size": 0, "status": "exported", "time": 0}}, fp)
+    chapter_journal = journal.ChapterJournal(journal_path)
+    assert chapter_journal.get(1)["status"] == "exported"
+    for chapter_id in range(2, 5):
+        chapter_journal.record(chapter_id, "text", "exported")
+    chapter_journal.remove(3)
+    with open(journal_path) as fp:
+        lines = fp.read().splitlines()
+    # converted before the first append
+    assert [json.loads(it)[0] for it in lines] == ["1", "2", "3", "4", "3"]
+    assert json.loads(lines[-1]) == ["3", None]
+
+    # line cut by a crash
+    with open(journal_path, "a") as fp:
+        fp.write('["5", {"hash"')
+    chapter_journal = journal.ChapterJournal(journal_path)
+    assert sorted(chapter_journal._entries) == ["1", "2", "4"]
+    chapter_journal.record(5, "text", "exported")
+    chapter_journal = journal.ChapterJournal(journal_path)
+    assert sorted(chapter_journal._entries) == ["1", "2", "4", "5"]
+
+
+def test_atomic_write(tmp_path):
+    file_path = str(tmp_path / "test.txt")
+    utils.atomic_write(file_path, "hello")
+    utils.atomic_write(file_path, b"world")
+    with open(file_path, "rb") as fp:
+        assert fp.read() == b"world"
+    assert os.listdir(str(tmp_path)) == ["test.txt"]
+    if sys.platform != "win32":
+        assert utils.get_file_mode(file_path) == 0o666 & ~get_umask()
+        os.chmod(file_path, 0o640)
+        utils.atomic_write(file_path, b"hello")
+        assert utils.get_file_mode(file_path) == 0o640
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+
+from aiohttp import test_utils, web
+
+from weread_exporter import metadata, utils
+
+
+def make_detail_html(book_id, soldout=False):
+    state = {
+        "reader": {
+            "bookInfo": {
+                "title": "book %s" % book_id,
+                "author": "author",
+                "cover": "https://example.com/s_cover.jpg",
+                "intro": "intro",
+                "soldout": 1 if soldout else 0,
+            },
+            "chapterInfos": [
+                {
+                    "chapterUid": 1,
+                    "title": "chapter 1",
+                    "level": 1,
+                    "wordCount": 100,
+                    "anchors": None,
+                }
+            ],
+        }
+    }
+    return (
+        "<html><script>window.__INITIAL_STATE__=%s;</script></html>"
+        % json.dumps(state, separators=(",", ":"))
+    )
+
+
+def test_book_metadata(tmp_path):
+    requests = []
+
+    async def handle_detail(request):
+        book_id = request.match_info["book_id"]
+        requests.append(book_id)
+        await asyncio.sleep(0.01)
+        return web.Response(
+            text=make_detail_html(book_id, soldout=book_id == "soldout"),
+            content_type="text/html",
+        )
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/web/bookDetail/{book_id}", handle_detail)
+        server = test_utils.TestServer(app)
+        await server.start_server()
+        try:
+            book_metadata = metadata.BookMetadata(
+                str(tmp_path), root_url=str(server.make_url("")).rstrip("/")
+            )
+            result = await book_metadata.prefetch(["book1", "book2", "soldout"])
+            assert result["book1"]["valid"]
+            assert result["book1"]["meta"]["chapters"][0]["words"] == 100
+            assert not result["soldout"]["valid"]
+            assert await book_metadata.is_valid("book2")
+            assert not await book_metadata.is_valid("soldout")
+            await asyncio.gather(book_metadata.get("book3"), book_metadata.get("book3"))
+        finally:
+            await utils.close_session()
+            await server.close()
+
+    asyncio.run(run())
+    assert sorted(requests) == ["book1", "book2", "book3", "soldout"]
+    with open(os.path.join(str(tmp_path), "book1", "meta.json")) as fp:
+        assert json.load(fp)["title"] == "book book1"
+    assert not os.path.exists(os.path.join(str(tmp_path), "soldout", "meta.json"))
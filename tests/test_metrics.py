@@ -0,0 +1,35 @@
+from weread_exporter import metrics
+
+
+def test_metrics_summary():
+    book_metrics = metrics.Metrics(labels={"book_id": "abc"})
+    book_metrics.incr("page_loads")
+    book_metrics.incr("page_loads")
+    book_metrics.incr("intercepted_requests", action="mock")
+    book_metrics.observe("render_seconds", 1.5, format="epub")
+    book_metrics.observe("render_seconds", 0.5, format="epub")
+    summary = book_metrics.summary()
+    assert summary["counters"]["page_loads"] == 2
+    assert summary["counters"]['intercepted_requests{action="mock"}'] == 1
+    timer = summary["timers"]['render_seconds{format="epub"}']
+    assert timer["count"] == 2
+    assert timer["total"] == 2.0
+    assert timer["max"] == 1.5
+
+
+def test_dump_prometheus(tmp_path):
+    book_metrics1 = metrics.Metrics(labels={"book_id": "a"})
+    book_metrics1.incr("page_loads", 3)
+    book_metrics2 = metrics.Metrics(labels={"book_id": "b"})
+    book_metrics2.incr("page_loads")
+    with book_metrics2.timer("page_load_seconds"):
+        pass
+    save_path = str(tmp_path / "metrics.prom")
+    metrics.dump_prometheus(save_path, [book_metrics1, book_metrics2])
+    with open(save_path) as fp:
+        lines = fp.read().splitlines()
+    assert lines[0] == "# TYPE weread_exporter_page_load_seconds summary"
+    assert "# TYPE weread_exporter_page_loads_total counter" in lines
+    assert 'weread_exporter_page_loads_total{book_id="a"} 3' in lines
+    assert 'weread_exporter_page_loads_total{book_id="b"} 1' in lines
+    assert 'weread_exporter_page_load_seconds_count{book_id="b"} 1' in lines
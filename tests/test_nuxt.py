@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from weread_exporter import nuxt, utils
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_data(name):
+    with open(os.path.join(current_path, "data", name), encoding="utf-8") as fp:
+        return fp.read()
+
+
+def test_parse():
+    assert nuxt.parse(
+        "(function(a,b){return {x:a,y:[b,a,void 0],z:'\\u002F',w:!0}}(1,\"s\"))"
+    ) == {"x": 1, "y": ["s", 1, None], "z": "/", "w": True}
+    assert nuxt.parse("(function(){return {a:Array(2)}})()") == {"a": [None, None]}
+    assert nuxt.parse("{a:-1,b:+.5,c:-2e3}") == {
+        "a": -1,
+        "b": 0.5,
+        "c": -2000.0,
+    }
+    with pytest.raises(nuxt.NuxtParseError):
+        nuxt.extract_nuxt_state("<script>window.__NUXT__={x:-{}};</script>")
+    with pytest.raises(RuntimeError):
+        utils.parse_book_list("<script>window.__NUXT__={x:-[]};</script>")
+
+
+def test_parse_book_list():
+    books, has_more = utils.parse_book_list(read_data("booklist.html"))
+    assert not has_more
+    assert [it["book_id"] for it in books] == ["3300045911", "695233", "26785321"]
+    assert books[0]["id"] == utils.wr_hash("3300045911")
+    assert books[0]["author"] == "岸见一郎"
+    assert books[0]["cover"].startswith("https://cdn.weread.qq.com/")
+    assert books[1]["title"] == '三体 },"全集"'
+    assert books[2]["title"] == "原则'Principles'"
+
+    books, has_more = utils.parse_book_list(read_data("booklist_paged.html"))
+    assert has_more
+    assert [it["title"] for it in books] == ["第一本", "第二本"]
+
+
+def test_parse_large_book_list():
+    entities = ",".join(
+        '"%d":{bookId:"%d",title:"书%d",author:a}' % (i, i, i)
+        for i in range(100000, 105000)
+    )
+    html = (
+        "<script>window.__NUXT__=(function(a){return {state:{booklist:"
+        '{bookEntities:{%s}}}}}("author"));</script>' % entities
+    )
+    books, _ = utils.parse_book_list(html)
+    assert len(books) == 5000
+    assert books[-1]["title"] == "书104999"
+    assert books[-1]["author"] == "author"
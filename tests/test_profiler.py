@@ -0,0 +1,92 @@
+import asyncio
+import os
+import pstats
+import time
+
+import pytest
+
+from weread_exporter import pipeline, profiler
+from weread_exporter.__main__ import create_parser
+
+
+def busy_loop(seconds):
+    time0 = time.time()
+    while time.time() - time0 < seconds:
+        pass
+
+
+def test_cprofile_stage(tmp_path):
+    book_profiler = profiler.create_profiler("cprofile", ["render"])
+    book_profiler.start()
+    busy_loop(0.01)
+    with book_profiler.stage("render"):
+        busy_loop(0.01)
+    save_path = book_profiler.stop(str(tmp_path / "profile"))
+    assert save_path.endswith(".prof")
+    stats = pstats.Stats(save_path)
+    assert stats.total_calls > 0
+
+
+def test_sampling_profiler(tmp_path):
+    book_profiler = profiler.create_profiler("sampling")
+    book_profiler.start()
+    busy_loop(0.2)
+    save_path = book_profiler.stop(str(tmp_path / "profile"))
+    with open(save_path) as fp:
+        text = fp.read()
+    assert "busy_loop" in text
+
+
+def test_null_profiler(tmp_path):
+    book_profiler = profiler.create_profiler(None)
+    book_profiler.start()
+    with book_profiler.stage("render"):
+        pass
+    assert book_profiler.stop(str(tmp_path / "profile")) is None
+    assert not os.listdir(str(tmp_path))
+
+
+def test_pipeline_profiler(tmp_path, monkeypatch):
+    args = create_parser().parse_args(["-b", "abc", "-o", "txt"])
+    args.profile = "sampling"
+    export_pipeline = pipeline.ExportPipeline(
+        args, cache_dir=str(tmp_path / "cache"), output_dir=str(tmp_path / "output")
+    )
+    book_profilers = []
+
+    def create_profiler(mode, stages=None):
+        book_profilers.append(profiler.SamplingProfiler(stages))
+        return book_profilers[-1]
+
+    valid = []
+
+    async def is_valid(book_id):
+        return bool(valid)
+
+    async def get_page(book_id, book_metrics):
+        raise RuntimeError("Launch failed")
+
+    monkeypatch.setattr(profiler, "create_profiler", create_profiler)
+    monkeypatch.setattr(export_pipeline._metadata, "is_valid", is_valid)
+    monkeypatch.setattr(export_pipeline, "_get_page", get_page)
+    # invalid book is not profiled
+    assert asyncio.run(export_pipeline.export_book("abc")) is None
+    assert not book_profilers[-1]._thread
+    valid.append(True)
+    with pytest.raises(RuntimeError):
+        asyncio.run(export_pipeline.export_book("abc"))
+    assert not book_profilers[-1]._enabled
+    assert not book_profilers[-1]._thread
+    export_pipeline._image_store.close()
+
+
+def test_check_profiler(monkeypatch, capsys):
+    from weread_exporter.__main__ import parse_args
+
+    profiler.check_profiler("sampling")
+    monkeypatch.setattr(profiler.YappiProfiler, "requires", "missing_yappi")
+    with pytest.raises(ImportError):
+        profiler.check_profiler("yappi")
+    with pytest.raises(SystemExit):
+        parse_args(create_parser(), ["-b", "abc", "--profile", "yappi"])
+    assert "requires missing_yappi package" in capsys.readouterr().err
@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+from aiohttp import test_utils
+
+from weread_exporter import server, utils
+from weread_exporter.__main__ import create_parser
+
+
+def test_export_jobs(tmp_path, monkeypatch):
+    args = create_parser(serve=True).parse_args(["-o", "txt", "--max-attempts", "1"])
+
+    async def export_book(book_id, output_formats=None):
+        if book_id == "invalid":
+            return None
+        if book_id == "error":
+            raise RuntimeError("Load failed")
+        return {
+            "book_id": book_id,
+            "title": "test",
+            "outputs": {"txt": str(tmp_path / "test.txt")},
+        }
+
+    async def get_book_list(book_list_id):
+        raise RuntimeError("Fetch url failed")
+
+    monkeypatch.setattr(utils, "get_book_list", get_book_list)
+    cache_dir = str(tmp_path / "cache")
+
+    async def run():
+        export_server = server.ExportServer(
+            args, cache_dir=cache_dir, output_dir=str(tmp_path / "output")
+        )
+        assert os.path.isfile(os.path.join(cache_dir, "jobs.db"))
+        export_server._pipeline.export_book = export_book
+        await export_server.start()
+        client = test_utils.TestClient(
+            test_utils.TestServer(export_server.create_app())
+        )
+        await client.start_server()
+        try:
+            rsp = await client.post("/jobs", json={"book_id": "abc"})
+            assert rsp.status == 201
+            job = (await rsp.json())["jobs"][0]
+            assert job["status"] == "queued"
+            assert job["formats"] == ["txt"]
+            rsp = await client.post("/jobs", json={"book_id": "invalid"})
+            invalid_job = (await rsp.json())["jobs"][0]
+            rsp = await client.post("/jobs", json={"book_id": "error"})
+            error_job = (await rsp.json())["jobs"][0]
+            rsp = await client.post("/jobs", json={"formats": ["txt"]})
+            assert rsp.status == 400
+            rsp = await client.post("/jobs", json=["abc"])
+            assert rsp.status == 400
+            rsp = await client.post("/jobs", json={"book_list_id": "1_2"})
+            assert rsp.status == 502
+            await asyncio.sleep(0.1)
+            rsp = await client.get("/jobs/%s" % job["id"])
+            job = await rsp.json()
+            assert job["status"] == "done"
+            assert job["result"]["outputs"]["txt"] == str(tmp_path / "test.txt")
+            rsp = await client.get("/jobs/%s" % invalid_job["id"])
+            assert (await rsp.json())["status"] == "dead"
+            rsp = await client.get("/jobs/%s" % error_job["id"])
+            job = await rsp.json()
+            assert job["status"] == "dead"
+            assert job["error"] == "Load failed"
+            rsp = await client.get("/jobs")
+            assert len((await rsp.json())["jobs"]) == 3
+            rsp = await client.get("/jobs", params={"status": "dead"})
+            assert len((await rsp.json())["jobs"]) == 2
+            rsp = await client.get("/sessions")
+            assert (await rsp.json())["sessions"][0]["name"] == "default"
+        finally:
+            await client.close()
+            await export_server.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from weread_exporter import sessions, utils
+
+
+def test_rate_budget(tmp_path):
+    session = sessions.Session("a", str(tmp_path / "a.txt"), rate=60, burst=2)
+    assert session.get_delay() == 0
+    session._tokens -= 2
+    assert 0.9 < session.get_delay() <= 1
+    unlimited = sessions.Session("b", str(tmp_path / "b.txt"))
+    unlimited._tokens -= 10
+    assert unlimited.get_delay() == 0
+
+
+def test_health_state(tmp_path):
+    cookie_path = str(tmp_path / "cookie.txt")
+    with open(cookie_path, "w") as fp:
+        fp.write("wr_vid=1")
+    os.utime(cookie_path, (time.time() - 10, time.time() - 10))
+    session = sessions.Session("default", cookie_path)
+    assert session.healthy
+    asyncio.run(session.mark_login_required("Login timeout"))
+    assert session.status == sessions.Session.STATUS_LOGIN_REQUIRED
+    # state is shared with other processes
+    session = sessions.Session("default", cookie_path)
+    assert not session.healthy
+    assert session.summary()["error"] == "Login timeout"
+    # login again
+    utils.atomic_write(cookie_path, "wr_vid=2")
+    os.utime(cookie_path, (time.time() + 1, time.time() + 1))
+    assert session.healthy
+
+
+def test_session_pool(tmp_path):
+    cache_dir = str(tmp_path)
+    os.makedirs(os.path.join(cache_dir, "sessions"))
+    for name in ("alice", "bob"):
+        with open(os.path.join(cache_dir, "sessions", name + ".txt"), "w") as fp:
+            fp.write("wr_vid=1")
+    pool = sessions.SessionPool(cache_dir)
+    assert [it.name for it in pool] == ["default", "alice", "bob"]
+
+    pool = sessions.SessionPool(cache_dir, names=["alice", "bob"])
+    other_pool = sessions.SessionPool(cache_dir, names=["alice", "bob"])
+    session = pool.acquire()
+    assert session.name == "alice"
+    # another process prefers a session not in use
+    assert other_pool.acquire().name == "bob"
+    for it in other_pool:
+        asyncio.run(it.mark_invalid("User 1 not found"))
+    assert not session.healthy
+    with pytest.raises(utils.NoHealthySessionError):
+        pool.acquire()
+    pool.release(session)
+
+
+def test_verified(tmp_path):
+    cookie_path = str(tmp_path / "cookie.txt")
+    utils.atomic_write(cookie_path, "wr_vid=1")
+    os.utime(cookie_path, (time.time() - 10, time.time() - 10))
+    session = sessions.Session("default", cookie_path, ttl=3600)
+    assert not session.verified
+    asyncio.run(session.mark_verified(time.time() + 86400))
+    assert session.verified
+    assert sessions.Session("default", cookie_path, ttl=3600).verified
+    assert not sessions.Session("default", cookie_path, ttl=-1).verified
+
+    asyncio.run(session.mark_verified(time.time() + 30))
+    assert not session.verified
+    asyncio.run(session.mark_verified())
+    assert session.verified
+    # cookies without known expiry are trusted for a short time only
+    session._state["verified"] = time.time() - session.unknown_expiry_ttl - 1
+    assert not session.verified
+    asyncio.run(session.mark_verified(time.time() + 86400))
+    asyncio.run(session.invalidate_verification())
+    assert not session.verified
+    assert not sessions.Session("default", cookie_path, ttl=3600).verified
+    asyncio.run(session.mark_verified(time.time() + 86400))
+    asyncio.run(session.mark_login_required("Login timeout"))
+    assert not session.verified
@@ -1,6 +1,15 @@
 
-from weread_exporter import utils
+from weread_exporter import utils, webpage
 
 def test_wr_hash():
     assert utils.wr_hash("42557145") == "f343248072895ed9f34f408"
     assert utils.wr_hash("14") == "aab325601eaab3238922e53"
+    assert utils.wr_hash("42557145") == utils.wr_hash.__wrapped__("42557145")
+
+
+def test_make_chapter_urls():
+    urls = webpage.make_chapter_urls("https://weread.qq.com", "abc", [42557145, 14])
+    assert urls == [
+        "https://weread.qq.com/web/reader/abckf343248072895ed9f34f408",
+        "https://weread.qq.com/web/reader/abckaab325601eaab3238922e53",
+    ]
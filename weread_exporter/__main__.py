@@ -24,19 +24,31 @@ def patch_generateRequestHash():
     network_manager.generateRequestHash = patched_generateRequestHash
 
 
-async def async_main():
-    from . import export, utils, webpage
+def create_parser(serve=False):
+    from . import formats, profiler
 
     parser = argparse.ArgumentParser(
         prog="weread-exporter", description="WeRead book export cmdline tool"
     )
-    parser.add_argument("-b", "--book-id", help="book id", required=True)
+    if serve:
+        parser.prog += " serve"
+        parser.add_argument(
+            "--listen",
+            help="listen address of job api, e.g. 127.0.0.1:8000",
+            default="127.0.0.1:8000",
+        )
+        parser.add_argument(
+            "--unix-socket",
+            help="listen on unix socket instead of tcp address",
+        )
+    else:
+        parser.add_argument("-b", "--book-id", help="book id", required=True)
     parser.add_argument(
         "-o",
         "--output-format",
         help="output file format",
         action="append",
-        choices=["md", "epub", "pdf", "mobi", "txt"],
+        choices=formats.get_format_names(),
     )
     parser.add_argument(
         "--load-timeout",
@@ -50,10 +62,28 @@ async def async_main():
         type=int,
         default=30,
     )
+    parser.add_argument(
+        "--format-workers",
+        help="processes used to generate output formats concurrently, 0 means auto",
+        type=int,
+        default=0,
+    )
     parser.add_argument(
         "--css-file",
         help="overide default css style",
     )
+    parser.add_argument(
+        "--front-matter",
+        help="start md output with book info and table of contents",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--partial",
+        help="record missing chapters as gaps in md output instead of failing",
+        action="store_true",
+        default=False,
+    )
     parser.add_argument(
         "--headless", help="chrome headless", action="store_true", default=False
     )
@@ -66,6 +96,24 @@ async def async_main():
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--no-persist-profile",
+        help="launch chrome with a temporary profile instead of cache/profiles",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--disk-cache-size",
+        help="chrome http disk cache size in MB",
+        type=int,
+        default=256,
+    )
+    parser.add_argument(
+        "--capture-only",
+        help="launch chrome without gpu, images, web fonts and animations",
+        action="store_true",
+        default=False,
+    )
     parser.add_argument(
         "--mock-user-agent",
         help="use mock user-agent",
@@ -76,17 +124,135 @@ async def async_main():
         "--proxy-server",
         help="http proxy server, e.g. http://127.0.0.1:8888",
     )
-    args = parser.parse_args()
-    args.output_format = args.output_format or ["epub"]
-    if "mobi" in args.output_format and "epub" not in args.output_format:
-        args.output_format.append("epub")
+    parser.add_argument(
+        "--session",
+        help="account sessions to use, cookie of each is saved in "
+        "cache/sessions/<name>.txt, all sessions are used by default",
+        action="append",
+    )
+    parser.add_argument(
+        "--session-rate",
+        help="chapters each account loads per minute at most, 0 means no limit",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--session-ttl",
+        help="seconds to trust a verified session without checking user on launch",
+        type=int,
+        default=3600,
+    )
+    parser.add_argument(
+        "--prefetch",
+        help="load next chapter in a second tab while exporting current one",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--prometheus-file",
+        help="save metrics of all books in prometheus text format",
+    )
+    parser.add_argument(
+        "--profile",
+        help="profile each book and save the result to cache/<book_id>",
+        choices=sorted(profiler.profilers.keys()),
+    )
+    parser.add_argument(
+        "--profile-stage",
+        help="only profile the given stage, profile all stages by default",
+        action="append",
+        choices=["export_markdown", "pre_process_markdown", "render"],
+    )
+    parser.add_argument(
+        "--profile-js",
+        help="profile hook.js with chrome cpu profiler",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--metadata-concurrency",
+        help="book detail pages fetched concurrently for a booklist",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--metadata-ttl",
+        help="seconds to cache book validity and meta data",
+        type=int,
+        default=24 * 3600,
+    )
+    parser.add_argument(
+        "--max-attempts",
+        help="give up a book after failing so many times",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "--retry-delay",
+        help="seconds to wait before first retry, doubled on each failure",
+        type=int,
+        default=30,
+    )
+    parser.add_argument(
+        "--packed-chapters",
+        help="keep chapters of a book in a single sqlite file instead of md files",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--cache-compression",
+        help="compress cached chapters and text resources, e.g. gzip or "
+        "chapter=zstd, content types are chapter/script/style/data",
+        action="append",
+    )
+    if not serve:
+        parser.add_argument(
+            "--collect-garbage",
+            help="remove shared images no longer used by any book after exporting",
+            action="store_true",
+            default=False,
+        )
+    parser.add_argument(
+        "--resume",
+        help="only trust chapters recorded in the progress journal",
+        action="store_true",
+        default=False,
+    )
+    return parser
+
+
+def parse_args(parser, argv):
+    from . import profiler
 
-    extra_css = None
-    if args.css_file:
-        if not os.path.isfile(args.css_file):
-            raise RuntimeError("CSS file %s not exist" % args.css_file)
-        with open(args.css_file) as fp:
-            extra_css = fp.read()
+    args = parser.parse_args(argv)
+    if args.profile:
+        # fail now instead of in every book
+        try:
+            profiler.check_profiler(args.profile)
+        except ImportError as ex:
+            parser.error(str(ex))
+    return args
+
+
+async def async_main(argv=None):
+    from . import jobqueue, pipeline, utils
+
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["serve"]:
+        from . import server
+
+        args = parse_args(create_parser(serve=True), argv[1:])
+        return await server.serve(args)
+
+    args = parse_args(create_parser(), argv)
+    export_pipeline = pipeline.ExportPipeline(args)
+    for output_format in export_pipeline.output_formats:
+        if not output_format.check_platform():
+            logging.error(
+                "Only %s system supported to export %s format"
+                % ("/".join(output_format.platforms), output_format.name)
+            )
+            return -1
 
     if "_" in args.book_id:
         # book list id
@@ -94,92 +260,37 @@ async def async_main():
     else:
         book_list = [args.book_id]
 
+    job_queue = jobqueue.JobQueue(
+        os.path.join("cache", "jobs.db"),
+        max_attempts=args.max_attempts,
+        backoff_base=args.retry_delay,
+    )
+    job_queue.recover()
     for book_id in book_list:
-        logging.info("Exporting book %s" % book_id)
-        page = webpage.WeReadWebPage(
-            book_id,
-            cookie_path=os.path.join("cache", "cookie.txt"),
-            webcache_path="cache",
-        )
-        if not await page.check_valid():
-            logging.warning("Book %s status is invalid, stop exporting" % book_id)
-            continue
-        save_path = os.path.join("cache", book_id)
-        output_dir = "output"
-        if not os.path.isdir(output_dir):
-            os.mkdir(output_dir)
-        exporter = export.WeReadExporter(page, save_path)
+        job_queue.add(book_id)
+    try:
+        if len(book_list) > 1:
+            await export_pipeline.prefetch_metadata(book_list)
         while True:
-            try:
-                await page.launch(
-                    headless=args.headless,
-                    force_login=args.force_login,
-                    use_default_profile=args.use_default_profile,
-                    mock_user_agent=args.mock_user_agent,
-                    proxy_server=args.proxy_server,
-                )
-            except RuntimeError:
-                logging.exception("Launch book %s home page failed" % book_id)
-                await asyncio.sleep(2)
+            job = job_queue.claim(book_list)
+            if job:
+                await export_pipeline.run_job(job_queue, job)
+                job = job_queue.get(job["id"])
+                if job["status"] == jobqueue.JobQueue.STATUS_DEAD:
+                    logging.error(
+                        "Export book %s failed: %s" % (job["book_id"], job["error"])
+                    )
                 continue
-
-            try:
-                await exporter.export_markdown(args.load_timeout, args.load_interval)
-            except utils.LoadChapterFailedError:
-                logging.warning("Load chapter failed, close browser and retry")
-                await page.close()
-            else:
-                await page.close()
+            delay = job_queue.get_next_delay(book_list)
+            if delay is None:
                 break
-
-        await exporter.pre_process_markdown()
-        title = await exporter.get_book_title()
-        title = utils.format_filename(title)
-        if "epub" in args.output_format:
-            save_path = os.path.join(output_dir, "%s.epub" % title)
-            if os.path.isfile(save_path):
-                logging.info("File %s exist, ignore export" % save_path)
-            else:
-                await exporter.markdown_to_epub(save_path, extra_css=extra_css)
-                logging.info("Save file %s complete" % save_path)
-
-        if "pdf" in args.output_format:
-            save_path = os.path.join(output_dir, "%s.pdf" % title)
-            if os.path.isfile(save_path):
-                logging.info("File %s exist, ignore export" % save_path)
-            else:
-                image_format = "jpg"
-                if sys.platform == "win32":
-                    image_format = "png"
-                await exporter.markdown_to_pdf(
-                    save_path,
-                    extra_css=extra_css,
-                    image_format=image_format,
-                )
-                logging.info("Save file %s complete" % save_path)
-
-        if "mobi" in args.output_format:
-            if sys.platform != "linux":
-                logging.error("Only linux system supported to export mobi format")
-                return -1
-            epub_path = os.path.join(output_dir, "%s.epub" % title)
-            save_path = os.path.join(output_dir, "%s.mobi" % title)
-            if os.path.isfile(save_path):
-                logging.info("File %s exist, ignore export" % save_path)
-            else:
-                await exporter.epub_to_mobi(epub_path, save_path)
-                if not os.path.isfile(save_path):
-                    logging.warning("Create mobi file failed")
-                    continue
-                logging.info("Save file %s complete" % save_path)
-
-        if "txt" in args.output_format:
-            save_path = os.path.join(output_dir, "%s.txt" % title)
-            if os.path.isfile(save_path):
-                logging.info("File %s exist, ignore export" % save_path)
-            else:
-                await exporter.markdown_to_txt(save_path)
-                logging.info("Save file %s complete" % save_path)
+            await asyncio.sleep(delay)
+        if args.collect_garbage:
+            await export_pipeline.collect_garbage()
+    finally:
+        await export_pipeline.close()
+        await utils.close_session()
+        job_queue.close()
     return 0
 
 
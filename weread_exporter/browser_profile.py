@@ -0,0 +1,114 @@
+"""
+Chrome profile reused across launches
+"""
+
+import logging
+import os
+import shutil
+import sys
+import time
+
+from . import utils
+
+
+class BrowserProfile(object):
+    """Per-account chrome user data directory under cache/profiles
+
+    Every process takes a lock on the directory it uses, concurrent
+    workers of the same account get their own numbered slot.
+    """
+
+    max_slots = 16
+    # Directories safe to drop when a profile grows beyond its size limit
+    cache_dirs = (
+        os.path.join("Default", "Cache"),
+        os.path.join("Default", "Code Cache"),
+        os.path.join("Default", "Service Worker", "CacheStorage"),
+        "GrShaderCache",
+        "ShaderCache",
+    )
+
+    def __init__(self, root, account, disk_cache_size=256, max_age=30):
+        self._root = root
+        self._account = utils.format_filename(str(account or "anonymous"))
+        self._disk_cache_size = disk_cache_size * 1024 * 1024
+        self._max_age = max_age * 24 * 3600
+        self._path = None
+        self._lock = None
+        if not os.path.isdir(self._root):
+            os.makedirs(self._root)
+
+    @property
+    def path(self):
+        return self._path
+
+    def get_chrome_args(self):
+        return [
+            "--user-data-dir=%s" % os.path.abspath(self._path),
+            "--disk-cache-size=%d" % self._disk_cache_size,
+        ]
+
+    def acquire(self):
+        for i in range(self.max_slots):
+            name = self._account if i == 0 else "%s-%d" % (self._account, i)
+            path = os.path.join(self._root, name)
+            lock = utils.try_lock_file(path + ".lock")
+            if not lock:
+                continue
+            self._path, self._lock = path, lock
+            os.utime(path + ".lock")
+            if not os.path.isdir(path):
+                logging.info("[%s] Create profile %s" % (self.__class__.__name__, path))
+                os.makedirs(path)
+            else:
+                self.trim()
+            return path
+        raise RuntimeError("No free profile slot of account %s" % self._account)
+
+    def release(self):
+        if self._lock:
+            utils.unlock_file(self._lock)
+            self._lock = None
+
+    def trim(self):
+        """Drop cached data when the profile exceeds twice the disk cache size"""
+        size = utils.get_dir_size(self._path)
+        if size <= self._disk_cache_size * 2:
+            return
+        logging.info(
+            "[%s] Profile %s size %d exceeds limit, clean cache"
+            % (self.__class__.__name__, self._path, size)
+        )
+        for it in self.cache_dirs:
+            shutil.rmtree(os.path.join(self._path, it), ignore_errors=True)
+
+    def cleanup(self):
+        """Remove profiles not used for max_age seconds"""
+        for it in os.listdir(self._root):
+            lock_path = os.path.join(self._root, it)
+            if not it.endswith(".lock"):
+                continue
+            if time.time() - os.path.getmtime(lock_path) < self._max_age:
+                continue
+            lock = utils.try_lock_file(lock_path)
+            if not lock:
+                continue
+            try:
+                logging.info(
+                    "[%s] Remove expired profile %s"
+                    % (self.__class__.__name__, lock_path[:-5])
+                )
+                shutil.rmtree(lock_path[:-5], ignore_errors=True)
+                if sys.platform != "win32":
+                    # remove it while locked, so nobody takes the profile
+                    # between unlock and remove
+                    os.remove(lock_path)
+            finally:
+                utils.unlock_file(lock)
+            if sys.platform == "win32":
+                # a locked file can not be removed on windows
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    # opened by another process meanwhile
+                    pass
@@ -0,0 +1,254 @@
+"""
+Storage of chapter contents
+
+A chapter has up to three versions: the raw markdown saved from the reader
+page, the processed markdown with local images, and the rendered html. The
+file store keeps the historical chapters/<n>-<id>.md(.bak) layout, the packed
+store keeps all versions of a book in a single sqlite database.
+"""
+
+import io
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import time
+
+from . import compression, utils
+
+VERSION_RAW = "raw"
+VERSION_PROCESSED = "processed"
+VERSION_HTML = "html"
+
+
+class ChapterStore(object):
+    cache_rendered = False
+
+    def read(self, index, chapter_id, version=None):
+        """Return data of chapter, the latest markdown if version is None"""
+        raise NotImplementedError(self.__class__.__name__)
+
+    def write(self, index, chapter_id, data, version):
+        raise NotImplementedError(self.__class__.__name__)
+
+    def get_size(self, index, chapter_id):
+        """Size of the latest markdown, None if chapter not exist"""
+        raise NotImplementedError(self.__class__.__name__)
+
+    def open(self, index, chapter_id):
+        """Open the latest markdown for streaming read, None if chapter not exist"""
+        data = self.read(index, chapter_id)
+        if data is None:
+            return None
+        return io.BytesIO(data)
+
+    def describe(self, index, chapter_id):
+        raise NotImplementedError(self.__class__.__name__)
+
+    def close(self):
+        pass
+
+
+class FileChapterStore(ChapterStore):
+    """One markdown file per chapter, raw version is kept in a .bak twin"""
+
+    _FILE_NAME_RE = re.compile(r"^(\d+)-(.+)\.md(\.gz|\.zst)?$")
+
+    def __init__(self, chapter_dir, codec=None):
+        self._chapter_dir = chapter_dir
+        self._codec = codec
+
+    def _get_path(self, index, chapter_id):
+        return os.path.join(self._chapter_dir, "%d-%s.md" % (index + 1, chapter_id))
+
+    def read(self, index, chapter_id, version=None):
+        path = self._get_path(index, chapter_id)
+        if version == VERSION_HTML:
+            return None
+        if version == VERSION_RAW and compression.exists(path + ".bak"):
+            return compression.read_file(path + ".bak")
+        if version == VERSION_PROCESSED and not compression.exists(path + ".bak"):
+            return None
+        return compression.read_file(path)
+
+    def write(self, index, chapter_id, data, version):
+        if version == VERSION_HTML:
+            return
+        if not os.path.isdir(self._chapter_dir):
+            os.makedirs(self._chapter_dir)
+        path = self._get_path(index, chapter_id)
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        if version == VERSION_RAW:
+            compression.write_file(path, data, self._codec)
+            # Stale raw copy of a previous export
+            compression.remove_file(path + ".bak")
+        else:
+            if not compression.exists(path + ".bak"):
+                compression.rename_file(path, path + ".bak")
+            compression.write_file(path, data, self._codec)
+
+    def open(self, index, chapter_id):
+        return compression.open_file(self._get_path(index, chapter_id))
+
+    def get_size(self, index, chapter_id):
+        return compression.get_size(self._get_path(index, chapter_id))
+
+    def get_mtime(self, index, chapter_id):
+        """Modified time of the latest markdown, None if chapter not exist"""
+        real_path = compression.find_file(self._get_path(index, chapter_id))[0]
+        return os.path.getmtime(real_path) if real_path else None
+
+    def describe(self, index, chapter_id):
+        return self._get_path(index, chapter_id)
+
+    def iter_chapters(self):
+        """Yield (index, chapter_id) of chapters in directory"""
+        if not os.path.isdir(self._chapter_dir):
+            return
+        for file_name in os.listdir(self._chapter_dir):
+            match = self._FILE_NAME_RE.match(file_name)
+            if match:
+                yield int(match.group(1)) - 1, match.group(2)
+
+
+class PackedChapterStore(ChapterStore):
+    """All chapter versions of a book in one sqlite database"""
+
+    cache_rendered = True
+
+    def __init__(self, path, codec=None):
+        self._path = path
+        self._codec = codec
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA mmap_size=268435456")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chapters ("
+                "chapter_id TEXT NOT NULL, version TEXT NOT NULL, "
+                "idx INTEGER NOT NULL, data BLOB NOT NULL, hash TEXT NOT NULL, "
+                "size INTEGER NOT NULL, time REAL NOT NULL, "
+                "codec TEXT, PRIMARY KEY (chapter_id, version))"
+            )
+            columns = self._conn.execute("PRAGMA table_info(chapters)").fetchall()
+            if "codec" not in [it[1] for it in columns]:
+                self._conn.execute("ALTER TABLE chapters ADD COLUMN codec TEXT")
+
+    def _select(self, columns, chapter_id, versions):
+        for version in versions:
+            row = self._conn.execute(
+                "SELECT %s FROM chapters WHERE chapter_id=? AND version=?" % columns,
+                (str(chapter_id), version),
+            ).fetchone()
+            if row:
+                return row
+        return None
+
+    def read(self, index, chapter_id, version=None):
+        versions = (version,) if version else (VERSION_PROCESSED, VERSION_RAW)
+        row = self._select("data, codec", chapter_id, versions)
+        if not row:
+            return None
+        return compression.decompress(row[0], row[1])
+
+    def write(self, index, chapter_id, data, version):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        with self._conn:
+            if version == VERSION_RAW:
+                self._conn.execute(
+                    "DELETE FROM chapters WHERE chapter_id=?", (str(chapter_id),)
+                )
+            elif version == VERSION_PROCESSED:
+                self._conn.execute(
+                    "DELETE FROM chapters WHERE chapter_id=? AND version=?",
+                    (str(chapter_id), VERSION_HTML),
+                )
+            self._conn.execute(
+                "REPLACE INTO chapters (chapter_id, version, idx, data, hash, size, "
+                "time, codec) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(chapter_id),
+                    version,
+                    index,
+                    compression.compress(data, self._codec),
+                    utils.md5(data),
+                    len(data),
+                    time.time(),
+                    self._codec,
+                ),
+            )
+
+    def get_size(self, index, chapter_id):
+        row = self._select("size", chapter_id, (VERSION_PROCESSED, VERSION_RAW))
+        return row[0] if row else None
+
+    def describe(self, index, chapter_id):
+        return "%s#%s" % (self._path, chapter_id)
+
+    def import_files(self, file_store, newer_only=False):
+        """Copy chapters of a file store into this store
+
+        With newer_only a chapter is skipped if this store saved it after the
+        file was written.
+        """
+        count = 0
+        for index, chapter_id in file_store.iter_chapters():
+            if newer_only:
+                row = self._select(
+                    "time", chapter_id, (VERSION_PROCESSED, VERSION_RAW)
+                )
+                if row and row[0] >= file_store.get_mtime(index, chapter_id):
+                    continue
+            raw_data = file_store.read(index, chapter_id, VERSION_RAW)
+            processed_data = file_store.read(index, chapter_id, VERSION_PROCESSED)
+            self.write(index, chapter_id, raw_data, VERSION_RAW)
+            if processed_data is not None:
+                self.write(index, chapter_id, processed_data, VERSION_PROCESSED)
+            count += 1
+        return count
+
+    def close(self):
+        self._conn.close()
+
+
+def open_chapter_store(save_dir, packed=None, codec=None):
+    """Open chapter store of a book
+
+    With packed=None the packed store is used only if the book already has one.
+    Chapter files are moved into the packed store, files written after the
+    store was created, e.g. by an older process in file mode, are merged into
+    it. Chapters are compressed with codec when written, existing ones are
+    read in any codec.
+    """
+    chapter_dir = os.path.join(save_dir, "chapters")
+    db_path = os.path.join(save_dir, "chapters.db")
+    if packed is None:
+        packed = os.path.isfile(db_path)
+    if not packed:
+        return FileChapterStore(chapter_dir, codec)
+    if not os.path.isfile(db_path) and os.path.isdir(chapter_dir):
+        temp_path = db_path + ".tmp"
+        for path in (temp_path, temp_path + "-wal", temp_path + "-shm"):
+            if os.path.isfile(path):
+                os.remove(path)
+        store = PackedChapterStore(temp_path, codec)
+        count = store.import_files(FileChapterStore(chapter_dir))
+        store.close()
+        os.replace(temp_path, db_path)
+        shutil.rmtree(chapter_dir)
+        logging.info("Moved %d chapter files into %s" % (count, db_path))
+        return PackedChapterStore(db_path, codec)
+    store = PackedChapterStore(db_path, codec)
+    if os.path.isdir(chapter_dir):
+        try:
+            file_store = FileChapterStore(chapter_dir)
+            count = store.import_files(file_store, newer_only=True)
+        except:
+            store.close()
+            raise
+        shutil.rmtree(chapter_dir)
+        logging.info("Merged %d chapter files into %s" % (count, db_path))
+    return store
@@ -0,0 +1,184 @@
+"""
+Transparent compression of cached files
+
+A compressed file is saved with the suffix of its codec. Readers look for
+every suffix, so plain and compressed files can be mixed in the same cache.
+zstd requires the optional zstandard package.
+"""
+
+import gzip
+import io
+import os
+import struct
+
+from . import utils
+
+CODECS = ("gzip", "zstd")
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+CONTENT_TYPES = {
+    "chapter": (),
+    "script": (".js", ".mjs"),
+    "style": (".css",),
+    "data": (".json", ".html", ".htm", ".svg", ".txt", ".xml"),
+}
+
+
+def _import_zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd compression requires zstandard package")
+    return zstandard
+
+
+def compress(data, codec):
+    if not codec:
+        return data
+    if codec == "gzip":
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as fp:
+            fp.write(data)
+        return buffer.getvalue()
+    if codec == "zstd":
+        return _import_zstd().ZstdCompressor(level=10).compress(data)
+    raise ValueError("Unsupported codec %s" % codec)
+
+
+def decompress(data, codec):
+    if not codec:
+        return data
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        return _import_zstd().ZstdDecompressor().decompress(data)
+    raise ValueError("Unsupported codec %s" % codec)
+
+
+def find_file(path):
+    """Return (real_path, codec) of path or its compressed variant"""
+    if os.path.isfile(path):
+        return path, None
+    for codec in CODECS:
+        if os.path.isfile(path + SUFFIXES[codec]):
+            return path + SUFFIXES[codec], codec
+    return None, None
+
+
+def exists(path):
+    return find_file(path)[0] is not None
+
+
+def open_file(path):
+    """Open path, or its compressed variant, for streaming read"""
+    real_path, codec = find_file(path)
+    if not real_path:
+        return None
+    if codec == "gzip":
+        return gzip.open(real_path, "rb")
+    if codec == "zstd":
+        return _import_zstd().ZstdDecompressor().stream_reader(
+            open(real_path, "rb"), closefd=True
+        )
+    return open(real_path, "rb")
+
+
+def get_size(path):
+    """Uncompressed size of path or its compressed variant, None if not exist
+
+    The size is taken from the gzip trailer or the zstd frame header, only a
+    zstd frame without content size is decompressed, in chunks.
+    """
+    real_path, codec = find_file(path)
+    if not real_path:
+        return None
+    if codec == "gzip":
+        # ISIZE of the single member written by compress
+        with open(real_path, "rb") as fp:
+            fp.seek(0, os.SEEK_END)
+            if fp.tell() < 18:
+                return 0
+            fp.seek(-4, os.SEEK_END)
+            return struct.unpack("<I", fp.read(4))[0]
+    if codec == "zstd":
+        with open(real_path, "rb") as fp:
+            size = _import_zstd().frame_content_size(fp.read(18))
+        if size >= 0:
+            return size
+    if codec:
+        size = 0
+        with open_file(path) as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                size += len(chunk)
+        return size
+    return os.path.getsize(real_path)
+
+
+def read_file(path):
+    """Read the whole content, use open_file for streaming read"""
+    fp = open_file(path)
+    if fp is None:
+        return None
+    with fp:
+        return fp.read()
+
+
+def remove_file(path):
+    for real_path in [path] + [path + it for it in SUFFIXES.values()]:
+        if os.path.isfile(real_path):
+            os.remove(real_path)
+
+
+def rename_file(src, dst):
+    """Rename src, or its compressed variant, keeping the codec suffix"""
+    real_path, codec = find_file(src)
+    remove_file(dst)
+    os.replace(real_path, dst + SUFFIXES.get(codec, ""))
+
+
+def write_file(path, data, codec=None):
+    """Atomically write data to path, compressed if codec is given"""
+    real_path = path + SUFFIXES.get(codec, "")
+    utils.atomic_write(real_path, compress(data, codec))
+    for it in [path] + [path + it for it in SUFFIXES.values()]:
+        if it != real_path and os.path.isfile(it):
+            os.remove(it)
+
+
+class CompressionPolicy(object):
+    """Codec used for each content type, e.g. {"chapter": "zstd", "script": "gzip"}"""
+
+    def __init__(self, codecs=None):
+        self._codecs = {}
+        for content_type, codec in (codecs or {}).items():
+            if content_type not in CONTENT_TYPES:
+                raise ValueError("Unsupported content type %s" % content_type)
+            if codec == "none":
+                continue
+            self._codecs[content_type] = codec
+            if codec not in CODECS:
+                raise ValueError("Unsupported codec %s" % codec)
+            if codec == "zstd":
+                _import_zstd()
+
+    @classmethod
+    def parse(cls, items):
+        """Parse ["gzip"] or ["chapter=zstd", "script=gzip", "data=none"]"""
+        codecs = {}
+        for item in items or ():
+            if "=" in item:
+                content_type, codec = item.split("=", 1)
+                codecs[content_type.strip()] = codec.strip()
+            else:
+                for content_type in CONTENT_TYPES:
+                    codecs[content_type] = item.strip()
+        return cls(codecs)
+
+    def get_codec(self, content_type):
+        return self._codecs.get(content_type)
+
+    def get_codec_for_path(self, path):
+        ext = os.path.splitext(path)[1].lower()
+        for content_type, exts in CONTENT_TYPES.items():
+            if ext in exts:
+                return self._codecs.get(content_type)
+        return None
@@ -5,75 +5,217 @@ import os
 import sys
 import time
 
-import bs4
-import markdown
-
-from ebooklib import epub
-from weasyprint import HTML, CSS
-
-from . import utils
+from . import chapterstore, fileio, journal, utils
+from .metrics import Metrics
 
 current_path = os.path.dirname(os.path.abspath(__file__))
 
 
 class WeReadExporter(object):
-    def __init__(self, page, save_dir):
+    def __init__(
+        self,
+        page,
+        save_dir,
+        resume=False,
+        metrics=None,
+        image_store=None,
+        packed=None,
+        chapter_codec=None,
+    ):
         self._page = page
         self._save_dir = save_dir
         if not os.path.isdir(save_dir):
             os.makedirs(save_dir)
         self._meta_path = os.path.join(self._save_dir, "meta.json")
-        self._chapter_dir = os.path.join(self._save_dir, "chapters")
         self._image_dir = os.path.join(self._save_dir, "images")
         if not os.path.isdir(self._image_dir):
             os.mkdir(self._image_dir)
         self._cover_image_path = os.path.join(self._save_dir, "cover.jpg")
         self._meta_data = {}
         self._current_chapter = 0
+        self._last_load_time = 0
+        self._resume = resume
+        self._metrics = metrics or Metrics()
+        self._image_store = image_store
+        self._journal = journal.ChapterJournal(
+            os.path.join(self._save_dir, "journal.json")
+        )
+        self._packed = packed
+        self._chapter_codec = chapter_codec
+        self._chapter_store = chapterstore.open_chapter_store(
+            save_dir, packed, chapter_codec
+        )
+
+    @property
+    def save_dir(self):
+        return self._save_dir
+
+    @property
+    def settings(self):
+        """Arguments to create an exporter of the same book in another process"""
+        return {"packed": self._packed, "chapter_codec": self._chapter_codec}
+
+    def _get_scratch_dir(self, name):
+        """Directory for temporary files of one output format"""
+        scratch_dir = os.path.join(self._save_dir, "scratch", name)
+        if not os.path.isdir(scratch_dir):
+            os.makedirs(scratch_dir)
+        return scratch_dir
+
+    def close(self):
+        self._chapter_store.close()
 
     async def get_book_title(self):
         meta_data = await self._load_meta_data()
         return meta_data["title"]
 
-    def _make_chapter_path(self, index, chapter_id):
-        return os.path.join(self._chapter_dir, "%d-%s.md" % (index + 1, chapter_id))
-
     async def _load_meta_data(self):
         if self._meta_data:
             return self._meta_data
 
-        if not os.path.isfile(self._meta_path):
+        text = await fileio.read_file(self._meta_path)
+        if text is None:
             self._meta_data = await self._page.get_book_info()
-            with open(self._meta_path, "w") as fp:
-                fp.write(json.dumps(self._meta_data))
+            await fileio.atomic_write(self._meta_path, json.dumps(self._meta_data))
         else:
-            with open(self._meta_path) as fp:
-                text = fp.read()
-                if text:
-                    self._meta_data = json.loads(text)
+            if text:
+                self._meta_data = json.loads(text.decode())
+            chapters = self._meta_data.get("chapters", [])
+            if self._page and any("url" not in it for it in chapters):
+                # meta.json saved by older versions
+                urls = self._page.get_chapter_urls([it["id"] for it in chapters])
+                for chapter, url in zip(chapters, urls):
+                    chapter["url"] = url
+                await fileio.atomic_write(
+                    self._meta_path, json.dumps(self._meta_data)
+                )
         return self._meta_data
 
-    async def merge_markdown(self, save_path):
+    async def _save_image(self, url, save_path):
+        if self._image_store:
+            object_path, size = await self._image_store.fetch(url)
+            await fileio.run(self._image_store.link, object_path, save_path)
+        else:
+            data = await utils.fetch(url)
+            size = len(data)
+            await fileio.atomic_write(save_path, data)
+        if size:
+            self._metrics.incr("images_downloaded")
+            self._metrics.incr("image_bytes", size)
+        else:
+            self._metrics.incr("image_store_hits")
+
+    def _read_chapter(self, index, chapter):
+        data = self._chapter_store.read(index, chapter["id"])
+        if data is None:
+            raise RuntimeError(
+                "Chapter %s not exist"
+                % self._chapter_store.describe(index, chapter["id"])
+            )
+        return data.decode()
+
+    def _make_front_matter(self, meta_data):
+        lines = ["---"]
+        for key in ("title", "author"):
+            if meta_data.get(key):
+                value = json.dumps(meta_data[key], ensure_ascii=False)
+                lines.append("%s: %s" % (key, value))
+        lines += ["---", "", "# %s" % meta_data["title"], ""]
+        if meta_data.get("intro"):
+            lines += [meta_data["intro"], ""]
+        lines += ["## 目录", ""]
+        for chapter in meta_data["chapters"]:
+            lines.append(
+                "%s- %s" % ("  " * (chapter.get("level", 1) - 1), chapter["title"])
+            )
+        lines += ["", ""]
+        return "\n".join(lines)
+
+    def _merge_markdown(self, save_path, meta_data, front_matter, partial):
+        gaps = []
+        fd, temp_path = utils.make_temp_file(save_path)
+        try:
+            with os.fdopen(fd, "wb", buffering=1024 * 1024) as fp:
+                if front_matter:
+                    fp.write(self._make_front_matter(meta_data).encode("utf-8"))
+                for index, chapter in enumerate(meta_data["chapters"]):
+                    stream = self._chapter_store.open(index, chapter["id"])
+                    if stream is None:
+                        if not partial:
+                            raise RuntimeError(
+                                "Chapter %s not exist"
+                                % self._chapter_store.describe(index, chapter["id"])
+                            )
+                        gaps.append(
+                            {
+                                "index": index,
+                                "id": chapter["id"],
+                                "title": chapter["title"],
+                            }
+                        )
+                        gap = "<!-- missing chapter: %s -->\n\n" % chapter["title"]
+                        fp.write(gap.encode("utf-8"))
+                        continue
+                    with stream:
+                        utils.copy_stream(stream, fp)
+                    fp.write(b"\n")
+            os.replace(temp_path, save_path)
+        except:
+            os.remove(temp_path)
+            raise
+        return gaps
+
+    async def merge_markdown(self, save_path, front_matter=False, partial=False):
+        """Stream chapters into save_path, return the missing chapters
+
+        With front_matter the book info and a table of contents from meta.json
+        are written first. With partial a missing chapter is recorded as a gap,
+        in save_path.gaps.json, instead of failing the merge.
+        """
         meta_data = await self._load_meta_data()
-        with open(save_path, "w") as fp:
-            for index, chapter in enumerate(meta_data["chapters"]):
-                file_path = self._make_chapter_path(index, chapter["id"])
-                if not os.path.isfile(file_path):
-                    raise RuntimeError("File %s not exist" % file_path)
-                with open(file_path) as fd:
-                    fp.write(fd.read() + "\n")
+        gaps = await fileio.run(
+            self._merge_markdown, save_path, meta_data, front_matter, partial
+        )
+        gaps_path = save_path + ".gaps.json"
+        if gaps:
+            logging.warning(
+                "[%s] %d chapters missing in %s, see %s"
+                % (self.__class__.__name__, len(gaps), save_path, gaps_path)
+            )
+            self._metrics.incr("missing_chapters", len(gaps))
+            await fileio.atomic_write(
+                gaps_path, json.dumps(gaps, ensure_ascii=False, indent=2)
+            )
+        elif os.path.isfile(gaps_path):
+            os.remove(gaps_path)
+        return gaps
 
     async def pre_process_markdown(self):
         meta_data = await self._load_meta_data()
         for index, chapter in enumerate(meta_data["chapters"]):
-            chapter_path = self._make_chapter_path(index, chapter["id"])
-            if not os.path.isfile(chapter_path):
+            raw_data = await fileio.run(
+                self._chapter_store.read, index, chapter["id"], chapterstore.VERSION_RAW
+            )
+            if raw_data is None:
                 logging.warning(
-                    "[%s] File %s not exist" % (self.__class__.__name__, chapter_path)
+                    "[%s] Chapter %s not exist"
+                    % (
+                        self.__class__.__name__,
+                        self._chapter_store.describe(index, chapter["id"]),
+                    )
                 )
                 continue
-            with open(chapter_path, "rb") as fp:
-                text = fp.read().decode()
+            processed_data = await fileio.run(
+                self._chapter_store.read,
+                index,
+                chapter["id"],
+                chapterstore.VERSION_PROCESSED,
+            )
+            if self._journal.verify_data(
+                chapter["id"], processed_data, journal.ChapterJournal.STATUS_PROCESSED
+            ):
+                continue
+            text = raw_data.decode()
 
             output = ""
             code_mode = False
@@ -103,39 +245,53 @@ class WeReadExporter(object):
                 pos1 = output.find(")", pos)
                 url = output[pos + 2 : pos1]
                 logging.info("[%s] Replace image %s" % (self.__class__.__name__, url))
+                image_name = utils.md5(url) + ".jpg"
                 try:
-                    data = await utils.fetch(url)
+                    await self._save_image(
+                        url, os.path.join(self._image_dir, image_name)
+                    )
                 except:
+                    self._metrics.incr("image_download_failures")
                     logging.exception(
                         "[%s] Fetch image data of %s failed"
                         % (self.__class__.__name__, url)
                     )
                     pos += 10
                 else:
-                    image_name = utils.md5(url) + ".jpg"
-                    with open(os.path.join(self._image_dir, image_name), "wb") as fp:
-                        fp.write(data)
                     output = output[: pos + 2] + "images/" + image_name + output[pos1:]
-            if not os.path.isfile(chapter_path + ".bak"):
-                os.rename(chapter_path, chapter_path + ".bak")
-            with open(chapter_path, "wb") as fp:
-                fp.write(output.encode())
+            output = output.encode()
+            await fileio.run(
+                self._chapter_store.write,
+                index,
+                chapter["id"],
+                output,
+                chapterstore.VERSION_PROCESSED,
+            )
+            await fileio.run(
+                self._journal.record,
+                chapter["id"],
+                output,
+                journal.ChapterJournal.STATUS_PROCESSED,
+            )
 
     async def markdown_to_txt(self, save_path):
+        import bs4
+
         meta_data = await self._load_meta_data()
+        texts = []
         for index, chapter in enumerate(meta_data["chapters"]):
-            chapter_path = self._make_chapter_path(index, chapter["id"])
-            raw_html = self._markdown_to_html(chapter_path, wrap=False)
+            raw_html = self._render_chapter(index, chapter, wrap=False)
             soup = bs4.BeautifulSoup(raw_html, features="html.parser")
-            with open(save_path, "a+") as fp:
-                fp.write(soup.text + "\n\n")
+            texts.append(soup.text + "\n\n")
+        await fileio.atomic_write(save_path, "".join(texts))
+
+    def _markdown_file_to_html(self, path, wrap=True):
+        with open(path, "rb") as fp:
+            return self._markdown_to_html(fp.read().decode(), wrap)
+
+    def _markdown_to_html(self, markdown_text, wrap=True):
+        import markdown
 
-    def _markdown_to_html(self, path_or_text, wrap=True):
-        if os.path.isfile(path_or_text):
-            with open(path_or_text, "rb") as fp:
-                markdown_text = fp.read().decode()
-        else:
-            markdown_text = path_or_text
         html = markdown.markdown(
             markdown_text,
             extensions=[
@@ -145,36 +301,65 @@ class WeReadExporter(object):
         )
         html += '<div class="page-break"></div>'
         if wrap:
-            html = (
-                '<html><head><link rel="stylesheet" href="style.css"></head><body>%s</body></html>'
-                % html
+            html = self._wrap_html(html)
+        return html
+
+    def _wrap_html(self, html):
+        return (
+            '<html><head><link rel="stylesheet" href="style.css"></head><body>%s</body></html>'
+            % html
+        )
+
+    def _render_chapter(self, index, chapter, wrap=True):
+        html = None
+        if self._chapter_store.cache_rendered:
+            html = self._chapter_store.read(
+                index, chapter["id"], chapterstore.VERSION_HTML
+            )
+        if html is None:
+            html = self._markdown_to_html(self._read_chapter(index, chapter), False)
+            self._chapter_store.write(
+                index, chapter["id"], html, chapterstore.VERSION_HTML
             )
+        else:
+            html = html.decode()
+        if wrap:
+            html = self._wrap_html(html)
         return html
 
     async def markdown_to_pdf(
         self, save_path, extra_css=None, image_format="jpg", dump_html=False
     ):
+        import bs4
+        from weasyprint import CSS, HTML
+
         meta_data = await self._load_meta_data()
         raw_html = '<img src="cover.jpg" style="width: 100%;">\n'
         for index, chapter in enumerate(meta_data["chapters"]):
-            chapter_path = self._make_chapter_path(index, chapter["id"])
-            raw_html += self._markdown_to_html(chapter_path, wrap=False)
+            raw_html += self._render_chapter(index, chapter, wrap=False)
         raw_html = raw_html.replace(
             "<pre><code>", "<pre><code>\n"
         )  # Fix unexpected indent
+        scratch_dir = self._get_scratch_dir("pdf")
         if image_format == "png":
+            # converted images are kept out of images dir read by epub
             soup = bs4.BeautifulSoup(raw_html, features="html.parser")
             for img in soup.find_all("img"):
-                src = os.path.join(self._save_dir, img.attrs["src"])
+                src = img.attrs["src"]
                 if not src.endswith(".png"):
-                    png_path = src[:-3] + "png"
-                    utils.save_to_png(src, png_path)
-                    img.attrs["src"] = img.attrs["src"][:-3] + "png"
+                    png_src = os.path.relpath(
+                        os.path.join(scratch_dir, src[:-3] + "png"), self._save_dir
+                    )
+                    png_path = os.path.join(self._save_dir, png_src)
+                    if not os.path.isdir(os.path.dirname(png_path)):
+                        os.makedirs(os.path.dirname(png_path))
+                    utils.save_to_png(os.path.join(self._save_dir, src), png_path)
+                    img.attrs["src"] = png_src.replace(os.sep, "/")
 
             raw_html = soup.prettify()
 
         if dump_html:
-            html_path = os.path.join(self._save_dir, "output.html")
+            html_path = os.path.join(scratch_dir, "output.html")
             with open(html_path, "w") as fp:
                 fp.write(raw_html)
         html = HTML(string=raw_html, base_url=self._save_dir)
@@ -190,6 +375,8 @@ class WeReadExporter(object):
         html.write_pdf(save_path, stylesheets=css)
 
     async def markdown_to_epub(self, save_path, extra_css=None):
+        from ebooklib import epub
+
         meta_data = await self._load_meta_data()
         book = epub.EpubBook()
         book.set_identifier("id123456")
@@ -219,12 +406,11 @@ class WeReadExporter(object):
         toc = []
         section = None
         for index, chapter in enumerate(meta_data["chapters"]):
-            chapter_path = self._make_chapter_path(index, chapter["id"])
             xhtml_name = "chap_%.4d.xhtml" % (index + 1)
             chap = epub.EpubHtml(
                 title=chapter["title"], file_name=xhtml_name, lang="hr"
             )
-            html = self._markdown_to_html(chapter_path)
+            html = self._render_chapter(index, chapter)
             chap.content = html.replace("code>", "epub-code>")
             chap.add_item(default_css)
             # add chapter
@@ -305,71 +491,145 @@ class WeReadExporter(object):
     async def save_cover_image(self):
         meta_data = await self._load_meta_data()
         cover_url = meta_data["cover"].replace("/s_", "/t9_")
-        data = await utils.fetch(cover_url)
-        with open(self._cover_image_path, "wb") as fp:
-            fp.write(data)
+        await self._save_image(cover_url, self._cover_image_path)
+
+    def _verify_chapter(self, index, chapter):
+        """Check the saved chapter against the journal without loading it whole"""
+        stream = self._chapter_store.open(index, chapter["id"])
+        if stream is None:
+            return False
+        with stream:
+            return self._journal.verify_stream(chapter["id"], stream)
+
+    async def _load_chapter(self, page, chapter, timeout):
+        time0 = 0
+        for _ in range(3):
+            time0 = time.time()
+            try:
+                await asyncio.wait_for(
+                    page.goto_chapter(
+                        chapter["id"],
+                        timeout=timeout,
+                        url=chapter.get("url"),
+                    ),
+                    timeout=timeout + 60,
+                )  # avoid pyppeteer hangs
+            except asyncio.TimeoutError:
+                logging.warning(
+                    "[%s] Load chapter %s timeout %ds"
+                    % (
+                        self.__class__.__name__,
+                        chapter["title"],
+                        time.time() - time0,
+                    )
+                )
+                raise utils.LoadChapterFailedError()
+            except (KeyboardInterrupt, utils.LoginRequiredError) as ex:
+                raise ex
+            except:
+                logging.exception(
+                    "[%s] Go to chapter %s failed"
+                    % (self.__class__.__name__, chapter["title"])
+                )
+            else:
+                break
+        else:
+            raise utils.LoadChapterFailedError(
+                "Load chapter %s failed" % chapter["title"]
+            )
 
-    async def export_markdown(self, timeout=60, interval=30):
-        if not os.path.isdir(self._chapter_dir):
-            os.makedirs(self._chapter_dir)
+    async def _paced_load_chapter(self, page, chapter, timeout, interval):
+        """Load chapter no earlier than interval seconds after the previous load started"""
+        delay = self._last_load_time + interval - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._last_load_time = time.time()
+        await self._load_chapter(page, chapter, timeout)
+
+    async def _save_chapter(self, page, index, chapter):
+        with self._metrics.timer("chapter_extract_seconds"):
+            markdown = await page.get_markdown()
+        logging.info(
+            "[%s] Export chapter %s to %s"
+            % (
+                self.__class__.__name__,
+                chapter["title"],
+                self._chapter_store.describe(index, chapter["id"]),
+            )
+        )
+        data = markdown.encode("utf-8", errors="replace")
+        await fileio.run(
+            self._chapter_store.write,
+            index,
+            chapter["id"],
+            data,
+            chapterstore.VERSION_RAW,
+        )
+        self._metrics.incr("chapters_exported")
+        self._metrics.incr("chapter_bytes", len(data))
+        await fileio.run(
+            self._journal.record,
+            chapter["id"],
+            data,
+            journal.ChapterJournal.STATUS_EXPORTED,
+        )
+
+    async def _export_chapters_pipelined(self, pending, timeout, interval):
+        """Load chapter i+1 in a second tab while chapter i is being extracted"""
+        pages = [self._page, await self._page.fork()]
+        self._last_load_time = 0
+        task = asyncio.ensure_future(
+            self._paced_load_chapter(pages[0], pending[0][1], timeout, interval)
+        )
+        try:
+            for i, (index, chapter) in enumerate(pending):
+                await task
+                task = None
+                if i + 1 < len(pending):
+                    task = asyncio.ensure_future(
+                        self._paced_load_chapter(
+                            pages[(i + 1) % 2], pending[i + 1][1], timeout, interval
+                        )
+                    )
+                await self._save_chapter(pages[i % 2], index, chapter)
+        finally:
+            if task and not task.done():
+                task.cancel()
+            await pages[1].close()
+
+    async def export_markdown(self, timeout=60, interval=30, prefetch=False):
         meta_data = await self._load_meta_data()
         if not os.path.isfile(self._cover_image_path):
             await self.save_cover_image()
 
+        pending = []
         for index, chapter in enumerate(meta_data["chapters"]):
             logging.info(
                 "[%s] Check chapter %s/%s"
                 % (self.__class__.__name__, chapter["id"], chapter["title"])
             )
 
-            file_path = self._make_chapter_path(index, chapter["id"])
-            if os.path.isfile(file_path) and os.path.getsize(file_path) > 3:
+            if self._resume:
+                if await fileio.run(self._verify_chapter, index, chapter):
+                    continue
+            elif (
+                await fileio.run(self._chapter_store.get_size, index, chapter["id"])
+                or 0
+            ) > 3:
                 continue
             logging.info(
-                "[%s] File %s not exist" % (self.__class__.__name__, file_path)
-            )
-
-            time0 = 0
-            for _ in range(3):
-                time0 = time.time()
-                try:
-                    await asyncio.wait_for(
-                        self._page.goto_chapter(
-                            chapter["id"],
-                            timeout=timeout,
-                        ),
-                        timeout=timeout + 60,
-                    )  # avoid pyppeteer hangs
-                except asyncio.TimeoutError:
-                    logging.warning(
-                        "[%s] Load chapter %s timeout %ds"
-                        % (
-                            self.__class__.__name__,
-                            chapter["title"],
-                            time.time() - time0,
-                        )
-                    )
-                    raise utils.LoadChapterFailedError()
-                except KeyboardInterrupt as ex:
-                    raise ex
-                except:
-                    logging.exception(
-                        "[%s] Go to chapter %s failed"
-                        % (self.__class__.__name__, chapter["title"])
-                    )
-                else:
-                    break
-            else:
-                raise utils.LoadChapterFailedError(
-                    "Load chapter %s failed" % chapter["title"]
+                "[%s] Chapter %s not exist"
+                % (
+                    self.__class__.__name__,
+                    self._chapter_store.describe(index, chapter["id"]),
                 )
-
-            markdown = await self._page.get_markdown()
-            logging.info(
-                "[%s] Export chapter %s to %s"
-                % (self.__class__.__name__, chapter["title"], file_path)
             )
-            with open(file_path, "wb") as fp:
-                fp.write(markdown.encode("utf-8", errors="replace"))
+            pending.append((index, chapter))
+
+        if prefetch and len(pending) > 1:
+            return await self._export_chapters_pipelined(pending, timeout, interval)
 
+        for index, chapter in pending:
+            await self._load_chapter(self._page, chapter, timeout)
+            await self._save_chapter(self._page, index, chapter)
             await asyncio.sleep(interval)
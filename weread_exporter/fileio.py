@@ -0,0 +1,88 @@
+"""
+Disk I/O off the event loop
+
+The event loop also answers intercepted browser requests, so coroutines hand
+blocking file operations to a dedicated I/O thread instead of running them
+inline. A single thread keeps writes in submission order.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import threading
+
+from . import compression, utils
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                1, thread_name_prefix="weread-io"
+            )
+    return _executor
+
+
+def _reset_executor():
+    # threads do not survive fork, a forked worker needs its own executor
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+async def run(func, *args, **kwargs):
+    """Run blocking func in the I/O thread"""
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+def _log_exception(name, future):
+    if not future.cancelled() and future.exception():
+        logging.error(
+            "I/O task %s failed: %r" % (name, future.exception()),
+            exc_info=future.exception(),
+        )
+
+
+def submit(func, *args, **kwargs):
+    """Run func in the I/O thread without waiting for it, e.g. in callbacks
+
+    Nobody may wait for the returned future, so a failure is logged.
+    """
+    future = get_executor().submit(func, *args, **kwargs)
+    name = getattr(func, "__qualname__", None) or repr(func)
+    future.add_done_callback(functools.partial(_log_exception, name))
+    return future
+
+
+async def read_file(path):
+    """Read path or its compressed variant, None if not exist"""
+    return await run(compression.read_file, path)
+
+
+async def write_file(path, data, codec=None):
+    await run(compression.write_file, path, data, codec)
+
+
+async def atomic_write(path, data):
+    await run(utils.atomic_write, path, data)
+
+
+def _append_text(path, text):
+    with open(path, "a+", encoding="utf-8") as fp:
+        fp.write(text)
+
+
+def append_text(path, text):
+    submit(_append_text, path, text)
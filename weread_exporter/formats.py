@@ -0,0 +1,227 @@
+"""
+Output format registry
+
+Formats only import their backend (weasyprint, ebooklib, ...) when exporting,
+so a run only pays for the formats it asks for.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import sys
+
+from . import profiler
+from .metrics import Metrics
+
+formats = {}
+
+
+def register_format(cls):
+    formats[cls.name] = cls()
+    return cls
+
+
+def get_format(name):
+    if name not in formats:
+        raise NotImplementedError("Unsupported output format %s" % name)
+    return formats[name]
+
+
+def get_format_names():
+    return sorted(formats.keys())
+
+
+def resolve_formats(names):
+    """Return requested formats with their dependencies, dependencies first"""
+    result = []
+
+    def _add(name):
+        output_format = get_format(name)
+        if output_format in result:
+            return
+        for it in output_format.depends:
+            _add(it)
+        result.append(output_format)
+
+    for name in names:
+        _add(name)
+    return result
+
+
+class OutputFormat(object):
+    name = None
+    extension = None
+    depends = ()
+    platforms = None
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.name)
+
+    def check_platform(self):
+        return not self.platforms or sys.platform in self.platforms
+
+    def get_save_path(self, output_dir, title):
+        return os.path.join(output_dir, "%s.%s" % (title, self.extension))
+
+    async def export(self, exporter, save_path, output_dir, title, options):
+        raise NotImplementedError(self.__class__.__name__)
+
+
+@register_format
+class MarkdownFormat(OutputFormat):
+    name = "md"
+    extension = "md"
+
+    async def export(self, exporter, save_path, output_dir, title, options):
+        await exporter.merge_markdown(
+            save_path,
+            front_matter=options.get("front_matter", False),
+            partial=options.get("partial", False),
+        )
+
+
+@register_format
+class EpubFormat(OutputFormat):
+    name = "epub"
+    extension = "epub"
+
+    async def export(self, exporter, save_path, output_dir, title, options):
+        await exporter.markdown_to_epub(save_path, extra_css=options.get("extra_css"))
+
+
+@register_format
+class PdfFormat(OutputFormat):
+    name = "pdf"
+    extension = "pdf"
+
+    async def export(self, exporter, save_path, output_dir, title, options):
+        image_format = "jpg"
+        if sys.platform == "win32":
+            image_format = "png"
+        await exporter.markdown_to_pdf(
+            save_path,
+            extra_css=options.get("extra_css"),
+            image_format=image_format,
+        )
+
+
+@register_format
+class MobiFormat(OutputFormat):
+    name = "mobi"
+    extension = "mobi"
+    depends = ("epub",)
+    platforms = ("linux",)
+
+    async def export(self, exporter, save_path, output_dir, title, options):
+        epub_path = get_format("epub").get_save_path(output_dir, title)
+        await exporter.epub_to_mobi(epub_path, save_path)
+
+
+@register_format
+class TxtFormat(OutputFormat):
+    name = "txt"
+    extension = "txt"
+
+    async def export(self, exporter, save_path, output_dir, title, options):
+        await exporter.markdown_to_txt(save_path)
+
+
+def _init_worker():
+    if sys.platform == "win32":
+        from .__main__ import patch_windows
+
+        patch_windows()
+
+
+def _export_in_process(
+    name, save_dir, settings, save_path, output_dir, title, options
+):
+    from . import utils
+    from .export import WeReadExporter
+
+    exporter = WeReadExporter(None, save_dir, **settings)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(
+            get_format(name).export(exporter, save_path, output_dir, title, options)
+        )
+    finally:
+        exporter.close()
+        loop.run_until_complete(utils.close_session())
+        loop.close()
+
+
+class FormatPipeline(object):
+    """Run output formats as a dependency graph
+
+    Formats that don't depend on each other run concurrently in worker
+    processes, a format starts as soon as its dependencies are done.
+    """
+
+    def __init__(self, output_formats, workers=1, metrics=None, book_profiler=None):
+        self._formats = resolve_formats([it.name for it in output_formats])
+        self._workers = workers
+        self._metrics = metrics or Metrics()
+        self._profiler = book_profiler or profiler.NullProfiler()
+
+    async def _run_format(self, output_format, depends, exporter, pool, args):
+        if depends:
+            await asyncio.gather(*depends)
+        output_dir, title, options = args
+        save_path = output_format.get_save_path(output_dir, title)
+        if os.path.isfile(save_path):
+            logging.info("File %s exist, ignore export" % save_path)
+            return
+        with self._metrics.timer("render_seconds", format=output_format.name):
+            if pool:
+                await asyncio.get_event_loop().run_in_executor(
+                    pool,
+                    _export_in_process,
+                    output_format.name,
+                    exporter.save_dir,
+                    exporter.settings,
+                    save_path,
+                    output_dir,
+                    title,
+                    options,
+                )
+            else:
+                with self._profiler.stage("render"):
+                    await output_format.export(
+                        exporter, save_path, output_dir, title, options
+                    )
+        if not os.path.isfile(save_path):
+            logging.warning("Create %s file failed" % output_format.name)
+        else:
+            logging.info("Save file %s complete" % save_path)
+
+    async def run(self, exporter, output_dir, title, options):
+        pool = None
+        if self._workers > 1 and len(self._formats) > 1:
+            pool = concurrent.futures.ProcessPoolExecutor(
+                min(self._workers, len(self._formats)), initializer=_init_worker
+            )
+        tasks = {}
+        try:
+            for output_format in self._formats:
+                depends = [tasks[it] for it in output_format.depends]
+                tasks[output_format.name] = asyncio.ensure_future(
+                    self._run_format(
+                        output_format,
+                        depends,
+                        exporter,
+                        pool,
+                        (output_dir, title, options),
+                    )
+                )
+            await asyncio.gather(*tasks.values())
+        finally:
+            # cancelling a task also cancels its format if not started yet
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+            if pool:
+                # running formats finish in background, the loop is not blocked
+                pool.shutdown(wait=False)
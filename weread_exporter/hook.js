@@ -47,6 +47,29 @@ function getHrElemList() {
   return hrList;
 }
 
+function waitForElement(selector, timeout) {
+  return new Promise(function (resolve) {
+    let elem = document.querySelector(selector);
+    if (elem) {
+      resolve(elem);
+      return;
+    }
+    let observer = new MutationObserver(function () {
+      let elem = document.querySelector(selector);
+      if (elem) {
+        observer.disconnect();
+        clearTimeout(timer);
+        resolve(elem);
+      }
+    });
+    let timer = setTimeout(function () {
+      observer.disconnect();
+      resolve(null);
+    }, timeout);
+    observer.observe(document.documentElement, { childList: true, subtree: true });
+  });
+}
+
 let canvasContextHandler = {
   data: {
     complete: false,
@@ -194,6 +217,7 @@ let canvasContextHandler = {
                 }
               }
               that.data.complete = true;
+              window.dispatchEvent(new Event("canvasrendered"));
             }, 1000);
 
           } else if (name === "clearRect") {
@@ -255,6 +279,43 @@ let canvasContextHandler = {
     for (let img of imgList) {
       this.data.markdown += "![](" + img[2] + ")\n";
     }
+  },
+  waitForRendered(timeout) {
+    let that = this;
+    return new Promise(function (resolve) {
+      if (that.data.complete) {
+        resolve(true);
+        return;
+      }
+      let onRendered = function () {
+        clearTimeout(timer);
+        resolve(true);
+      };
+      let timer = setTimeout(function () {
+        window.removeEventListener("canvasrendered", onRendered);
+        resolve(false);
+      }, timeout);
+      window.addEventListener("canvasrendered", onRendered, { once: true });
+    });
+  },
+  async turnPages(timeout, renderTimeout) {
+    // click "下一页" until the footer button is something else, e.g. "下一章"
+    let pages = 0;
+    while (true) {
+      let button = await waitForElement("button.readerFooter_button", timeout);
+      if (!button) {
+        return { button: null, pages: pages };
+      }
+      let text = button.innerText;
+      if (text !== "下一页") {
+        return { button: text, pages: pages };
+      }
+      this.data.markdown += "\n\n";
+      this.data.complete = false;
+      button.click();
+      pages += 1;
+      await this.waitForRendered(renderTimeout);
+    }
   }
 }
 
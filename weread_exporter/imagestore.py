@@ -0,0 +1,150 @@
+"""
+Content addressed image store shared by all books
+
+Images are saved once in objects/<hash[:2]>/<hash>, keyed by the sha256 of
+their data, and books hardlink them into their own images directory. An
+index maps image urls to hashes, so an url already downloaded by any book is
+not fetched again. Paths an object is linked or copied to are recorded too.
+An object is garbage when no recorded path exists any more and it has no
+other hardlinks, objects added within the grace period are always kept.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+from . import fileio, utils
+
+
+class ImageStore(object):
+    def __init__(self, root, grace=3600):
+        self._root = root
+        self._grace = grace
+        self._object_dir = os.path.join(root, "objects")
+        if not os.path.isdir(self._object_dir):
+            os.makedirs(self._object_dir)
+        self._conn = sqlite3.connect(
+            os.path.join(root, "index.db"), check_same_thread=False
+        )
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS urls ("
+                "url TEXT PRIMARY KEY, hash TEXT NOT NULL, "
+                "size INTEGER NOT NULL, time REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS urls_hash ON urls (hash)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS links ("
+                "path TEXT PRIMARY KEY, hash TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS links_hash ON links (hash)"
+            )
+
+    def _get_object_path(self, hash):
+        return os.path.join(self._object_dir, hash[:2], hash)
+
+    def lookup(self, url):
+        """Return object path of url if it was stored before"""
+        row = self._conn.execute(
+            "SELECT hash FROM urls WHERE url=?", (url,)
+        ).fetchone()
+        if row:
+            object_path = self._get_object_path(row[0])
+            if os.path.isfile(object_path):
+                return object_path
+        return None
+
+    def add(self, url, data):
+        hash = hashlib.sha256(data).hexdigest()
+        object_path = self._get_object_path(hash)
+        if not os.path.isfile(object_path):
+            if not os.path.isdir(os.path.dirname(object_path)):
+                os.makedirs(os.path.dirname(object_path))
+            utils.atomic_write(object_path, data)
+        else:
+            # keep it out of garbage collection until it is linked
+            os.utime(object_path)
+        with self._conn:
+            self._conn.execute(
+                "REPLACE INTO urls (url, hash, size, time) VALUES (?, ?, ?, ?)",
+                (url, hash, len(data), time.time()),
+            )
+        return object_path
+
+    async def fetch(self, url):
+        """Return (object_path, downloaded bytes), only download unknown urls"""
+        object_path = await fileio.run(self.lookup, url)
+        if object_path:
+            return object_path, 0
+        data = await utils.fetch(url)
+        return await fileio.run(self.add, url, data), len(data)
+
+    def link(self, object_path, save_path):
+        """Hardlink object to save_path, copy it if hardlink is not supported"""
+        if not (
+            os.path.isfile(save_path) and os.path.samefile(object_path, save_path)
+        ):
+            fd, temp_path = utils.make_temp_file(save_path)
+            os.close(fd)
+            try:
+                try:
+                    os.remove(temp_path)
+                    os.link(object_path, temp_path)
+                except OSError:
+                    shutil.copyfile(object_path, temp_path)
+                os.replace(temp_path, save_path)
+            except:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        with self._conn:
+            self._conn.execute(
+                "REPLACE INTO links (path, hash) VALUES (?, ?)",
+                (os.path.abspath(save_path), os.path.basename(object_path)),
+            )
+
+    def _is_referenced(self, hash):
+        """Whether a recorded path of the object still exists"""
+        referenced = False
+        for (path,) in self._conn.execute(
+            "SELECT path FROM links WHERE hash=?", (hash,)
+        ).fetchall():
+            if os.path.isfile(path):
+                referenced = True
+            else:
+                with self._conn:
+                    self._conn.execute("DELETE FROM links WHERE path=?", (path,))
+        return referenced
+
+    def collect_garbage(self):
+        """Remove objects no book links to, return removed bytes"""
+        removed_size = removed_count = 0
+        now = time.time()
+        for sub_dir in os.listdir(self._object_dir):
+            sub_path = os.path.join(self._object_dir, sub_dir)
+            for hash in os.listdir(sub_path):
+                object_path = os.path.join(sub_path, hash)
+                stat = os.stat(object_path)
+                if stat.st_nlink > 1 or now - stat.st_mtime < self._grace:
+                    continue
+                if self._is_referenced(hash):
+                    continue
+                with self._conn:
+                    self._conn.execute("DELETE FROM urls WHERE hash=?", (hash,))
+                os.remove(object_path)
+                removed_size += stat.st_size
+                removed_count += 1
+            if not os.listdir(sub_path):
+                os.rmdir(sub_path)
+        logging.info(
+            "[%s] Removed %d unused images, reclaimed %d bytes"
+            % (self.__class__.__name__, removed_count, removed_size)
+        )
+        return removed_size
+
+    def close(self):
+        self._conn.close()
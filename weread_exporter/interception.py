@@ -0,0 +1,260 @@
+"""
+Request interception rules
+"""
+
+import asyncio
+import logging
+import random
+import re
+
+ACTION_CONTINUE = "continue"  # let chrome handle the request
+ACTION_HOOK = "hook"  # respond with hook.js
+ACTION_BLOCK = "block"  # abort the request
+ACTION_MOCK = "mock"  # respond with static data
+ACTION_CACHE = "cache"  # respond from local resource cache
+ACTION_REWRITE = "rewrite"  # fetch from server, then patch headers and body
+ACTION_PASSTHROUGH = "passthrough"  # let chrome fetch with patched request headers
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Request-Method": "*",
+    "Access-Control-Allow-Headers": "*",
+}
+
+
+class Rule(object):
+    """Match requests by url pattern, resource type and method"""
+
+    def __init__(
+        self,
+        name,
+        action,
+        pattern=None,
+        resource_types=None,
+        methods=None,
+        response=None,
+    ):
+        self.name = name
+        self.action = action
+        self._pattern = re.compile(pattern) if pattern else None
+        self._resource_types = frozenset(resource_types or ())
+        self._methods = frozenset(methods or ())
+        self._response = response
+
+    def __repr__(self):
+        return "<Rule %s %s>" % (self.name, self.action)
+
+    def match(self, url, resource_type=None, method="GET"):
+        if self._methods and method not in self._methods:
+            return False
+        if self._resource_types and resource_type not in self._resource_types:
+            return False
+        if self._pattern and not self._pattern.search(url):
+            return False
+        return True
+
+    def make_response(self):
+        response = self._response
+        if callable(response):
+            response = response()
+        response = response or {}
+        body = response.get("body", b"")
+        headers = {"Server": "nginx/1.20.2"}
+        if body:
+            headers["Content-Type"] = response.get(
+                "content_type", "application/json; charset=utf-8"
+            )
+            headers["Content-Length"] = str(len(body))
+        headers.update(response.get("headers", {}))
+        return response.get("status", 200), headers, body
+
+
+def _mock_book_read():
+    return {"body": b'{"succ":1,"synckey":%d}' % random.randint(10000000, 100000000)}
+
+
+DEFAULT_RULES = [
+    Rule("extension", ACTION_CONTINUE, r"^chrome-extension://"),
+    Rule("hook", ACTION_HOOK, r"/web/1\.392ec47a\.js"),
+    Rule(
+        "cors-preflight",
+        ACTION_MOCK,
+        methods=["OPTIONS"],
+        response={"headers": CORS_HEADERS},
+    ),
+    Rule(
+        "analytics",
+        ACTION_BLOCK,
+        r"^https?://([\w-]+\.)*(google-analytics\.com|googletagmanager\.com|doubleclick\.net|pingjs\.qq\.com|tajs\.qq\.com|beacon\.qq\.com|aegis\.qq\.com)/",
+    ),
+    Rule("avatar", ACTION_BLOCK, r"^https?://([\w-]+\.)*qlogo\.cn/", ["image"]),
+    Rule("csp-report", ACTION_BLOCK, r"hijack_csp_report"),
+    Rule(
+        "resource",
+        ACTION_CACHE,
+        r"^[^?#]*\.(js|css|jpg|png|gif|svg)([?#]|$)",
+        methods=["GET"],
+    ),
+    Rule("reader", ACTION_REWRITE, r"/web/reader/", ["document"]),
+    Rule("oss-cors", ACTION_REWRITE, r"^https?://([\w-]+\.)*oss\.weread\.qq\.com/"),
+    Rule("book-read", ACTION_MOCK, r"/web/book/read", response=_mock_book_read),
+    Rule("sentry", ACTION_MOCK, r"sentry_key=", response={"body": b"{}"}),
+    Rule("hera-log", ACTION_MOCK, r"/hera/(logkv|osslog)", response={"status": 204}),
+    Rule("hera-chlog", ACTION_MOCK, r"/hera/chlog", response={"body": b'{"ret":0}'}),
+    Rule(
+        "river",
+        ACTION_MOCK,
+        r"/river/single",
+        response={"body": b'{"err_code":0,"msg":"suc"}'},
+    ),
+]
+
+# Added in front of the rules by the capture-only launch profile, markdown is
+# captured from canvas calls and chapter images are downloaded by the exporter
+CAPTURE_ONLY_RULES = [
+    Rule("capture-image", ACTION_BLOCK, resource_types=["image"]),
+    Rule("capture-font", ACTION_BLOCK, resource_types=["font"]),
+    Rule("capture-media", ACTION_BLOCK, resource_types=["media"]),
+]
+
+
+class RuleTable(object):
+    """Ordered rules, the first matched rule wins"""
+
+    def __init__(self, rules=None):
+        self._rules = list(DEFAULT_RULES if rules is None else rules)
+
+    def __iter__(self):
+        return iter(self._rules)
+
+    def insert(self, index, rule):
+        self._rules.insert(index, rule)
+
+    def match(self, url, resource_type=None, method="GET"):
+        for rule in self._rules:
+            if rule.match(url, resource_type, method):
+                return rule
+        return None
+
+
+class RequestStats(object):
+    """Count intercepted requests by action and resource type"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._actions = {}
+        self._resource_types = {}
+        self._rules = {}
+        self._bytes = 0
+
+    def add(self, rule_name, action, resource_type, size=0):
+        self._actions[action] = self._actions.get(action, 0) + 1
+        resource_type = resource_type or "other"
+        self._resource_types[resource_type] = (
+            self._resource_types.get(resource_type, 0) + 1
+        )
+        self._rules[rule_name] = self._rules.get(rule_name, 0) + 1
+        self._bytes += size
+
+    @property
+    def total(self):
+        return sum(self._actions.values())
+
+    def summary(self):
+        return {
+            "total": self.total,
+            "bytes": self._bytes,
+            "actions": dict(self._actions),
+            "resource_types": dict(self._resource_types),
+            "rules": dict(self._rules),
+        }
+
+
+class InterceptionManager(object):
+    """Handle intercepted requests of a page in tracked, bounded tasks
+
+    The request listener is registered once per page. At most max_tasks
+    requests are handled at a time, and tasks still running when the page
+    navigates away are cancelled. A request is aborted if its task is
+    cancelled or fails, so chrome does not wait for it forever.
+    """
+
+    def __init__(self, handler, max_tasks=32):
+        self._handler = handler
+        self._semaphore = asyncio.Semaphore(max_tasks)
+        self._page = None
+        self._tasks = set()
+        self._counts = {
+            "started": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "max_in_flight": 0,
+        }
+
+    @property
+    def in_flight(self):
+        return len(self._tasks)
+
+    async def attach(self, page):
+        if page is self._page:
+            return
+        await page.setRequestInterception(True)
+        page.on("request", self._on_request)
+        self._page = page
+
+    def _on_request(self, request):
+        task = asyncio.ensure_future(self._handle(request))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_done)
+        self._counts["started"] += 1
+        self._counts["max_in_flight"] = max(
+            self._counts["max_in_flight"], len(self._tasks)
+        )
+
+    async def _handle(self, request):
+        try:
+            async with self._semaphore:
+                await self._handler(request)
+        except asyncio.CancelledError:
+            await self._abort(request, "aborted")
+            raise
+        except Exception:
+            await self._abort(request, "failed")
+            raise
+
+    async def _abort(self, request, error_code):
+        try:
+            await request.abort(error_code)
+        except Exception as ex:
+            # request may be handled before the error, or page is closed
+            logging.debug(
+                "[%s] Abort request failed: %r" % (self.__class__.__name__, ex)
+            )
+
+    def _on_done(self, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            self._counts["cancelled"] += 1
+        elif task.exception():
+            self._counts["failed"] += 1
+            logging.warning(
+                "[%s] Handle request failed: %r"
+                % (self.__class__.__name__, task.exception())
+            )
+        else:
+            self._counts["completed"] += 1
+
+    def cancel(self):
+        """Cancel requests of the previous document, return how many were running"""
+        count = len(self._tasks)
+        for task in self._tasks:
+            task.cancel()
+        return count
+
+    def summary(self):
+        summary = dict(self._counts)
+        summary["in_flight"] = self.in_flight
+        return summary
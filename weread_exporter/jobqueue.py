@@ -0,0 +1,289 @@
+"""
+Durable queue of export jobs
+
+Jobs are kept in a sqlite database so that a batch can be resumed after
+restart. Failed jobs are retried with exponential backoff, jobs that can
+never succeed (e.g. soldout books) or run out of attempts are moved to the
+dead letter state. A claimed job records its owner process and a heartbeat,
+only jobs whose owner is gone or stopped beating are recovered.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import time
+import uuid
+
+
+class JobQueue(object):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_DEAD = "dead"
+
+    def __init__(
+        self, path, max_attempts=5, backoff_base=30, backoff_max=1800, lease=300
+    ):
+        self._path = path
+        self.lease = lease
+        self._owner = "%s:%d" % (socket.gethostname(), os.getpid())
+        self._book_ids = None
+        self._max_attempts = max_attempts
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        save_dir = os.path.dirname(path)
+        if save_dir and not os.path.isdir(save_dir):
+            os.makedirs(save_dir)
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, book_id TEXT NOT NULL, formats TEXT, "
+                "priority INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, next_run REAL NOT NULL, "
+                "error TEXT, result TEXT, created REAL NOT NULL, "
+                "started REAL, finished REAL, owner TEXT, heartbeat REAL)"
+            )
+            columns = [
+                row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")
+            ]
+            for column, column_type in (("owner", "TEXT"), ("heartbeat", "REAL")):
+                if column not in columns:
+                    self._conn.execute(
+                        "ALTER TABLE jobs ADD COLUMN %s %s" % (column, column_type)
+                    )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs "
+                "(status, priority, next_run)"
+            )
+
+    def _to_dict(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["formats"] = json.loads(job["formats"]) if job["formats"] else None
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def add(self, book_id, formats=None, priority=0):
+        """Queue a book, a book already waiting in queue is not queued twice"""
+        row = self._conn.execute(
+            "SELECT * FROM jobs WHERE book_id=? AND status IN (?, ?)",
+            (book_id, self.STATUS_QUEUED, self.STATUS_RUNNING),
+        ).fetchone()
+        if row:
+            if priority > row["priority"]:
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE jobs SET priority=? WHERE id=?", (priority, row["id"])
+                    )
+            return self.get(row["id"])
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, book_id, formats, priority, status, "
+                "next_run, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    book_id,
+                    json.dumps(formats) if formats else None,
+                    priority,
+                    self.STATUS_QUEUED,
+                    now,
+                    now,
+                ),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        return self._to_dict(
+            self._conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        )
+
+    def list(self, status=None):
+        if status:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status=? ORDER BY created", (status,)
+            )
+        else:
+            rows = self._conn.execute("SELECT * FROM jobs ORDER BY created")
+        return [self._to_dict(row) for row in rows]
+
+    def _where_book_ids(self, sql, params, book_ids):
+        """Filter by book ids kept in a temp table, a long list may exceed the
+        variable limit of sqlite"""
+        if book_ids is None:
+            return sql, params
+        book_ids = frozenset(book_ids)
+        if book_ids != self._book_ids:
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS job_books "
+                    "(book_id TEXT PRIMARY KEY)"
+                )
+                self._conn.execute("DELETE FROM temp.job_books")
+                self._conn.executemany(
+                    "INSERT INTO temp.job_books (book_id) VALUES (?)",
+                    ((it,) for it in book_ids),
+                )
+            self._book_ids = book_ids
+        return sql + " AND book_id IN (SELECT book_id FROM temp.job_books)", params
+
+    def claim(self, book_ids=None):
+        """Take the due job with the highest priority, return None if no job is due
+
+        A job taken by another process between select and update is skipped.
+        """
+        sql, params = self._where_book_ids(
+            "SELECT id FROM jobs WHERE status=? AND next_run<=?",
+            (self.STATUS_QUEUED, time.time()),
+            book_ids,
+        )
+        sql += " ORDER BY priority DESC, next_run, created LIMIT 1"
+        while True:
+            row = self._conn.execute(sql, params).fetchone()
+            if not row:
+                return None
+            now = time.time()
+            with self._conn:
+                count = self._conn.execute(
+                    "UPDATE jobs SET status=?, attempts=attempts+1, started=?, "
+                    "owner=?, heartbeat=? WHERE id=? AND status=?",
+                    (
+                        self.STATUS_RUNNING,
+                        now,
+                        self._owner,
+                        now,
+                        row["id"],
+                        self.STATUS_QUEUED,
+                    ),
+                ).rowcount
+            if count:
+                return self.get(row["id"])
+
+    def heartbeat(self, job_id):
+        """Renew the lease of a running job"""
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat=? WHERE id=? AND status=? AND owner=?",
+                (time.time(), job_id, self.STATUS_RUNNING, self._owner),
+            )
+
+    def get_next_delay(self, book_ids=None):
+        """Seconds before next queued job is due, None if queue is empty"""
+        sql, params = self._where_book_ids(
+            "SELECT MIN(next_run) FROM jobs WHERE status=?",
+            (self.STATUS_QUEUED,),
+            book_ids,
+        )
+        next_run = self._conn.execute(sql, params).fetchone()[0]
+        if next_run is None:
+            return None
+        return max(next_run - time.time(), 0)
+
+    def complete(self, job_id, result=None):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status=?, result=?, error=NULL, finished=? "
+                "WHERE id=?",
+                (self.STATUS_DONE, json.dumps(result), time.time(), job_id),
+            )
+
+    def fail(self, job_id, error, progress=False):
+        """Retry the job later, or move it to dead letter if no attempts left
+
+        A failed run that still made progress does not use up an attempt, so
+        only failures in a row count.
+        """
+        job = self.get(job_id)
+        if progress:
+            job["attempts"] = 0
+        elif job["attempts"] >= self._max_attempts:
+            logging.warning(
+                "[%s] Job %s of book %s failed %d times, give up"
+                % (self.__class__.__name__, job_id, job["book_id"], job["attempts"])
+            )
+            self.dead(job_id, error)
+            return
+        delay = min(
+            self._backoff_base * 2 ** max(job["attempts"] - 1, 0), self._backoff_max
+        )
+        logging.info(
+            "[%s] Retry job %s of book %s in %d seconds"
+            % (self.__class__.__name__, job_id, job["book_id"], delay)
+        )
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status=?, attempts=?, error=?, next_run=? "
+                "WHERE id=?",
+                (
+                    self.STATUS_QUEUED,
+                    job["attempts"],
+                    error,
+                    time.time() + delay,
+                    job_id,
+                ),
+            )
+
+    def dead(self, job_id, error):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status=?, error=?, finished=? WHERE id=?",
+                (self.STATUS_DEAD, error, time.time(), job_id),
+            )
+
+    def _is_owner_alive(self, owner):
+        """Whether the owner process may still be running"""
+        host, _, pid = (owner or "").rpartition(":")
+        if sys.platform == "win32" or host != socket.gethostname():
+            # only the lease tells
+            return True
+        if not pid.isdigit():
+            return True
+        if int(pid) == os.getpid():
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def recover(self):
+        """Queue again the running jobs whose owner is gone or lease expired"""
+        now = time.time()
+        count = 0
+        rows = self._conn.execute(
+            "SELECT id, owner, heartbeat FROM jobs WHERE status=?",
+            (self.STATUS_RUNNING,),
+        ).fetchall()
+        for row in rows:
+            expired = not row["heartbeat"] or row["heartbeat"] < now - self.lease
+            if not expired and self._is_owner_alive(row["owner"]):
+                continue
+            with self._conn:
+                count += self._conn.execute(
+                    "UPDATE jobs SET status=?, next_run=?, owner=NULL "
+                    "WHERE id=? AND status=? AND heartbeat IS ?",
+                    (
+                        self.STATUS_QUEUED,
+                        now,
+                        row["id"],
+                        self.STATUS_RUNNING,
+                        row["heartbeat"],
+                    ),
+                ).rowcount
+        if count:
+            logging.info(
+                "[%s] Recovered %d interrupted jobs" % (self.__class__.__name__, count)
+            )
+        return count
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,140 @@
+"""
+Chapter progress journal
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+from . import utils
+
+
+class ChapterJournal(object):
+    """Record of chapters that were completely written to disk
+
+    Each change is appended to the journal as a json line of [chapter_id,
+    entry], a removed chapter has a null entry. A line cut by a crash is
+    ignored on load, and the journal is compacted when most of its lines are
+    outdated.
+    """
+
+    STATUS_EXPORTED = "exported"
+    STATUS_PROCESSED = "processed"
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = {}
+        self._lines = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self._path):
+            return
+        with open(self._path, "rb") as fp:
+            text = fp.read().decode("utf-8", "replace")
+        try:
+            entries = json.loads(text)
+        except ValueError:
+            entries = None
+        if isinstance(entries, dict):
+            # journal saved as a single object by older versions
+            self._entries = entries
+            self._lines = -1
+            return
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                chapter_id, entry = json.loads(line)
+            except (TypeError, ValueError):
+                logging.warning(
+                    "[%s] Invalid line in journal %s, ignore it"
+                    % (self.__class__.__name__, self._path)
+                )
+                continue
+            if entry:
+                self._entries[chapter_id] = entry
+            else:
+                self._entries.pop(chapter_id, None)
+            self._lines += 1
+        if text and not text.endswith("\n"):
+            # rewrite the cut line before appending
+            self._lines = -1
+
+    def _make_line(self, chapter_id, entry):
+        return json.dumps([chapter_id, entry]) + "\n"
+
+    def _save(self):
+        utils.atomic_write(
+            self._path,
+            "".join(self._make_line(*it) for it in self._entries.items()),
+        )
+        self._lines = len(self._entries)
+
+    def _append(self, chapter_id, entry):
+        if self._lines < 0 or self._lines >= 2 * len(self._entries) + 16:
+            self._save()
+            return
+        with open(self._path, "ab") as fp:
+            fp.write(self._make_line(chapter_id, entry).encode("utf-8"))
+            fp.flush()
+            os.fsync(fp.fileno())
+        self._lines += 1
+
+    def get(self, chapter_id):
+        return self._entries.get(str(chapter_id))
+
+    def record(self, chapter_id, data, status):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        chapter_id = str(chapter_id)
+        self._entries[chapter_id] = {
+            "hash": utils.md5(data),
+            "size": len(data),
+            "status": status,
+            "time": int(time.time()),
+        }
+        self._append(chapter_id, self._entries[chapter_id])
+
+    def remove(self, chapter_id):
+        chapter_id = str(chapter_id)
+        if self._entries.pop(chapter_id, None):
+            self._append(chapter_id, None)
+
+    def verify(self, chapter_id, file_path, status=None):
+        """Check that file_path still matches the journaled entry of chapter_id"""
+        if not os.path.isfile(file_path):
+            return False
+        with open(file_path, "rb") as fp:
+            return self.verify_stream(chapter_id, fp, status)
+
+    def _get_entry(self, chapter_id, status):
+        entry = self.get(chapter_id)
+        if not entry or (status and entry["status"] != status):
+            return None
+        return entry
+
+    def verify_data(self, chapter_id, data, status=None):
+        """Check that data still matches the journaled entry of chapter_id"""
+        entry = self._get_entry(chapter_id, status)
+        if not entry or data is None:
+            return False
+        if len(data) != entry["size"]:
+            return False
+        return utils.md5(data) == entry["hash"]
+
+    def verify_stream(self, chapter_id, fp, status=None):
+        """Check data read from fp in chunks, like verify_data"""
+        entry = self._get_entry(chapter_id, status)
+        if not entry:
+            return False
+        md5 = hashlib.md5()
+        size = 0
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            size += len(chunk)
+            if size > entry["size"]:
+                return False
+            md5.update(chunk)
+        return size == entry["size"] and md5.hexdigest() == entry["hash"]
@@ -0,0 +1,106 @@
+"""
+Book meta data cache
+
+Validity and meta data of a book both come from its book detail page, so the
+page is fetched once and the result is cached for a while. A whole booklist
+can be prefetched concurrently before any browser is launched.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from . import fileio, utils, webpage
+
+
+class BookMetadata(object):
+    def __init__(
+        self,
+        cache_dir="cache",
+        ttl=24 * 3600,
+        concurrency=4,
+        root_url=webpage.WeReadWebPage.root_url,
+    ):
+        self._cache_dir = cache_dir
+        self._ttl = ttl
+        self._concurrency = concurrency
+        self._root_url = root_url
+        self._pending = {}
+
+    def _get_record_path(self, book_id):
+        return os.path.join(self._cache_dir, book_id, "book_info.json")
+
+    def _load_record(self, book_id):
+        record_path = self._get_record_path(book_id)
+        if not os.path.isfile(record_path):
+            return None
+        try:
+            with open(record_path) as fp:
+                record = json.load(fp)
+        except ValueError:
+            return None
+        if time.time() - record.get("time", 0) > self._ttl:
+            return None
+        return record
+
+    async def _fetch(self, book_id):
+        html = await utils.fetch("%s/web/bookDetail/%s" % (self._root_url, book_id))
+        html = html.decode()
+        record = {"time": time.time(), "valid": not webpage.is_soldout(html)}
+        if record["valid"]:
+            record["meta"] = webpage.parse_book_info(html, book_id, self._root_url)
+        await fileio.run(self._save_record, book_id, record)
+        return record
+
+    def _save_record(self, book_id, record):
+        save_dir = os.path.join(self._cache_dir, book_id)
+        if not os.path.isdir(save_dir):
+            os.makedirs(save_dir)
+        utils.atomic_write(self._get_record_path(book_id), json.dumps(record))
+        meta_path = os.path.join(save_dir, "meta.json")
+        if record["valid"] and not os.path.isfile(meta_path):
+            # meta.json is kept once written, exported chapters depend on it
+            utils.atomic_write(meta_path, json.dumps(record["meta"]))
+
+    async def get(self, book_id):
+        """Return {"valid": bool, "meta": dict} of book, fetched at most once"""
+        record = await fileio.run(self._load_record, book_id)
+        if record:
+            return record
+        if book_id not in self._pending:
+            self._pending[book_id] = asyncio.ensure_future(self._fetch(book_id))
+        try:
+            return await asyncio.shield(self._pending[book_id])
+        finally:
+            task = self._pending.get(book_id)
+            if task and task.done():
+                self._pending.pop(book_id)
+
+    async def is_valid(self, book_id):
+        return (await self.get(book_id))["valid"]
+
+    async def prefetch(self, book_ids):
+        """Fetch books concurrently, return {book_id: record or None}"""
+        semaphore = asyncio.Semaphore(self._concurrency)
+        result = {}
+
+        async def _prefetch(book_id):
+            async with semaphore:
+                try:
+                    result[book_id] = await self.get(book_id)
+                except Exception:
+                    logging.exception(
+                        "[%s] Fetch book %s info failed"
+                        % (self.__class__.__name__, book_id)
+                    )
+                    result[book_id] = None
+
+        await asyncio.gather(*[_prefetch(book_id) for book_id in book_ids])
+        invalid_count = len([it for it in result.values() if it and not it["valid"]])
+        logging.info(
+            "[%s] Prefetched %d books, %d invalid"
+            % (self.__class__.__name__, len(book_ids), invalid_count)
+        )
+        return result
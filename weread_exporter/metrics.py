@@ -0,0 +1,112 @@
+"""
+Counters and timers of the export pipeline
+"""
+
+import contextlib
+import json
+import time
+
+from . import utils
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in sorted(labels.items())
+    )
+
+
+class Metrics(object):
+    """Counters and durations, optionally tagged with labels"""
+
+    def __init__(self, labels=None):
+        self._labels = labels or {}
+        self._counters = {}
+        self._timers = {}
+
+    @property
+    def labels(self):
+        return self._labels
+
+    @staticmethod
+    def _make_key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def incr(self, name, value=1, **labels):
+        key = self._make_key(name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._make_key(name, labels)
+        timer = self._timers.setdefault(key, {"count": 0, "total": 0.0, "max": 0.0})
+        timer["count"] += 1
+        timer["total"] += seconds
+        timer["max"] = max(timer["max"], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        time0 = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - time0, **labels)
+
+    def get_counter(self, name, **labels):
+        return self._counters.get(self._make_key(name, labels), 0)
+
+    def summary(self):
+        counters = {}
+        for (name, labels), value in sorted(self._counters.items()):
+            counters[name + _format_labels(dict(labels))] = value
+        timers = {}
+        for (name, labels), timer in sorted(self._timers.items()):
+            timers[name + _format_labels(dict(labels))] = {
+                "count": timer["count"],
+                "total": round(timer["total"], 3),
+                "mean": round(timer["total"] / timer["count"], 3),
+                "max": round(timer["max"], 3),
+            }
+        return {"labels": self._labels, "counters": counters, "timers": timers}
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def dump_json(self, save_path):
+        utils.atomic_write(save_path, self.to_json())
+
+    def to_prometheus(self, prefix="weread_exporter"):
+        """Return (family, type, sample line) tuples"""
+        samples = []
+        for (name, labels), value in sorted(self._counters.items()):
+            family = "%s_%s_total" % (prefix, name)
+            labels = _format_labels(dict(self._labels, **dict(labels)))
+            samples.append((family, "counter", "%s%s %s" % (family, labels, value)))
+        for (name, labels), timer in sorted(self._timers.items()):
+            family = "%s_%s" % (prefix, name)
+            labels = _format_labels(dict(self._labels, **dict(labels)))
+            samples.append(
+                (family, "summary", "%s_count%s %d" % (family, labels, timer["count"]))
+            )
+            samples.append(
+                (family, "summary", "%s_sum%s %.6f" % (family, labels, timer["total"]))
+            )
+        return samples
+
+
+def format_prometheus(metrics_list, prefix="weread_exporter"):
+    """Return metrics of all books in prometheus text exposition format"""
+    families = {}
+    for metrics in metrics_list:
+        for family, metric_type, line in metrics.to_prometheus(prefix):
+            families.setdefault((family, metric_type), []).append(line)
+    lines = []
+    for family, metric_type in sorted(families):
+        lines.append("# TYPE %s %s" % (family, metric_type))
+        lines.extend(families[(family, metric_type)])
+    return "\n".join(lines) + "\n"
+
+
+def dump_prometheus(save_path, metrics_list, prefix="weread_exporter"):
+    utils.atomic_write(save_path, format_prometheus(metrics_list, prefix))
@@ -0,0 +1,267 @@
+"""
+Parser of the window.__NUXT__ payload
+
+Nuxt serializes the page state as a javascript expression, usually an IIFE
+whose parameters hold the repeated values:
+
+    window.__NUXT__=(function(a,b){return {state:{x:a,y:[b,a]}}}("s",1));
+
+Only the literal subset of javascript used by the serializer is supported.
+"""
+
+import re
+
+_TOKEN_RE = re.compile(
+    r"""\s*(?:
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    |(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    |(?P<name>[A-Za-z_$][\w$]*)
+    |(?P<punct>[{}\[\]:,()=;.!+\-])
+    )""",
+    re.X | re.S,
+)
+_ESCAPE_RE = re.compile(
+    r"\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\r\n|.)", re.S
+)
+_ESCAPES = {
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+    "v": "\v",
+    "0": "\0",
+    "\n": "",
+    "\r\n": "",
+}
+_CONSTANTS = {
+    "true": True,
+    "false": False,
+    "null": None,
+    "undefined": None,
+    "NaN": float("nan"),
+    "Infinity": float("inf"),
+}
+
+
+class NuxtParseError(ValueError):
+    pass
+
+
+def _replace_escape(match):
+    escape = match.group(1)
+    if escape[0] == "u" and escape[1] == "{":
+        return chr(int(escape[2:-1], 16))
+    if escape[0] in ("u", "x") and len(escape) > 1:
+        return chr(int(escape[1:], 16))
+    return _ESCAPES.get(escape, escape)
+
+
+def _unescape(text):
+    if "\\" not in text:
+        return text
+    text = _ESCAPE_RE.sub(_replace_escape, text)
+    try:
+        text.encode("utf-8")
+    except UnicodeEncodeError:
+        # join surrogate pairs written as two \\u escapes
+        text = text.encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+    return text
+
+
+class _Function(object):
+    def __init__(self, params, body_pos):
+        self.params = params
+        self.body_pos = body_pos
+
+
+class _Parser(object):
+    def __init__(self, text):
+        self._text = text
+        self._pos = 0
+        self._scope = {}
+
+    def _next(self, peek=False):
+        match = _TOKEN_RE.match(self._text, self._pos)
+        if not match:
+            raise NuxtParseError(
+                "Unexpected character at %d: %r"
+                % (self._pos, self._text[self._pos : self._pos + 20])
+            )
+        if not peek:
+            self._pos = match.end()
+        return match.lastgroup, match.group(match.lastgroup)
+
+    def _peek(self):
+        return self._next(peek=True)
+
+    def _expect(self, value):
+        _, token = self._next()
+        if token != value:
+            raise NuxtParseError(
+                "Expect %r but got %r at %d" % (value, token, self._pos)
+            )
+
+    def _parse_object(self):
+        result = {}
+        if self._peek()[1] == "}":
+            self._next()
+            return result
+        while True:
+            kind, token = self._next()
+            if kind == "string":
+                key = _unescape(token[1:-1])
+            elif kind in ("name", "number"):
+                key = token
+            else:
+                raise NuxtParseError(
+                    "Invalid object key %r at %d" % (token, self._pos)
+                )
+            self._expect(":")
+            result[key] = self.parse_value()
+            _, token = self._next()
+            if token == "}":
+                return result
+            if token != ",":
+                raise NuxtParseError("Expect , or } at %d" % self._pos)
+
+    def _parse_list(self, end):
+        result = []
+        if self._peek()[1] == end:
+            self._next()
+            return result
+        while True:
+            result.append(self.parse_value())
+            _, token = self._next()
+            if token == end:
+                return result
+            if token != ",":
+                raise NuxtParseError("Expect , or %s at %d" % (end, self._pos))
+
+    def _skip_block(self):
+        depth = 0
+        while True:
+            _, token = self._next()
+            if token in ("{", "(", "["):
+                depth += 1
+            elif token in ("}", ")", "]"):
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _parse_function(self):
+        if self._peek()[0] == "name":
+            self._next()
+        self._expect("(")
+        params = []
+        while True:
+            kind, token = self._next()
+            if token == ")":
+                break
+            if kind == "name":
+                params.append(token)
+        body_pos = self._pos
+        self._skip_block()
+        return _Function(params, body_pos)
+
+    def _call(self, function, args):
+        pos, scope = self._pos, self._scope
+        self._scope = dict(zip(function.params, args))
+        self._pos = function.body_pos
+        self._expect("{")
+        depth = 0
+        result = None
+        while True:
+            _, token = self._peek()
+            if token == "return" and depth == 0:
+                self._next()
+                result = self.parse_value()
+                break
+            if token == "}" and depth == 0:
+                break
+            self._next()
+            if token in ("{", "(", "["):
+                depth += 1
+            elif token in ("}", ")", "]"):
+                depth -= 1
+        self._pos, self._scope = pos, scope
+        return result
+
+    def _parse_name(self, token):
+        if token in _CONSTANTS:
+            return _CONSTANTS[token]
+        if token == "void":
+            self.parse_value()
+            return None
+        if token == "new":
+            return self.parse_value()
+        if token == "function":
+            return self._parse_function()
+        while self._peek()[1] == ".":
+            self._next()
+            token += "." + self._next()[1]
+        if token in self._scope:
+            return self._scope[token]
+        if self._peek()[1] == "(":
+            self._next()
+            args = self._parse_list(")")
+            if token == "Array":
+                if len(args) == 1 and isinstance(args[0], int):
+                    return [None] * args[0]
+                return args
+            if token in ("Object.create", "Map"):
+                return {}
+            # Date, Set, String, ...
+            return args[0] if args else None
+        return None
+
+    def parse_value(self):
+        kind, token = self._next()
+        if kind == "string":
+            value = _unescape(token[1:-1])
+        elif kind == "number":
+            value = float(token) if "." in token or "e" in token.lower() else int(token)
+        elif token in ("-", "+"):
+            value = self.parse_value()
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise NuxtParseError(
+                    "Unexpected operand of %s at %d" % (token, self._pos)
+                )
+            if token == "-":
+                value = -value
+        elif token == "!":
+            value = not self.parse_value()
+        elif token == "{":
+            value = self._parse_object()
+        elif token == "[":
+            value = self._parse_list("]")
+        elif token == "(":
+            value = self.parse_value()
+            self._expect(")")
+        elif kind == "name":
+            value = self._parse_name(token)
+        else:
+            raise NuxtParseError("Unexpected token %r at %d" % (token, self._pos))
+        while isinstance(value, _Function) and self._peek()[1] == "(":
+            self._next()
+            value = self._call(value, self._parse_list(")"))
+        return value
+
+
+def parse(text):
+    """Parse a javascript expression produced by the nuxt serializer"""
+    return _Parser(text).parse_value()
+
+
+def extract_nuxt_state(html):
+    """Return the object assigned to window.__NUXT__ in html"""
+    pos = html.find("window.__NUXT__")
+    if pos < 0:
+        raise NuxtParseError("window.__NUXT__ not found")
+    pos = html.find("=", pos)
+    parser = _Parser(html)
+    parser._pos = pos + 1
+    result = parser.parse_value()
+    if not isinstance(result, dict):
+        raise NuxtParseError("Unexpected __NUXT__ payload: %r" % type(result))
+    return result
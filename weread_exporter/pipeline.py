@@ -0,0 +1,301 @@
+"""
+Export pipeline of books
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from . import (
+    compression,
+    export,
+    fileio,
+    formats,
+    imagestore,
+    metadata,
+    metrics,
+    profiler,
+    sessions,
+    utils,
+    webpage,
+)
+
+
+class ExportPipeline(object):
+    """Export books one by one
+
+    With keep_browser the launched browser is reused by the following books
+    instead of being closed after each one.
+    """
+
+    def __init__(self, args, keep_browser=False, cache_dir="cache", output_dir="output"):
+        self._args = args
+        self._keep_browser = keep_browser
+        self._cache_dir = cache_dir
+        self._output_dir = output_dir
+        self._output_formats = formats.resolve_formats(args.output_format or ["epub"])
+        self._extra_css = None
+        if args.css_file:
+            if not os.path.isfile(args.css_file):
+                raise RuntimeError("CSS file %s not exist" % args.css_file)
+            with open(args.css_file) as fp:
+                self._extra_css = fp.read()
+        self._metadata = metadata.BookMetadata(
+            cache_dir,
+            ttl=args.metadata_ttl,
+            concurrency=args.metadata_concurrency,
+        )
+        self._image_store = imagestore.ImageStore(
+            os.path.join(cache_dir, "image_store")
+        )
+        self._compression = compression.CompressionPolicy.parse(
+            args.cache_compression
+        )
+        self._sessions = sessions.SessionPool(
+            cache_dir,
+            names=args.session,
+            rate=args.session_rate,
+            ttl=args.session_ttl,
+        )
+        self._page = None
+        self._metrics_list = []
+
+    @property
+    def output_formats(self):
+        return self._output_formats
+
+    @property
+    def metrics_list(self):
+        return self._metrics_list
+
+    @property
+    def sessions(self):
+        return self._sessions
+
+    def _get_format_workers(self, output_formats):
+        if self._args.profile:
+            # render in current process so that profiler can see it
+            return 1
+        return self._args.format_workers or min(
+            len(output_formats), os.cpu_count() or 1
+        )
+
+    async def _get_page(self, book_id, book_metrics):
+        if self._page:
+            if self._page.session.healthy:
+                self._page.switch_book(book_id, metrics=book_metrics)
+                return self._page
+            # move on to another account
+            await self._close_page(self._page)
+            self._page = None
+        session = self._sessions.acquire()
+        logging.info("Export book %s with session %s" % (book_id, session.name))
+        page = webpage.WeReadWebPage(
+            book_id,
+            webcache_path=self._cache_dir,
+            metrics=book_metrics,
+            compression_policy=self._compression,
+            session=session,
+        )
+        if self._keep_browser:
+            self._page = page
+        return page
+
+    async def _close_page(self, page):
+        await page.close()
+        self._sessions.release(page.session)
+
+    async def _launch(self, page, book_id, book_metrics):
+        args = self._args
+        if page.launched:
+            return
+        try:
+            with book_metrics.timer("stage_seconds", stage="launch"):
+                await page.launch(
+                    headless=args.headless,
+                    force_login=args.force_login,
+                    use_default_profile=args.use_default_profile,
+                    mock_user_agent=args.mock_user_agent,
+                    proxy_server=args.proxy_server,
+                    persist_profile=not args.no_persist_profile,
+                    disk_cache_size=args.disk_cache_size,
+                    capture_only=args.capture_only,
+                    prefetch=args.prefetch,
+                )
+        except RuntimeError:
+            book_metrics.incr("launch_failures")
+            logging.warning("Launch book %s home page failed" % book_id)
+            await page.close()
+            raise
+
+    async def _export_markdown(self, page, exporter, book_id, book_metrics, book_profiler):
+        args = self._args
+        await self._launch(page, book_id, book_metrics)
+        if args.profile_js:
+            await page.start_js_profiler()
+        success = False
+        try:
+            with book_metrics.timer(
+                "stage_seconds", stage="export_markdown"
+            ), book_profiler.stage("export_markdown"):
+                await exporter.export_markdown(
+                    args.load_timeout, args.load_interval, prefetch=args.prefetch
+                )
+            success = True
+        except utils.LoadChapterFailedError:
+            book_metrics.incr("load_chapter_failures")
+            logging.warning("Load chapter failed, close browser")
+            raise
+        finally:
+            if args.profile_js and page.launched:
+                await page.stop_js_profiler(
+                    os.path.join(
+                        self._cache_dir,
+                        book_id,
+                        "hook-%d.cpuprofile" % int(time.time()),
+                    )
+                )
+            if not success or not self._keep_browser:
+                await page.close()
+
+    async def export_book(self, book_id, output_formats=None):
+        """Export book to output formats, return None if book is invalid"""
+        args = self._args
+        output_formats = output_formats or self._output_formats
+        logging.info("Exporting book %s" % book_id)
+        book_metrics = metrics.Metrics(labels={"book_id": book_id})
+        self._metrics_list.append(book_metrics)
+        book_profiler = profiler.create_profiler(args.profile, args.profile_stage)
+        with book_metrics.timer("stage_seconds", stage="metadata"):
+            valid = await self._metadata.is_valid(book_id)
+        if not valid:
+            logging.warning("Book %s status is invalid, stop exporting" % book_id)
+            return None
+        book_profiler.start()
+        try:
+            return await self._export_valid_book(
+                book_id, output_formats, book_metrics, book_profiler
+            )
+        finally:
+            # profile is only saved when export succeeds
+            book_profiler.disable()
+
+    async def _export_valid_book(
+        self, book_id, output_formats, book_metrics, book_profiler
+    ):
+        args = self._args
+        page = await self._get_page(book_id, book_metrics)
+        save_path = os.path.join(self._cache_dir, book_id)
+        if not os.path.isdir(self._output_dir):
+            os.mkdir(self._output_dir)
+        exporter = export.WeReadExporter(
+            page,
+            save_path,
+            resume=args.resume,
+            metrics=book_metrics,
+            image_store=self._image_store,
+            packed=args.packed_chapters or None,
+            chapter_codec=self._compression.get_codec("chapter"),
+        )
+        try:
+            return await self._export_book(
+                exporter, page, book_id, output_formats, book_metrics, book_profiler
+            )
+        finally:
+            exporter.close()
+            if page is not self._page:
+                self._sessions.release(page.session)
+
+    async def _export_book(
+        self, exporter, page, book_id, output_formats, book_metrics, book_profiler
+    ):
+        args = self._args
+        await self._export_markdown(page, exporter, book_id, book_metrics, book_profiler)
+
+        with book_metrics.timer(
+            "stage_seconds", stage="pre_process_markdown"
+        ), book_profiler.stage("pre_process_markdown"):
+            await exporter.pre_process_markdown()
+        title = await exporter.get_book_title()
+        title = utils.format_filename(title)
+        format_pipeline = formats.FormatPipeline(
+            output_formats,
+            workers=self._get_format_workers(output_formats),
+            metrics=book_metrics,
+            book_profiler=book_profiler,
+        )
+        options = {
+            "extra_css": self._extra_css,
+            "front_matter": args.front_matter,
+            "partial": args.partial,
+        }
+        await format_pipeline.run(exporter, self._output_dir, title, options)
+
+        book_profiler.stop(os.path.join(self._cache_dir, book_id, "profile"))
+        # metrics are formatted on the loop, which is the only one updating them
+        await fileio.atomic_write(
+            os.path.join(self._cache_dir, book_id, "metrics.json"),
+            book_metrics.to_json(),
+        )
+        if args.prometheus_file:
+            await fileio.atomic_write(
+                args.prometheus_file, metrics.format_prometheus(self._metrics_list)
+            )
+        outputs = {}
+        for output_format in formats.resolve_formats(
+            [it.name for it in output_formats]
+        ):
+            path = output_format.get_save_path(self._output_dir, title)
+            if os.path.isfile(path):
+                outputs[output_format.name] = os.path.abspath(path)
+        return {"book_id": book_id, "title": title, "outputs": outputs}
+
+    async def prefetch_metadata(self, book_ids):
+        return await self._metadata.prefetch(book_ids)
+
+    async def run_job(self, job_queue, job):
+        """Export the book of a claimed job and record the result in queue"""
+        output_formats = None
+        if job["formats"]:
+            output_formats = formats.resolve_formats(job["formats"])
+        heartbeat = asyncio.ensure_future(self._keep_alive(job_queue, job["id"]))
+        metrics_count = len(self._metrics_list)
+        try:
+            result = await self.export_book(job["book_id"], output_formats)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            logging.exception("Export book %s failed" % job["book_id"])
+            # a long book may need several runs, keep retrying while it advances
+            progress = any(
+                it.get_counter("chapters_exported")
+                for it in self._metrics_list[metrics_count:]
+            )
+            job_queue.fail(
+                job["id"], str(ex) or ex.__class__.__name__, progress=progress
+            )
+            return False
+        finally:
+            heartbeat.cancel()
+        if result is None:
+            job_queue.dead(job["id"], "Book is invalid or soldout")
+            return False
+        job_queue.complete(job["id"], result)
+        return True
+
+    async def _keep_alive(self, job_queue, job_id):
+        """Renew lease of the running job so other processes do not recover it"""
+        while True:
+            await asyncio.sleep(job_queue.lease / 3.0)
+            job_queue.heartbeat(job_id)
+
+    async def collect_garbage(self):
+        """Remove shared images no longer used by any book"""
+        return await fileio.run(self._image_store.collect_garbage)
+
+    async def close(self):
+        if self._page:
+            await self._close_page(self._page)
+            self._page = None
+        self._image_store.close()
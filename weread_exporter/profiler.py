@@ -0,0 +1,191 @@
+"""
+Profilers of the export pipeline
+"""
+
+import collections
+import contextlib
+import cProfile
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+
+
+class Profiler(object):
+    """Profile the whole book or only the selected stages"""
+
+    suffix = ".prof"
+    requires = None  # optional package the profiler needs
+
+    def __init__(self, stages=None):
+        self._stages = set(stages or ())
+        self._enabled = False
+
+    def _enable(self):
+        raise NotImplementedError(self.__class__.__name__)
+
+    def _disable(self):
+        raise NotImplementedError(self.__class__.__name__)
+
+    def _save(self, save_path):
+        raise NotImplementedError(self.__class__.__name__)
+
+    def enable(self):
+        if not self._enabled:
+            self._enabled = True
+            self._enable()
+
+    def disable(self):
+        if self._enabled:
+            self._disable()
+            self._enabled = False
+
+    def start(self):
+        if not self._stages:
+            self.enable()
+
+    def stop(self, save_path):
+        self.disable()
+        save_path += self.suffix
+        self._save(save_path)
+        logging.info(
+            "[%s] Profile saved to %s" % (self.__class__.__name__, save_path)
+        )
+        return save_path
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if name not in self._stages:
+            yield
+            return
+        self.enable()
+        try:
+            yield
+        finally:
+            self.disable()
+
+
+class NullProfiler(Profiler):
+    """Used when profiling is disabled"""
+
+    def enable(self):
+        pass
+
+    def disable(self):
+        pass
+
+    def stop(self, save_path):
+        return None
+
+
+class CProfileProfiler(Profiler):
+    """Deterministic profiler, time spent in awaits is not counted"""
+
+    def __init__(self, stages=None):
+        super(CProfileProfiler, self).__init__(stages)
+        self._profile = cProfile.Profile()
+
+    def _enable(self):
+        self._profile.enable()
+
+    def _disable(self):
+        self._profile.disable()
+
+    def _save(self, save_path):
+        self._profile.dump_stats(save_path)
+
+
+class YappiProfiler(Profiler):
+    """Coroutine aware wall clock profiler, requires yappi"""
+
+    requires = "yappi"
+
+    def __init__(self, stages=None):
+        super(YappiProfiler, self).__init__(stages)
+        import yappi
+
+        self._yappi = yappi
+        self._yappi.clear_stats()
+        self._yappi.set_clock_type("wall")
+
+    def _enable(self):
+        self._yappi.start()
+
+    def _disable(self):
+        self._yappi.stop()
+
+    def _save(self, save_path):
+        self._yappi.get_func_stats().save(save_path, type="pstat")
+        self._yappi.clear_stats()
+
+
+class SamplingProfiler(Profiler):
+    """Sample the main thread stack periodically, cheap enough for production
+
+    The result is saved in collapsed stack format used by flamegraph tools.
+    """
+
+    suffix = ".folded"
+
+    def __init__(self, stages=None, interval=0.01):
+        super(SamplingProfiler, self).__init__(stages)
+        self._interval = interval
+        self._thread_id = threading.get_ident()
+        self._samples = collections.Counter()
+        self._running = False
+        self._thread = None
+
+    def _sample(self):
+        while self._running:
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame:
+                code = frame.f_code
+                stack.append(
+                    "%s:%s" % (os.path.basename(code.co_filename), code.co_name)
+                )
+                frame = frame.f_back
+            if stack:
+                self._samples[";".join(reversed(stack))] += 1
+            time.sleep(self._interval)
+
+    def _enable(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _disable(self):
+        self._running = False
+        self._thread.join()
+        self._thread = None
+
+    def _save(self, save_path):
+        with open(save_path, "w") as fp:
+            for stack, count in self._samples.most_common():
+                fp.write("%s %d\n" % (stack, count))
+        self._samples.clear()
+
+
+profilers = {
+    "cprofile": CProfileProfiler,
+    "yappi": YappiProfiler,
+    "sampling": SamplingProfiler,
+}
+
+
+def check_profiler(mode):
+    """Raise ImportError if the package required by profiler mode is missing"""
+    requires = profilers[mode].requires
+    if requires:
+        try:
+            importlib.import_module(requires)
+        except ImportError:
+            raise ImportError("%s profiler requires %s package" % (mode, requires))
+
+
+def create_profiler(mode, stages=None):
+    if not mode:
+        return NullProfiler()
+    return profilers[mode](stages)
@@ -0,0 +1,155 @@
+"""
+Export job service
+
+    POST /jobs          {"book_id": "...", "formats": ["epub", "pdf"]}
+                        {"book_list_id": "...", "formats": ["txt"], "priority": 1}
+    GET  /jobs          list all jobs
+    GET  /jobs/{job_id} job status and output paths
+    GET  /sessions      health and rate budget of account sessions
+"""
+
+import asyncio
+import logging
+import os
+
+from aiohttp import web
+
+from . import formats, jobqueue, pipeline, utils
+
+
+class ExportServer(object):
+    """Run export jobs one by one on a warm browser session"""
+
+    def __init__(self, args, queue_path=None, cache_dir="cache", output_dir="output"):
+        self._args = args
+        self._pipeline = pipeline.ExportPipeline(
+            args, keep_browser=True, cache_dir=cache_dir, output_dir=output_dir
+        )
+        queue_path = queue_path or os.path.join(cache_dir, "jobs.db")
+        self._queue = jobqueue.JobQueue(
+            queue_path, max_attempts=args.max_attempts, backoff_base=args.retry_delay
+        )
+        self._wakeup = asyncio.Event()
+        self._worker = None
+
+    def _parse_formats(self, names):
+        if not names:
+            return self._pipeline.output_formats
+        output_formats = formats.resolve_formats(names)
+        for output_format in output_formats:
+            if not output_format.check_platform():
+                raise NotImplementedError(
+                    "Format %s is not supported on this system" % output_format.name
+                )
+        return output_formats
+
+    async def handle_create_job(self, request):
+        try:
+            data = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(reason="Invalid json body")
+        if not isinstance(data, dict):
+            raise web.HTTPBadRequest(reason="Json body should be an object")
+        try:
+            output_formats = self._parse_formats(data.get("formats"))
+        except NotImplementedError as ex:
+            raise web.HTTPBadRequest(reason=str(ex))
+        if data.get("book_list_id"):
+            try:
+                book_list = await utils.get_book_list(data["book_list_id"])
+            except Exception as ex:
+                logging.exception(
+                    "[%s] Get book list %s failed"
+                    % (self.__class__.__name__, data["book_list_id"])
+                )
+                raise web.HTTPBadGateway(reason="Get book list failed: %s" % ex)
+            book_ids = [it["id"] for it in book_list]
+        elif data.get("book_id"):
+            book_ids = [data["book_id"]]
+        else:
+            raise web.HTTPBadRequest(reason="book_id or book_list_id is required")
+        try:
+            priority = int(data.get("priority", 0))
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(reason="Invalid priority")
+        format_names = [it.name for it in output_formats]
+        jobs = []
+        for book_id in book_ids:
+            jobs.append(self._queue.add(book_id, format_names, priority))
+        self._wakeup.set()
+        if len(book_ids) > 1:
+            asyncio.ensure_future(self._pipeline.prefetch_metadata(book_ids))
+        return web.json_response({"jobs": jobs}, status=201)
+
+    async def handle_list_jobs(self, request):
+        return web.json_response(
+            {"jobs": self._queue.list(request.query.get("status"))}
+        )
+
+    async def handle_get_job(self, request):
+        job = self._queue.get(request.match_info["job_id"])
+        if not job:
+            raise web.HTTPNotFound(reason="Job not found")
+        return web.json_response(job)
+
+    async def handle_list_sessions(self, request):
+        return web.json_response({"sessions": self._pipeline.sessions.summary()})
+
+    async def work(self):
+        while True:
+            job = self._queue.claim()
+            if job:
+                await self._pipeline.run_job(self._queue, job)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self._queue.get_next_delay()
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post("/jobs", self.handle_create_job)
+        app.router.add_get("/jobs", self.handle_list_jobs)
+        app.router.add_get("/jobs/{job_id}", self.handle_get_job)
+        app.router.add_get("/sessions", self.handle_list_sessions)
+        return app
+
+    async def start(self):
+        self._queue.recover()
+        self._worker = asyncio.ensure_future(self.work())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self._pipeline.close()
+        await utils.close_session()
+        self._queue.close()
+
+
+async def serve(args):
+    export_server = ExportServer(args)
+    runner = web.AppRunner(export_server.create_app())
+    await runner.setup()
+    if args.unix_socket:
+        site = web.UnixSite(runner, args.unix_socket)
+    else:
+        host, port = args.listen.rsplit(":", 1)
+        site = web.TCPSite(runner, host, int(port))
+    await site.start()
+    await export_server.start()
+    logging.info("[ExportServer] Listening on %s" % site.name)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await export_server.stop()
+        await runner.cleanup()
+    return 0
@@ -0,0 +1,265 @@
+"""
+Pool of account sessions
+
+Every account keeps its cookie in its own file, cache/cookie.txt for the
+default account and cache/sessions/<name>.txt for the others. Each session
+has a rate budget of chapter loads and a health state saved next to its
+cookie, so books are only exported by accounts that still work. Saving a new
+cookie file, e.g. by logging in again, makes an unhealthy session healthy.
+A session verified within ttl seconds is not checked again on launch, or
+within unknown_expiry_ttl seconds if its cookies have no known expiry.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from . import fileio, utils
+
+
+class Session(object):
+    """Cookie file of one account with its rate budget and health state"""
+
+    STATUS_HEALTHY = "healthy"
+    STATUS_LOGIN_REQUIRED = "login_required"  # cookie expired, login again
+    STATUS_INVALID = "invalid"  # user does not exist
+    unknown_expiry_ttl = 300
+
+    def __init__(self, name, cookie_path, rate=0, burst=1, ttl=3600):
+        self.name = name
+        self.cookie_path = cookie_path
+        self._ttl = ttl
+        self._rate = rate / 60.0
+        self._burst = max(burst, 1)
+        self._tokens = self._burst
+        self._update_time = time.monotonic()
+        self._lock = None
+        self._state_path = cookie_path + ".state.json"
+        self._state = {
+            "status": self.__class__.STATUS_HEALTHY,
+            "error": None,
+            "time": 0,
+            "refreshes": 0,
+            "verified": 0,
+            "expires": None,
+        }
+        self._state_mtime = None
+        self._chapters = 0
+        self._load_state()
+
+    def __repr__(self):
+        return "<Session %s %s>" % (self.name, self.status)
+
+    def _load_state(self):
+        """Load state saved by this or other processes if it changed"""
+        if not os.path.isfile(self._state_path):
+            return
+        mtime = os.path.getmtime(self._state_path)
+        if mtime == self._state_mtime:
+            return
+        self._state_mtime = mtime
+        with open(self._state_path) as fp:
+            try:
+                self._state.update(json.loads(fp.read()))
+            except ValueError:
+                logging.warning(
+                    "[%s] Invalid state file %s, ignore it"
+                    % (self.__class__.__name__, self._state_path)
+                )
+
+    async def _set_status(self, status, error=None):
+        if status != self._state["status"]:
+            logging.info(
+                "[%s] Session %s is %s%s"
+                % (
+                    self.__class__.__name__,
+                    self.name,
+                    status,
+                    ": %s" % error if error else "",
+                )
+            )
+        self._state.update({"status": status, "error": error, "time": time.time()})
+        await self._save_state()
+
+    def _write_state(self, text):
+        utils.atomic_write(self._state_path, text)
+        self._state_mtime = os.path.getmtime(self._state_path)
+
+    async def _save_state(self):
+        await fileio.run(self._write_state, json.dumps(self._state))
+
+    @property
+    def status(self):
+        self._load_state()
+        status = self._state["status"]
+        if status != self.__class__.STATUS_HEALTHY and os.path.isfile(
+            self.cookie_path
+        ):
+            if os.path.getmtime(self.cookie_path) > self._state["time"]:
+                # cookie saved after the session broke
+                return self.__class__.STATUS_HEALTHY
+        return status
+
+    @property
+    def healthy(self):
+        return self.status == self.__class__.STATUS_HEALTHY
+
+    @property
+    def verified(self):
+        """Whether the cookie was verified recently and has not expired"""
+        if not self.healthy:
+            return False
+        now = time.time()
+        verified = self._state["verified"]
+        expires = self._state["expires"]
+        ttl = self._ttl
+        if not expires:
+            ttl = min(ttl, self.__class__.unknown_expiry_ttl)
+        if now - verified > ttl:
+            return False
+        if os.path.isfile(self.cookie_path):
+            if os.path.getmtime(self.cookie_path) > verified:
+                # the verified cookie was replaced
+                return False
+        return not expires or expires > now + 60
+
+    @property
+    def locked(self):
+        return self._lock is not None
+
+    def lock(self):
+        """Take the cookie file, return False if another process is using it"""
+        if not self._lock:
+            cookie_dir = os.path.dirname(self.cookie_path)
+            if cookie_dir and not os.path.isdir(cookie_dir):
+                os.makedirs(cookie_dir)
+            self._lock = utils.try_lock_file(self.cookie_path + ".lock")
+        return self._lock is not None
+
+    def unlock(self):
+        if self._lock:
+            utils.unlock_file(self._lock)
+            self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._update_time) * self._rate
+        )
+        self._update_time = now
+
+    def get_delay(self):
+        """Seconds to wait before the next chapter load is in budget"""
+        if not self._rate:
+            return 0
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    async def wait(self):
+        """Wait for and take budget of one chapter load"""
+        self._chapters += 1
+        if not self._rate:
+            return
+        while True:
+            delay = self.get_delay()
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+        self._tokens -= 1
+
+    async def mark_verified(self, expires=None):
+        """User of cookie was checked, expires is the earliest cookie expiry"""
+        self._state.update({"verified": time.time(), "expires": expires})
+        await self._set_status(self.__class__.STATUS_HEALTHY)
+
+    async def invalidate_verification(self):
+        """Check user again on next launch, e.g. the skipped check was wrong"""
+        self._load_state()
+        if self._state["verified"]:
+            self._state.update({"verified": 0, "expires": None})
+            await self._save_state()
+
+    async def mark_refreshed(self):
+        """Cookie was refreshed after errCode -2012"""
+        self._state["refreshes"] += 1
+        await self._set_status(self.__class__.STATUS_HEALTHY)
+
+    async def mark_login_required(self, error=None):
+        await self._set_status(self.__class__.STATUS_LOGIN_REQUIRED, error)
+
+    async def mark_invalid(self, error=None):
+        await self._set_status(self.__class__.STATUS_INVALID, error)
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "error": self._state["error"],
+            "refreshes": self._state["refreshes"],
+            "verified": self._state["verified"],
+            "expires": self._state["expires"],
+            "chapters": self._chapters,
+            "delay": self.get_delay(),
+            "locked": self.locked,
+        }
+
+
+class SessionPool(object):
+    """Sessions of cache/cookie.txt and cache/sessions/*.txt
+
+    Only the given names are used if names is not empty, a name without a
+    cookie file yet is a new account to login.
+    """
+
+    default_name = "default"
+
+    def __init__(self, cache_dir, names=None, rate=0, burst=1, ttl=3600):
+        self._sessions = []
+        session_dir = os.path.join(cache_dir, "sessions")
+        paths = {self.__class__.default_name: os.path.join(cache_dir, "cookie.txt")}
+        if os.path.isdir(session_dir):
+            for it in sorted(os.listdir(session_dir)):
+                if it.endswith(".txt"):
+                    paths[it[:-4]] = os.path.join(session_dir, it)
+        for name in names or ():
+            if name not in paths:
+                paths[name] = os.path.join(
+                    session_dir, "%s.txt" % utils.format_filename(name)
+                )
+        for name, path in paths.items():
+            if names and name not in names:
+                continue
+            self._sessions.append(Session(name, path, rate, burst, ttl))
+
+    def __iter__(self):
+        return iter(self._sessions)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def acquire(self):
+        """Pick a healthy session, preferring ones no other process is using
+
+        The picked session is locked if possible, it is shared with other
+        processes only when every healthy session is locked elsewhere.
+        """
+        healthy = [it for it in self._sessions if it.healthy]
+        if not healthy:
+            raise utils.NoHealthySessionError(
+                "No healthy session in %s"
+                % ", ".join("%s(%s)" % (it.name, it.status) for it in self._sessions)
+            )
+        for session in sorted(healthy, key=lambda it: it.get_delay()):
+            if session.lock():
+                return session
+        return min(healthy, key=lambda it: it.get_delay())
+
+    def release(self, session):
+        session.unlock()
+
+    def summary(self):
+        return [it.summary() for it in self._sessions]
@@ -1,8 +1,13 @@
+import asyncio
+import functools
 import hashlib
+import io
 import logging
+import os
 import random
-
-import aiohttp
+import shutil
+import sys
+import tempfile
 
 
 class ChromeNotInstalledError(Exception):
@@ -21,57 +26,117 @@ class InvalidUserError(RuntimeError):
     pass
 
 
+class NoHealthySessionError(RuntimeError):
+    pass
+
+
 def generate_user_agent():
     user_agent_tmpl = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/%d.0.0.0 Safari/537.36"
     return user_agent_tmpl % random.randint(90, 130)
 
 
+_sessions = {}
+
+
+def get_session():
+    """Return the http session shared by all fetches of current event loop"""
+    import aiohttp
+
+    loop = asyncio.get_event_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        # cookies are always passed explicitly in headers
+        session = aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar())
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    session = _sessions.pop(asyncio.get_event_loop(), None)
+    if session:
+        await session.close()
+
+
 async def fetch(url, method="GET", headers=None, data=None, respond_with_headers=False):
     headers = headers or {}
     headers.pop("sec-ch-ua", None)
     headers.pop("sec-ch-ua-platform", None)
-    async with aiohttp.ClientSession() as session:
-        method = getattr(session, method.lower())
-        if data and not isinstance(data, bytes):
-            data = data.encode("utf-8")
+    session = get_session()
+    method = getattr(session, method.lower())
+    if data and not isinstance(data, bytes):
+        data = data.encode("utf-8")
 
-        for _ in range(3):
-            try:
-                async with method(url, headers=headers, data=data) as response:
-                    #response.raise_for_status()
-                    result = await response.read()
-                    if respond_with_headers:
-                        return response.status, response.headers, result
-                    else:
-                        return result
-            except:
-                logging.exception("Fetch url %s failed" % url)
-        else:
-            raise RuntimeError("Fetch url %s failed" % url)
-
-
-async def get_book_list(book_list_id):
+    for _ in range(3):
+        try:
+            async with method(url, headers=headers, data=data) as response:
+                #response.raise_for_status()
+                result = await response.read()
+                if respond_with_headers:
+                    return response.status, response.headers, result
+                else:
+                    return result
+        except:
+            logging.exception("Fetch url %s failed" % url)
+    else:
+        raise RuntimeError("Fetch url %s failed" % url)
+
+
+def _find_container(data, key):
+    """Return the first dict in data containing key, breadth first"""
+    queue = [data]
+    while queue:
+        item = queue.pop(0)
+        if isinstance(item, dict):
+            if key in item:
+                return item
+            queue.extend(item.values())
+        elif isinstance(item, list):
+            queue.extend(item)
+    return None
+
+
+def parse_book_list(html):
+    """Parse books in a booklist page, return (books, has_more)"""
+    from . import nuxt
+
+    try:
+        state = nuxt.extract_nuxt_state(html)
+    except nuxt.NuxtParseError as ex:
+        raise RuntimeError("Unexpected booklist html: %s" % ex)
+    container = _find_container(state, "bookEntities")
+    if container is None:
+        raise RuntimeError("bookEntities not found in booklist page")
+    book_list = []
+    for key, entity in (container["bookEntities"] or {}).items():
+        if not isinstance(entity, dict):
+            continue
+        book_id = str(entity.get("bookId") or key)
+        book_list.append(
+            {
+                "id": wr_hash(book_id),
+                "book_id": book_id,
+                "title": entity.get("title"),
+                "author": entity.get("author"),
+                "cover": entity.get("cover"),
+            }
+        )
+    return book_list, bool(container.get("hasMore"))
+
+
+async def get_book_list(book_list_id, root_url="https://weread.qq.com"):
+    url = root_url + "/misc/booklist/" + book_list_id
     book_list = []
-    url = "https://weread.qq.com/misc/booklist/" + book_list_id
-    html = await fetch(url)
-    html = html.decode()
-    pos = html.find("window.__NUXT__")
-    if pos <= 0:
-        raise RuntimeError("Unexpected html: %s" % html)
-    pos = html.find("bookEntities:", pos)
+    book_ids = set()
+    page_url = url
     while True:
-        if book_list:
-            pos = html.find('},"', pos)
-            if pos < 0:
-                break
-        pos = html.find('"', pos)
-        pos1 = html.find('"', pos + 1)
-        book_id = html[pos + 1 : pos1]
-        pos = html.find("title:", pos)
-        pos = html.find('"', pos)
-        pos1 = html.find('"', pos + 1)
-        title = html[pos + 1 : pos1]
-        book_list.append({"id": wr_hash(book_id), "title": title})
+        html = (await fetch(page_url)).decode()
+        books, has_more = parse_book_list(html)
+        books = [it for it in books if it["id"] not in book_ids]
+        book_list.extend(books)
+        book_ids.update(it["id"] for it in books)
+        if not has_more or not books:
+            break
+        page_url = "%s?offset=%d" % (url, len(book_list))
     return book_list
 
 
@@ -87,6 +152,7 @@ def md5(s):
     return hashlib.md5(s).hexdigest()
 
 
+@functools.lru_cache(maxsize=4096)
 def wr_hash(s):
     hash = md5(s)
     result = hash[:3] + "32" + hash[-2:]
@@ -108,6 +174,134 @@ def wr_hash(s):
     return result
 
 
+_umask = None
+
+
+def get_file_mode(path):
+    """Mode of path if it exists, otherwise mode of a newly created file"""
+    global _umask
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        pass
+    if _umask is None:
+        _umask = os.umask(0o022)
+        os.umask(_umask)
+    return 0o666 & ~_umask
+
+
+def make_temp_file(path):
+    """Create a temp file next to path to be renamed over it, return (fd, path)
+
+    mkstemp creates files readable only by owner, the temp file gets the mode
+    of path instead, or the mode a new file would have.
+    """
+    dirpath = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".%s." % os.path.basename(path), suffix=".tmp", dir=dirpath
+    )
+    try:
+        os.chmod(tmp_path, get_file_mode(path))
+    except:
+        os.close(fd)
+        os.remove(tmp_path)
+        raise
+    return fd, tmp_path
+
+
+def atomic_write(path, data):
+    """Write data to a temp file in the same directory, then rename it over path"""
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    fd, tmp_path = make_temp_file(path)
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def try_lock_file(path):
+    """Take an exclusive lock on path without blocking, return None if locked
+
+    A lock file may be removed by its holder, the lock taken on a removed
+    file is stale and path is opened again.
+    """
+    while True:
+        fp = open(path, "a+")
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+                return fp
+            import fcntl
+
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fp.close()
+            return None
+        try:
+            if os.path.samestat(os.fstat(fp.fileno()), os.stat(path)):
+                return fp
+        except FileNotFoundError:
+            pass
+        unlock_file(fp)
+
+
+def unlock_file(fp):
+    if sys.platform == "win32":
+        import msvcrt
+
+        fp.seek(0)
+        msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+    fp.close()
+
+
+def copy_stream(src, dst, chunk_size=1024 * 1024):
+    """Copy file object src to dst, with sendfile if both are plain files"""
+    if (
+        hasattr(os, "sendfile")
+        and type(src) is io.BufferedReader
+        and type(dst) is io.BufferedWriter
+    ):
+        dst.flush()
+        offset = start = src.tell()
+        while True:
+            try:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, chunk_size)
+            except OSError:
+                if offset != start:
+                    raise
+                # sendfile between files is not supported, e.g. on macos
+                break
+            if not sent:
+                dst.seek(0, os.SEEK_END)
+                return
+            offset += sent
+    shutil.copyfileobj(src, dst, chunk_size)
+
+
+def get_dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for it in files:
+            try:
+                total += os.path.getsize(os.path.join(root, it))
+            except OSError:
+                pass
+    return total
+
+
 def save_to_png(img_path, png_path):
     from PIL import Image
 
@@ -6,14 +6,62 @@ import asyncio
 import json
 import logging
 import os
-import random
 import sys
 import time
 import urllib.parse
 
 import pyppeteer
 
-from . import utils
+from . import browser_profile, compression, fileio, interception, utils
+from .metrics import Metrics
+
+
+def is_soldout(html):
+    return '"soldout":1' in html
+
+
+def make_chapter_urls(root_url, book_id, chapter_ids):
+    """Return reader urls of chapters"""
+    prefix = "%s/web/reader/%sk" % (root_url, book_id)
+    return [prefix + utils.wr_hash(str(chapter_id)) for chapter_id in chapter_ids]
+
+
+def parse_book_info(html, book_id=None, root_url=None):
+    """Parse book meta data from book detail html
+
+    Reader urls of chapters are added when book_id and root_url are given.
+    """
+    pos1 = html.find("window.__INITIAL_STATE__")
+    if pos1 <= 0:
+        raise RuntimeError("Unexpected html: %s" % html)
+    pos1 = html.find("=", pos1)
+    pos2 = html.find("};", pos1)
+    data = html[pos1 + 1 : pos2 + 1].strip()
+    data = json.loads(data)
+    book_info = {}
+    book_info["title"] = data["reader"]["bookInfo"]["title"]
+    book_info["author"] = data["reader"]["bookInfo"]["author"]
+    book_info["cover"] = data["reader"]["bookInfo"]["cover"]
+    book_info["intro"] = data["reader"]["bookInfo"]["intro"]
+    book_info["chapters"] = []
+    for chapter in data["reader"]["chapterInfos"]:
+        chap = {
+            "id": chapter["chapterUid"],
+            "title": chapter["title"],
+            "level": chapter["level"],
+            "words": chapter["wordCount"],
+            "anchors": [],
+        }
+        if chapter["anchors"]:
+            for it in chapter["anchors"]:
+                chap["anchors"].append({"title": it["title"], "level": it["level"]})
+        book_info["chapters"].append(chap)
+    if book_id and root_url:
+        chapters = book_info["chapters"]
+        urls = make_chapter_urls(root_url, book_id, [it["id"] for it in chapters])
+        for chapter, url in zip(chapters, urls):
+            chapter["url"] = url
+    return book_info
 
 
 class WeReadWebPage(object):
@@ -21,10 +69,35 @@ class WeReadWebPage(object):
 
     root_url = "https://weread.qq.com"
     window_size = (1920, 1080)
-
-    def __init__(self, book_id, cookie_path=None, webcache_path=None):
+    # Chrome args of the capture-only launch profile. Window size is kept, the
+    # reader paginates and positions elements by it
+    capture_only_args = (
+        "--disable-gpu",
+        "--disable-smooth-scrolling",
+        "--force-prefers-reduced-motion",
+        "--blink-settings=imagesEnabled=false",
+    )
+    # With prefetch one of the two tabs is always in background, chrome must
+    # not throttle its timers and rendering
+    prefetch_args = (
+        "--disable-background-timer-throttling",
+        "--disable-renderer-backgrounding",
+        "--disable-backgrounding-occluded-windows",
+    )
+
+    def __init__(
+        self,
+        book_id,
+        cookie_path=None,
+        webcache_path=None,
+        rules=None,
+        metrics=None,
+        compression_policy=None,
+        session=None,
+    ):
         self._book_id = book_id
-        self._cookie_path = cookie_path
+        self._session = session
+        self._cookie_path = cookie_path or (session and session.cookie_path)
         self._cookie = {}
         self._webcache_path = webcache_path or "cache"
         if not os.path.isdir(self._webcache_path):
@@ -36,37 +109,42 @@ class WeReadWebPage(object):
         self._chapter_root_url = self.__class__.root_url + "/web/reader/"
         self._browser = None
         self._page = None
+        self._forked = False
+        self._profile = None
+        self._rules = rules or interception.RuleTable()
+        self._request_stats = interception.RequestStats()
+        self._metrics = metrics or Metrics()
+        self._compression = compression_policy or compression.CompressionPolicy()
+        self._hook_script = None
+        self._js_profiler = None
+        self._interception = interception.InterceptionManager(self._handle_request)
         self._load_cookie()
         self._url = ""
 
+    @property
+    def launched(self):
+        return self._browser is not None
+
+    @property
+    def session(self):
+        return self._session
+
+    def switch_book(self, book_id, metrics=None):
+        """Reuse this page, and its launched browser, for another book"""
+        self._book_id = book_id
+        self._home_url = "%s/web/bookDetail/%s" % (
+            self.__class__.root_url,
+            book_id,
+        )
+        if metrics:
+            self._metrics = metrics
+
     async def get_book_info(self):
-        html = (await utils.fetch(self._home_url)).decode()
-        pos1 = html.find("window.__INITIAL_STATE__")
-        if pos1 <= 0:
-            raise RuntimeError("Unexpected html: %s" % self._html)
-        pos1 = html.find("=", pos1)
-        pos2 = html.find("};", pos1)
-        data = html[pos1 + 1 : pos2 + 1].strip()
-        data = json.loads(data)
-        book_info = {}
-        book_info["title"] = data["reader"]["bookInfo"]["title"]
-        book_info["author"] = data["reader"]["bookInfo"]["author"]
-        book_info["cover"] = data["reader"]["bookInfo"]["cover"]
-        book_info["intro"] = data["reader"]["bookInfo"]["intro"]
-        book_info["chapters"] = []
-        for chapter in data["reader"]["chapterInfos"]:
-            chap = {
-                "id": chapter["chapterUid"],
-                "title": chapter["title"],
-                "level": chapter["level"],
-                "words": chapter["wordCount"],
-                "anchors": [],
-            }
-            if chapter["anchors"]:
-                for it in chapter["anchors"]:
-                    chap["anchors"].append({"title": it["title"], "level": it["level"]})
-            book_info["chapters"].append(chap)
-        return book_info
+        return parse_book_info(
+            (await utils.fetch(self._home_url)).decode(),
+            self._book_id,
+            self.__class__.root_url,
+        )
 
     async def get_user_info(self):
         vid = self._cookie.get("wr_vid")
@@ -93,12 +171,16 @@ class WeReadWebPage(object):
                 logging.info(
                     "[%s] Update cookie %s" % (self.__class__.__name__, cookie)
                 )
-            self._save_cookie()
+            await self._save_cookie()
+            if self._session:
+                await self._session.mark_refreshed()
             headers["Cookie"] = self._format_cookie()
             rsp = await utils.fetch(url, headers=headers)
             rsp = json.loads(rsp.decode())
         elif rsp.get("errCode") == -2010:
             # 用户不存在
+            if self._session:
+                await self._session.mark_invalid("User %s not found" % vid)
             raise utils.InvalidUserError("User %s not found" % vid)
         elif rsp.get("errCode"):
             raise RuntimeError("Get user info failed: %s" % rsp)
@@ -123,11 +205,10 @@ class WeReadWebPage(object):
                 for key in cookie:
                     self._cookie[key] = cookie[key]
 
-    def _save_cookie(self):
+    async def _save_cookie(self):
         if not self._cookie_path:
             return
-        with open(self._cookie_path, "w") as fp:
-            fp.write(json.dumps(self._cookie))
+        await fileio.atomic_write(self._cookie_path, json.dumps(self._cookie))
 
     def _format_cookie(self, cookie=""):
         cookies = []
@@ -148,10 +229,7 @@ class WeReadWebPage(object):
         self._cookie = await self._read_cookie()
 
     async def check_valid(self):
-        html = await utils.fetch(self._home_url)
-        if b'"soldout":1' in html:
-            return False
-        return True
+        return not is_soldout((await utils.fetch(self._home_url)).decode())
 
     def _check_chrome(self):
         path_list = os.environ["PATH"].split(";" if sys.platform == "win32" else ":")
@@ -182,7 +260,11 @@ class WeReadWebPage(object):
         force_login=False,
         use_default_profile=False,
         mock_user_agent=False,
-        proxy_server=None
+        proxy_server=None,
+        persist_profile=True,
+        disk_cache_size=256,
+        capture_only=False,
+        prefetch=False,
     ):
         logging.info("[%s] Launch url %s" % (self.__class__.__name__, self._home_url))
         chrome = self._check_chrome()
@@ -191,10 +273,29 @@ class WeReadWebPage(object):
             args.append("--headless")
             if sys.platform == "linux" and os.getuid() == 0:
                 args.append("--no-sandbox")
+        if capture_only:
+            args.extend(self.__class__.capture_only_args)
+            for i, rule in enumerate(interception.CAPTURE_ONLY_RULES):
+                if rule not in self._rules:
+                    self._rules.insert(i, rule)
+        if prefetch:
+            args.extend(self.__class__.prefetch_args)
         if use_default_profile:
             args.append("--user-data-dir")
         else:
             args.append("--window-size=%d,%d" % self.__class__.window_size)
+            if persist_profile:
+                if self._profile:
+                    self._profile.release()
+                self._profile = browser_profile.BrowserProfile(
+                    os.path.join(self._webcache_path, "profiles"),
+                    self._cookie.get("wr_vid"),
+                    disk_cache_size=disk_cache_size,
+                )
+                # size of profiles is walked, keep it off the event loop
+                await fileio.run(self._profile.cleanup)
+                await fileio.run(self._profile.acquire)
+                args.extend(self._profile.get_chrome_args())
         if mock_user_agent:
             args.append('--user-agent="%s"' % utils.generate_user_agent())
         if proxy_server:
@@ -203,14 +304,90 @@ class WeReadWebPage(object):
         logging.info(
             "[%s] Chrome args: chrome %s" % (self.__class__.__name__, " ".join(args))
         )
-        self._browser = await pyppeteer.launch(
-            executablePath=chrome,
-            ignoreDefaultArgs=True,
-            args=args,
-            defaultViewport=None,
-            logLevel=logging.INFO,
+        check_user = None
+        if self._cookie.get("wr_vid"):
+            if self._session and self._session.verified:
+                logging.info(
+                    "[%s] Session %s was verified recently, skip checking user"
+                    % (self.__class__.__name__, self._session.name)
+                )
+            else:
+                # check user while chrome is starting
+                check_user = asyncio.ensure_future(self._check_user())
+        try:
+            self._browser = await pyppeteer.launch(
+                executablePath=chrome,
+                ignoreDefaultArgs=True,
+                args=args,
+                defaultViewport=None,
+                logLevel=logging.INFO,
+            )
+            self._page = (await self._browser.pages())[0]
+            await self._setup_page()
+            verified = check_user and await check_user
+            if check_user and not verified and self._profile:
+                # persisted profile still has cookies of the invalid user
+                await self._clear_browser_cookies()
+        finally:
+            if check_user and not check_user.done():
+                check_user.cancel()
+        if self._cookie:
+            await self._inject_cookie()
+
+        await self._page.goto(self._home_url)
+        # await self.wait_for_selector("div.readerFooter a")
+        if force_login:
+            await self.login()
+        if self._cookie:
+            try:
+                await self.wait_for_avatar()
+            except RuntimeError:
+                if self._session and check_user is None:
+                    # the skipped check trusted a broken session
+                    await self._session.invalidate_verification()
+                raise
+            if verified and self._session:
+                await self._session.mark_verified(await self._get_cookie_expires())
+        self._page.on("console", self.handle_log)
+
+    async def _check_user(self):
+        """Return True if cookie is of a valid user, clear it otherwise"""
+        try:
+            user_info = await self.get_user_info()
+        except utils.InvalidUserError as ex:
+            logging.warning("[%s] Get user error: %s" % (self.__class__.__name__, ex))
+            self._cookie = {}
+            return False
+        logging.info(
+            "[%s] Current login user is %s"
+            % (self.__class__.__name__, user_info.get("name", "Anonymous"))
         )
-        self._page = (await self._browser.pages())[0]
+        return True
+
+    async def _clear_browser_cookies(self):
+        cookies = await self._page.cookies(self.__class__.root_url)
+        if cookies:
+            logging.info(
+                "[%s] Clear %d cookies of profile %s"
+                % (self.__class__.__name__, len(cookies), self._profile.path)
+            )
+            await self._page.deleteCookie(
+                *[
+                    {"name": it["name"], "domain": it["domain"], "path": it["path"]}
+                    for it in cookies
+                ]
+            )
+
+    async def _get_cookie_expires(self):
+        """Earliest expiry time of the saved cookies, None if all are session ones"""
+        expires = [
+            it["expires"]
+            for it in await self._page.cookies(self.__class__.root_url)
+            if it["name"] in self._cookie and it.get("expires", -1) > 0
+        ]
+        return min(expires) if expires else None
+
+    async def _setup_page(self):
         await self._page.evaluateOnNewDocument(
             """() => {
             if (navigator.webdriver) {
@@ -264,34 +441,38 @@ class WeReadWebPage(object):
                 "deviceScaleFactor": 0.3,
             }
         )
-        if self._cookie.get("wr_vid"):
-            try:
-                user_info = await self.get_user_info()
-            except utils.InvalidUserError as ex:
-                logging.warning(
-                    "[%s] Get user error: %s" % (self.__class__.__name__, ex)
-                )
-                self._cookie = {}
-            else:
-                logging.info(
-                    "[%s] Current login user is %s"
-                    % (self.__class__.__name__, user_info.get("name", "Anonymous"))
-                )
-        if self._cookie:
-            await self._inject_cookie()
 
-        await self._page.goto(self._home_url)
-        # await self.wait_for_selector("div.readerFooter a")
-        if force_login:
-            await self.login()
-        if self._cookie:
-            await self.wait_for_avatar()
-        self._page.on("console", self.handle_log)
+    async def fork(self):
+        """Open another tab in the same browser, sharing cookies and cache"""
+        page = self.__class__(
+            self._book_id,
+            cookie_path=self._cookie_path,
+            webcache_path=self._webcache_path,
+            rules=self._rules,
+            metrics=self._metrics,
+            compression_policy=self._compression,
+            session=self._session,
+        )
+        page._cookie = self._cookie
+        page._browser = self._browser
+        page._forked = True
+        page._page = await self._browser.newPage()
+        await page._setup_page()
+        page._page.on("console", page.handle_log)
+        return page
 
     async def close(self):
-        if self._browser:
+        self._interception.cancel()
+        if self._forked:
+            if self._page:
+                await self._page.close()
+            self._browser = self._page = None
+        elif self._browser:
             await self._browser.close()
             self._browser = self._page = None
+        if self._profile:
+            self._profile.release()
+            self._profile = None
 
     async def get_html(self):
         return await self._page.evaluate("document.documentElement.outerHTML;")
@@ -303,37 +484,43 @@ class WeReadWebPage(object):
         try:
             return await self._page.waitForSelector(selector, timeout=timeout)
         except pyppeteer.errors.TimeoutError as ex:
-            html = await self.get_html()
-            html_path = "webpage.html"
-            with open(html_path, "wb") as fp:
-                if not isinstance(html, bytes):
-                    html = html.encode("utf8")
-                fp.write(html)
-            logging.info(
-                "[%s] Current html saved to %s" % (self.__class__.__name__, html_path)
-            )
-            screenshot_path = "screenshot.jpg"
-            await self.screenshot(screenshot_path)
-            logging.info(
-                "[%s] Current screenshot saved to %s"
-                % (self.__class__.__name__, screenshot_path)
-            )
+            await self._save_snapshot()
             raise ex
 
+    async def _save_snapshot(self):
+        """Save current html and screenshot for debugging"""
+        html = await self.get_html()
+        html_path = "webpage.html"
+        with open(html_path, "wb") as fp:
+            if not isinstance(html, bytes):
+                html = html.encode("utf8")
+            fp.write(html)
+        logging.info(
+            "[%s] Current html saved to %s" % (self.__class__.__name__, html_path)
+        )
+        screenshot_path = "screenshot.jpg"
+        await self.screenshot(screenshot_path)
+        logging.info(
+            "[%s] Current screenshot saved to %s"
+            % (self.__class__.__name__, screenshot_path)
+        )
+
     def handle_log(self, message):
-        with open("%s.log" % self._book_id, "a+", encoding="utf-8") as fp:
-            fp.write("[%s] %s\n" % (self._url, message.text))
+        fileio.append_text(
+            "%s.log" % self._book_id, "[%s] %s\n" % (self._url, message.text)
+        )
 
     async def wait_for_avatar(self, timeout=30):
-        time0 = time.time()
-        while time.time() - time0 < timeout:
-            avatar_url = await self._page.evaluate(
-                "document.querySelector('img.wr_avatar_img') && document.querySelector('img.wr_avatar_img').getAttribute('src');"
+        """Wait until the avatar is not the default one, checked on DOM changes"""
+        script = """() => {
+            var img = document.querySelector('img.wr_avatar_img');
+            return !img || !(img.getAttribute('src') || '').endsWith('Default.svg');
+        }"""
+        try:
+            await self._page.waitForFunction(
+                script, {"polling": "mutation", "timeout": timeout * 1000}
             )
-            if avatar_url is None or not avatar_url.endswith("Default.svg"):
-                break
-            await asyncio.sleep(5)
-        else:
+        except pyppeteer.errors.TimeoutError:
             raise RuntimeError("Wait for avatar timeout")
 
     async def _inject_cookie(self):
@@ -377,7 +564,7 @@ class WeReadWebPage(object):
                     continue
                 logging.info("[%s] Login success" % self.__class__.__name__)
                 await self._update_cookie()
-                self._save_cookie()
+                await self._save_cookie()
                 return True
             else:
                 raise RuntimeError("Login timeout")
@@ -388,24 +575,35 @@ class WeReadWebPage(object):
         path = os.path.join(
             self._webcache_path, "resources", u.path[1:].replace("/", os.sep)
         )
-        if os.path.isfile(path):
-            with open(path, "rb") as fp:
-                return 200, {}, fp.read()
+        body = await fileio.read_file(path)
+        if body is not None:
+            self._count_request("resource", "cache-hit", "resource")
+            self._metrics.incr("resource_cache_hits")
+            return 200, {}, body
 
-        dirpath = os.path.dirname(path)
-        if not os.path.isdir(dirpath):
-            os.makedirs(dirpath)
         status, headers, body = await utils.fetch(
             url, headers=headers, respond_with_headers=True
         )
+        self._count_request("resource", "cache-miss", "resource", len(body))
+        self._metrics.incr("resource_cache_misses")
         if status == 200:
-            with open(path, "wb") as fp:
-                fp.write(body)
+            # respond without waiting for the disk
+            fileio.submit(self._save_resource, path, body)
         return status, headers, body
 
-    def _handle_request_headers(self, url, headers):
+    def _save_resource(self, path, body):
+        dirpath = os.path.dirname(path)
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        codec = self._compression.get_codec_for_path(path)
+        compression.write_file(path, body, codec)
+
+    def _handle_request_headers(self, url, headers, with_cookie=True):
         for key in ("baggage", "sentry-trace"):
             headers.pop(key, None)
+        if not with_cookie:
+            # chrome sends cookies from its own cookie jar
+            return headers
         cookie = ""
         if "/web/reader/" in url:
             cookie = "wr_useHorizonReader=0"
@@ -427,79 +625,58 @@ class WeReadWebPage(object):
             return body.replace(b"</head>", inject_script.encode() + b"</head>")
         return body
 
-    async def _handle_request(self, request):
-        if request.url.startswith("chrome-extension://"):
-            return await request.continue_()
-
-        if "/web/1.392ec47a.js" in request.url:
+    def _load_hook_script(self):
+        if self._hook_script is None:
             with open(
                 os.path.join(os.path.dirname(os.path.abspath(__file__)), "hook.js"),
                 "rb",
             ) as fp:
-                hook_script = fp.read()
-                response = {
-                    "status": 200,
-                    "headers": {"Content-Type": "application/json"},
-                    "body": hook_script,
-                }
-                return await request.respond(response)
+                self._hook_script = fp.read()
+        return self._hook_script
 
-        urlobj = urllib.parse.urlparse(request.url)
-        is_resource_file = urlobj.path.endswith(
-            (".js", ".css", ".jpg", ".png", ".gif", ".svg")
-        )
-        status = 200
-        headers = {
-            "Server": "nginx/1.20.2",
-        }
-        body = b""
-        if request.method == "OPTIONS":
-            headers = {
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Request-Method": "*",
-                "Access-Control-Allow-Headers": "*",
-            }
-        elif request.method == "GET" and is_resource_file:
-            status, headers, body = await self._get_from_cache_or_server(request.url)
-        elif "/web/book/read" in request.url:
-            body = b'{"succ":1,"synckey":%d}' % random.randint(10000000, 100000000)
-            headers["Content-Type"] = "application/json; charset=utf-8"
-            headers["Content-Length"] = str(len(body))
-            logging.info(
-                "[%s][%s] Url %s return mock data"
-                % (self.__class__.__name__, request.method, request.url)
-            )
-        elif "sentry_key=" in request.url:
-            status = 200
-            headers["Content-Type"] = "application/json; charset=utf-8"
-            headers["Content-Length"] = str(len(body))
-            body = b"{}"
-            logging.info(
-                "[%s][%s] Url %s return mock data"
-                % (self.__class__.__name__, request.method, request.url)
+    async def _handle_request(self, request):
+        rule = self._rules.match(request.url, request.resourceType, request.method)
+        if rule:
+            rule_name, action = rule.name, rule.action
+        else:
+            rule_name, action = "default", interception.ACTION_PASSTHROUGH
+
+        if action == interception.ACTION_CONTINUE:
+            self._count_request(rule_name, action, request.resourceType)
+            return await request.continue_()
+        elif action == interception.ACTION_PASSTHROUGH:
+            self._count_request(rule_name, action, request.resourceType)
+            headers = self._handle_request_headers(
+                request.url, dict(request.headers), with_cookie=False
             )
-        elif "/hera/logkv" in request.url or "/hera/osslog" in request.url:
-            status = 204
-        elif "/hera/chlog" in request.url:
-            body = b'{"ret":0}'
-            headers["Content-Type"] = "application/json; charset=utf-8"
-            headers["Content-Length"] = str(len(body))
-            logging.info(
-                "[%s][%s] Url %s return mock data"
-                % (self.__class__.__name__, request.method, request.url)
+            return await request.continue_({"headers": headers})
+        elif action == interception.ACTION_BLOCK:
+            self._count_request(rule_name, action, request.resourceType)
+            logging.debug(
+                "[%s][%s] Url %s is blocked by rule %s"
+                % (self.__class__.__name__, request.method, request.url, rule_name)
             )
-        elif "hijack_csp_report" in request.url:
-            return
-        elif "/river/single" in request.url:
-            body = b'{"err_code":0,"msg":"suc"}'
-            headers["Content-Type"] = "application/json; charset=utf-8"
-            headers["Content-Length"] = len(body)
-            logging.info(
+            return await request.abort()
+        elif action == interception.ACTION_HOOK:
+            self._count_request(rule_name, action, request.resourceType)
+            response = {
+                "status": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": self._load_hook_script(),
+            }
+            return await request.respond(response)
+
+        if action == interception.ACTION_MOCK:
+            status, headers, body = rule.make_response()
+            self._count_request(rule_name, action, request.resourceType)
+            logging.debug(
                 "[%s][%s] Url %s return mock data"
                 % (self.__class__.__name__, request.method, request.url)
             )
+        elif action == interception.ACTION_CACHE:
+            status, headers, body = await self._get_from_cache_or_server(request.url)
         else:
-            logging.info(
+            logging.debug(
                 "[%s][%s] Fetch url %s"
                 % (self.__class__.__name__, request.method, request.url)
             )
@@ -513,7 +690,7 @@ class WeReadWebPage(object):
                 respond_with_headers=True,
             )
             headers = dict(headers)
-            logging.info(
+            logging.debug(
                 "[%s][%s][%.2f] Url %s return %d, body len is %d"
                 % (
                     self.__class__.__name__,
@@ -525,7 +702,7 @@ class WeReadWebPage(object):
                 )
             )
             if "Content-Security-Policy" in headers:
-                logging.info(
+                logging.debug(
                     "[%s][%s] Url %s has Content-Security-Policy: %s"
                     % (
                         self.__class__.__name__,
@@ -535,6 +712,7 @@ class WeReadWebPage(object):
                     )
                 )
                 headers.pop("Content-Security-Policy")
+            self._count_request(rule_name, action, request.resourceType, len(body))
 
         headers = self._handle_response_headers(request.url, headers)
         response = {
@@ -544,12 +722,25 @@ class WeReadWebPage(object):
         }
         return await request.respond(response)
 
-    def handle_request(self, request):
-        asyncio.ensure_future(self._handle_request(request))
+    def _count_request(self, rule_name, action, resource_type, size=0):
+        self._request_stats.add(rule_name, action, resource_type, size)
+        self._metrics.incr(
+            "intercepted_requests",
+            action=action,
+            resource_type=resource_type or "other",
+        )
+        if size:
+            self._metrics.incr("fetched_bytes", size)
+
+    def get_request_stats(self):
+        return self._request_stats.summary()
+
+    def get_interception_stats(self):
+        return self._interception.summary()
 
     async def pre_load_page(self):
-        await self._page.setRequestInterception(True)
-        self._page.on("request", self.handle_request)
+        """Intercept requests of current page, only once per page"""
+        await self._interception.attach(self._page)
 
     async def get_markdown(self):
         script = "canvasContextHandler.data.complete;"
@@ -568,51 +759,85 @@ class WeReadWebPage(object):
                 raise RuntimeError("Wait for creating markdown timeout")
         return result
 
-    async def _check_next_page(self):
-        while True:
-            try:
-                await self.wait_for_selector(
-                    "button.readerFooter_button", timeout=60000
-                )
-            except pyppeteer.errors.TimeoutError:
-                logging.info("[%s] load selector timeout " % self.__class__.__name__)
-                break
-            result = await self._page.evaluate(
-                "document.getElementsByClassName('readerFooter_button')[0].innerText;"
+    async def _check_next_page(self, timeout=60, render_timeout=10):
+        """Turn pages in the reader until the end of current chapter"""
+        result = await self._page.evaluate(
+            "canvasContextHandler.turnPages(%d, %d);"
+            % (timeout * 1000, render_timeout * 1000)
+        )
+        if result["pages"]:
+            logging.info(
+                "[%s] Turned %d pages" % (self.__class__.__name__, result["pages"])
             )
-            if result == "下一页":
-                logging.info("[%s] Go to next page" % self.__class__.__name__)
-                await self._page.evaluate(
-                    r"canvasContextHandler.data.markdown += '\n\n';"
-                )
-                await self.pre_load_page()
-                await self._page.click("button.readerFooter_button")
-                await asyncio.sleep(1)
-            elif result == "下一章":
-                break
-            elif result.startswith("登录"):
-                raise utils.LoginRequiredError()
-            else:
-                raise NotImplementedError(result)
+            self._metrics.incr("next_page_clicks", result["pages"])
+        button = result["button"]
+        if button is None:
+            logging.info("[%s] load selector timeout " % self.__class__.__name__)
+            await self._save_snapshot()
+        elif button == "下一章":
+            return
+        elif button.startswith("登录"):
+            raise utils.LoginRequiredError()
+        else:
+            raise NotImplementedError(button)
 
-    def _get_chapter_url(self, chapter_id):
-        return "%s%sk%s" % (
-            self._chapter_root_url,
-            self._book_id,
-            utils.wr_hash(str(chapter_id)),
-        )
+    def get_chapter_urls(self, chapter_ids):
+        return make_chapter_urls(self.__class__.root_url, self._book_id, chapter_ids)
 
-    async def goto_chapter(self, chapter_id, timeout=120):
+    async def goto_chapter(self, chapter_id, timeout=120, url=None):
         logging.info("[%s] Go to chapter %s" % (self.__class__.__name__, chapter_id))
+        if self._session:
+            await self._session.wait()
         # await self.clear_cache()
         await self.pre_load_page()
-        self._url = self._get_chapter_url(chapter_id)
+        self._url = url or self.get_chapter_urls([chapter_id])[0]
+        cancelled = self._interception.cancel()
+        if cancelled:
+            self._metrics.incr("cancelled_requests", cancelled)
+        self._request_stats.reset()
+        self._metrics.incr("page_loads")
+        time0 = time.time()
         await self._page.goto(self._url, timeout=1000 * timeout)
         try:
             await self._check_next_page()
         except utils.LoginRequiredError:
-            await self.login()
-            return await self.goto_chapter(chapter_id, timeout=timeout)
+            if self._session:
+                await self._session.invalidate_verification()
+            try:
+                await self.login()
+            except RuntimeError as ex:
+                if self._session:
+                    await self._session.mark_login_required(str(ex))
+                raise utils.LoginRequiredError(str(ex))
+            return await self.goto_chapter(chapter_id, timeout=timeout, url=url)
+        self._metrics.observe("page_load_seconds", time.time() - time0)
+        logging.info(
+            "[%s] Chapter %s requests: %s, tasks: %s"
+            % (
+                self.__class__.__name__,
+                chapter_id,
+                json.dumps(self._request_stats.summary()),
+                json.dumps(self._interception.summary()),
+            )
+        )
+
+    async def start_js_profiler(self, interval=100):
+        """Start CDP cpu profiler of current page, interval is in microseconds"""
+        self._js_profiler = await self._page.target.createCDPSession()
+        await self._js_profiler.send("Profiler.enable")
+        await self._js_profiler.send("Profiler.setSamplingInterval", {"interval": interval})
+        await self._js_profiler.send("Profiler.start")
+
+    async def stop_js_profiler(self, save_path):
+        if not self._js_profiler:
+            return
+        result = await self._js_profiler.send("Profiler.stop")
+        await self._js_profiler.detach()
+        self._js_profiler = None
+        await fileio.atomic_write(save_path, json.dumps(result["profile"]))
+        logging.info(
+            "[%s] JS profile saved to %s" % (self.__class__.__name__, save_path)
+        )
 
     async def clear_cache(self):
         await self._page.evaluate("canvasContextHandler.clearCanvasCache();")